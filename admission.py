@@ -0,0 +1,140 @@
+import queue
+import threading
+
+OVERLOADED_RESPONSE = (
+    b"HTTP/1.1 503 Service Unavailable\r\n"
+    b"Retry-After: 1\r\n"
+    b"Content-Type: text/plain\r\n"
+    b"Content-Length: 28\r\n"
+    b"Connection: close\r\n\r\n"
+    b"Proxy overloaded, try again\n"
+)
+
+
+class AdmissionController:
+    """Caps the connections in the proxy globally and per client IP.
+
+    A connection is admitted when it is accepted and released when its
+    handler finishes, so queued connections count against the limits too.
+    Rejected connections are counted by reason ('global' or 'client').
+    A limit of 0 means unlimited.
+    """
+
+    def __init__(self, max_connections=0, max_per_client=0):
+        self.max_connections = max_connections
+        self.max_per_client = max_per_client
+        self.active = 0
+        self.per_client = {}
+        self.shed = {'global': 0, 'client': 0}
+        self.lock = threading.Lock()
+
+    def admit(self, client_ip):
+        """Reserve a slot for a new connection; False if it must be shed"""
+        with self.lock:
+            if self.max_connections and self.active >= self.max_connections:
+                self.shed['global'] += 1
+                return False
+            count = self.per_client.get(client_ip, 0)
+            if self.max_per_client and count >= self.max_per_client:
+                self.shed['client'] += 1
+                return False
+            self.active += 1
+            self.per_client[client_ip] = count + 1
+            return True
+
+    def release(self, client_ip):
+        with self.lock:
+            self.active -= 1
+            count = self.per_client.get(client_ip, 1) - 1
+            if count:
+                self.per_client[client_ip] = count
+            else:
+                self.per_client.pop(client_ip, None)
+
+    def record_shed(self, reason):
+        """Count a connection that was admitted but could not be served after all"""
+        with self.lock:
+            self.shed[reason] += 1
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'connections_active': self.active,
+                'connections_shed': sum(self.shed.values()),
+                'connections_shed_global': self.shed['global'],
+                'connections_shed_client': self.shed['client']
+            }
+
+
+def reject(client_socket):
+    """Answer an overloaded connection with 503 without ever blocking the accept loop"""
+    try:
+        client_socket.setblocking(False)
+        # Read what the client already sent so close() does not reset the connection
+        client_socket.recv(65536)
+    except OSError:
+        pass
+    try:
+        client_socket.send(OVERLOADED_RESPONSE)
+    except OSError:
+        pass
+    client_socket.close()
+
+
+class HandlerPool:
+    """At most max_threads handler threads fed from a bounded queue.
+
+    Threads are started on demand up to the limit (0 = no limit) and then
+    kept for reuse. Every submitted item reserves an idle thread, or starts
+    one, so a burst never waits behind long-running handlers while the pool
+    could still grow.
+    submit() never blocks: when the queue is full it returns False so the
+    caller can shed the connection instead of piling up work.
+    """
+
+    def __init__(self, handler, max_threads, queue_size, name='proxy-handler'):
+        self.handler = handler
+        self.max_threads = max_threads
+        self.name = name
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.threads = 0
+        # Threads waiting for work that no queued item has claimed yet
+        self.idle = 0
+        # Queued items that found no thread to claim and wait for one to finish
+        self.unclaimed = 0
+        self.lock = threading.Lock()
+
+    def submit(self, *args):
+        with self.lock:
+            try:
+                self.queue.put_nowait(args)
+            except queue.Full:
+                return False
+            if self.idle:
+                self.idle -= 1
+            elif not self.max_threads or self.threads < self.max_threads:
+                self.threads += 1
+                threading.Thread(target=self._run, name=self.name, daemon=True).start()
+            else:
+                self.unclaimed += 1
+        return True
+
+    def _run(self):
+        while True:
+            args = self.queue.get()
+            try:
+                self.handler(*args)
+            finally:
+                with self.lock:
+                    if self.unclaimed:
+                        self.unclaimed -= 1
+                    else:
+                        self.idle += 1
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'handler_threads': self.threads,
+                'handler_threads_busy': self.threads - self.idle,
+                'handler_queue_depth': self.queue.qsize()
+            }
@@ -0,0 +1,538 @@
+import asyncio
+import functools
+import time
+
+import config
+from admission import OVERLOADED_RESPONSE, AdmissionController
+from blocklist import describe_match
+from collapsing import CollapsedRequestError
+from http_cache import CACHEABLE_STATUS
+from http_parser import (HTTPParseError, error_response, hop_by_hop_headers, parse_request,
+                         parse_response_head, request_framing, request_target, set_headers,
+                         set_request_line)
+from http_relay import (CONTINUE_RESPONSE, MAX_HEAD_SIZE, BodyFramer, FramingError, HTTPRelayError,
+                        is_interim, response_framing)
+from proxy_server import HTTPProxyServer, logger
+
+FORBIDDEN_RESPONSE = "HTTP/1.1 403 Forbidden\r\n\r\n🚫 This website is blocked.".encode()
+
+
+class AsyncHTTPProxyServer(HTTPProxyServer):
+    """Proxy engine that runs every connection on one asyncio event loop.
+
+    Shares the block list, access log writer and response cache with the
+    threaded HTTPProxyServer, but an open CONNECT tunnel costs two coroutines
+    instead of an OS thread. Blocking SQLite work (cache reads and writes) is
+    pushed to the default executor so it never stalls the loop.
+    """
+
+    def __init__(self, host='localhost', port=8080):
+        super().__init__(host, port)
+        self.loop = None
+        self.stopped = None
+        # Resolves once the background warm-up has loaded the block list
+        self.blocklist_loaded = None
+
+    def create_admission(self):
+        """Connection limits; the event loop has no accept queue to count"""
+        return AdmissionController(config.MAX_CONNECTIONS, config.MAX_CONNECTIONS_PER_CLIENT)
+
+    def start_server(self):
+        """Start the proxy server (blocks until stop_server has drained it)"""
+        self.ready.clear()
+        self.finished.clear()
+        self.start_error = None
+        self.connections.reset()
+        self.loop = asyncio.new_event_loop()
+        try:
+            self.loop.run_until_complete(self.serve())
+        except Exception as e:
+            self.start_error = str(e)
+            logger.error("Server error: %s", e)
+        finally:
+            self.is_running = False
+            self.loop.close()
+            self.loop = None
+            self.ready.set()
+            self.finished.set()
+
+    async def serve(self):
+        self.stopped = asyncio.Event()
+        # One executor thread waits for the warm-up on behalf of every connection
+        self.blocklist_loaded = asyncio.get_running_loop().run_in_executor(None, self.blocklist_ready.wait)
+        self.server_socket = self.open_listener()
+        server = await asyncio.start_server(
+            self.handle_connection, sock=self.server_socket,
+            backlog=config.LISTEN_BACKLOG, limit=config.MAX_REQUEST_SIZE
+        )
+        self.is_running = True
+        self.ready.set()
+        print(f"✅ Proxy server (asyncio) running on {self.host}:{self.port}")
+        await self.stopped.wait()
+
+        server.close()
+        loop = asyncio.get_running_loop()
+        # The tracker blocks while it waits, so it runs off the loop; the
+        # connections it closes are aborted back on the loop
+        await loop.run_in_executor(None, self.drain_connections)
+        handlers = asyncio.all_tasks() - {asyncio.current_task()}
+        if handlers:
+            await asyncio.wait(handlers, timeout=1)
+
+    def stop_server(self):
+        """Stop accepting, drain open connections and wait until that is done"""
+        self.is_running = False
+        loop = self.loop
+        if loop is not None and self.stopped is not None:
+            loop.call_soon_threadsafe(self.stopped.set)
+        self.finished.wait(config.DRAIN_TIMEOUT + 5)
+        self.log_writer.flush()
+        print("🛑 Proxy server stopped")
+
+    async def handle_connection(self, reader, writer):
+        """Handle client connection"""
+        client_ip = writer.get_extra_info('peername')[0]
+        if not self.admission.admit(client_ip):
+            writer.write(OVERLOADED_RESPONSE)
+            writer.close()
+            return
+        self.metrics.gauge('proxy_active_connections', 1)
+        loop = asyncio.get_running_loop()
+        self.connections.add(writer, functools.partial(loop.call_soon_threadsafe, writer.transport.abort))
+        try:
+            if not self.connections.idle(writer):
+                return
+            try:
+                head = await reader.readuntil(b'\r\n\r\n')
+            except asyncio.IncompleteReadError:
+                return
+            except asyncio.LimitOverrunError as e:
+                self.reject_request_async(writer, client_ip, HTTPParseError(str(e), 431))
+                return
+            self.connections.busy(writer)
+
+            started = time.perf_counter()
+            method, target, version, request_headers, request = parse_request(head)
+            self.metrics.observe('parse', started)
+
+            if method.upper() == 'CONNECT':
+                host, _, port = target.partition(':')
+                await self.handle_connect(reader, writer, client_ip, host, int(port) if port.isdigit() else 443)
+            else:
+                await self.handle_http(reader, writer, client_ip, method, target, version,
+                                       request, request_headers)
+        except HTTPParseError as e:
+            self.reject_request_async(writer, client_ip, e)
+        except Exception as e:
+            logger.warning("Error handling %s: %s", client_ip, e)
+        finally:
+            self.connections.remove(writer)
+            self.metrics.gauge('proxy_active_connections', -1)
+            self.admission.release(client_ip)
+            writer.close()
+
+    def reject_request_async(self, writer, client_ip, error):
+        """Answer a request that will not be forwarded and log why"""
+        logger.info("Rejected request from %s: %s", client_ip, error)
+        self.metrics.inc(f'proxy_rejected_requests_total{{status="{error.status}"}}')
+        writer.write(error_response(error.status))
+
+    async def is_blocked_async(self, host):
+        """is_blocked, waiting for a block list still being loaded without stalling the loop"""
+        if not self.blocklist_ready.is_set():
+            await asyncio.shield(self.blocklist_loaded)
+        return self.is_blocked(host)
+
+    async def wait_request_turn_async(self, client_ip, host):
+        """Hold a request back under the request rate limits; False if it must be refused"""
+        delay = self.rate_limiter.request(client_ip, host)
+        if delay is None:
+            return False
+        if delay:
+            await asyncio.sleep(delay)
+        return True
+
+    async def throttle(self, meter, amount):
+        """Charge relayed bytes to the byte limits and pause for as long as they ask"""
+        delay = meter.charge(amount)
+        if delay:
+            await asyncio.sleep(delay)
+
+    async def handle_connect(self, reader, writer, client_ip, host, port):
+        """Handle HTTPS CONNECT requests"""
+        self.metrics.inc('proxy_requests_total{kind="connect"}')
+        match = await self.is_blocked_async(host)
+        if match:
+            writer.write(b"HTTP/1.1 403 Forbidden\r\n\r\n")
+            self.metrics.inc('proxy_blocked_total')
+            self.log_access("localhost", f"https://{host}", "CONNECT", 403, 1, describe_match(match))
+            return
+        if not await self.wait_request_turn_async(client_ip, host):
+            writer.write(error_response(429))
+            self.log_access("localhost", f"https://{host}", "CONNECT", 429, 0)
+            return
+
+        try:
+            target_reader, target_writer = await self.open_upstream(host, port)
+        except (OSError, asyncio.TimeoutError):
+            writer.write(b"HTTP/1.1 502 Bad Gateway\r\n\r\n")
+            self.log_access("localhost", f"https://{host}", "CONNECT", 502, 0)
+            raise
+        writer.write(b"HTTP/1.1 200 Connection Established\r\n\r\n")
+        self.log_access("localhost", f"https://{host}", "CONNECT", 200, 0)
+
+        activity = {'last': asyncio.get_running_loop().time()}
+        meter = self.rate_limiter.meter(client_ip, host)
+        self.metrics.gauge('proxy_active_tunnels', 1)
+        try:
+            sent, received = await asyncio.gather(
+                self.pipe(reader, target_writer, activity, meter),
+                self.pipe(target_reader, writer, activity, meter)
+            )
+        finally:
+            self.metrics.gauge('proxy_active_tunnels', -1)
+            target_writer.close()
+        self.metrics.inc('proxy_bytes_total{kind="tunnel",direction="upstream"}', sent)
+        self.metrics.inc('proxy_bytes_total{kind="tunnel",direction="downstream"}', received)
+
+    async def pipe(self, reader, writer, activity, meter):
+        """Copy one direction of a tunnel until EOF or until both directions go idle.
+
+        At EOF only the write half of the other side is shut down, so the
+        opposite direction keeps flowing (as in tunnel.relay_tunnel). An idle
+        timeout or an error closes the other side, which ends both directions.
+        Reads pause while the client's or host's byte limit is used up.
+        Returns the number of bytes copied.
+        """
+        loop = asyncio.get_running_loop()
+        timeout = config.TUNNEL_IDLE_TIMEOUT
+        copied = 0
+        finished = False
+        try:
+            while True:
+                try:
+                    data = await asyncio.wait_for(reader.read(config.RELAY_BUFFER_SIZE), timeout)
+                except asyncio.TimeoutError:
+                    if loop.time() - activity['last'] >= timeout:
+                        break
+                    continue
+                if not data:
+                    finished = True
+                    break
+                activity['last'] = loop.time()
+                copied += len(data)
+                writer.write(data)
+                await writer.drain()
+                await self.throttle(meter, len(data))
+        except ConnectionError:
+            pass
+        finally:
+            if finished and writer.can_write_eof() and not writer.is_closing():
+                try:
+                    writer.write_eof()
+                except OSError:
+                    writer.close()
+            else:
+                writer.close()
+        return copied
+
+    async def open_upstream(self, host, port, **kwargs):
+        """Open a connection to an origin through the shared DNS cache"""
+        started = time.perf_counter()
+        addresses = self.resolver.resolve(host, port, wait=False)
+        if addresses is None:
+            loop = asyncio.get_running_loop()
+            addresses = await loop.run_in_executor(None, self.resolver.resolve, host, port)
+        self.metrics.observe('dns', started)
+
+        error = None
+        for address in addresses:
+            sockaddr = address[4]
+            started = time.perf_counter()
+            try:
+                connection = await asyncio.wait_for(
+                    asyncio.open_connection(sockaddr[0], sockaddr[1], **kwargs), timeout=10
+                )
+                self.metrics.observe('upstream_connect', started)
+                return connection
+            except (OSError, asyncio.TimeoutError) as e:
+                error = e
+        raise error or OSError(f"no addresses for {host}")
+
+    async def handle_http(self, reader, writer, client_ip, method, target, version, request,
+                          request_headers):
+        """Forward a plain HTTP request and stream back the response"""
+        url, host, port, path, authority = request_target(target, request_headers)
+
+        self.metrics.inc('proxy_requests_total{kind="http"}')
+        match = await self.is_blocked_async(host)
+        if match:
+            writer.write(FORBIDDEN_RESPONSE)
+            self.metrics.inc('proxy_blocked_total')
+            self.log_access(client_ip, url, method, 403, 1, describe_match(match))
+            return
+        if not await self.wait_request_turn_async(client_ip, host):
+            writer.write(error_response(429))
+            self.log_access(client_ip, url, method, 429, 0)
+            return
+        meter = self.rate_limiter.meter(client_ip, host)
+
+        loop = asyncio.get_running_loop()
+        # One request per client connection, so the upstream one is not kept either
+        upstream_headers = {'Host': authority, 'Connection': 'close'}
+        remove = hop_by_hop_headers(request_headers)
+        use_cache = config.CACHE_ENABLED and self.cache.is_cacheable_request(method, request_headers)
+        cached = None
+        if use_cache:
+            cached = await loop.run_in_executor(None, self.cache.lookup, url, request_headers)
+            if cached and self.cache.can_serve(cached, request_headers):
+                await self.send_cached_async(writer, cached, meter)
+                self.cache.record_hit(cached)
+                self.log_access(client_ip, url, method, cached.status_code, 0)
+                return
+            if cached and cached.has_validators():
+                upstream_headers.update(cached.conditional_headers())
+            else:
+                cached = None
+
+        request_framer = BodyFramer(*request_framing(request_headers))
+        # An identical request already being fetched is followed instead of fetched again
+        flight = None
+        if use_cache and request_framer.done and self.collapser.collapsible(request_headers):
+            flight, leading = self.collapser.join(url, request_headers)
+            if not leading:
+                status_code = await self.follow_async(writer, flight, url, request_headers, meter)
+                if status_code is not None:
+                    self.log_access(client_ip, url, method, status_code, 0)
+                    return
+                flight = None
+
+        if not request_framer.done and request_headers.get('expect', '').lower() == '100-continue':
+            writer.write(CONTINUE_RESPONSE)
+            remove.add('expect')
+        upstream_request = set_headers(
+            set_request_line(request, method, path, version), upstream_headers, remove
+        ).encode('iso-8859-1')
+
+        try:
+            try:
+                target_reader, target_writer = await self.open_upstream(host, port, limit=MAX_HEAD_SIZE)
+            except (OSError, asyncio.TimeoutError) as e:
+                self.bad_gateway_async(writer, client_ip, method, url, flight, e)
+                return
+            try:
+                try:
+                    target_writer.write(upstream_request)
+                    await self.relay_request_body(reader, target_writer, request_framer, meter)
+                    head = await self.read_response_head(target_reader, writer, version)
+                except (OSError, EOFError, asyncio.LimitOverrunError, HTTPRelayError) as e:
+                    self.bad_gateway_async(writer, client_ip, method, url, flight, e)
+                    return
+                status_code = await self.relay_response_async(
+                    target_reader, writer, head, method, url, request_headers, use_cache, cached, flight, meter
+                )
+            finally:
+                target_writer.close()
+        except Exception as e:
+            if flight is not None:
+                self.collapser.land(flight, e)
+            raise
+        if flight is not None:
+            self.collapser.land(flight)
+
+        self.log_access(client_ip, url, method, status_code, 0)
+
+    def bad_gateway_async(self, writer, client_ip, method, url, flight, error):
+        """Answer 502 when the origin could not be reached or sent no response (see HTTPProxyServer.bad_gateway)"""
+        logger.info("Upstream request for %s failed: %s", url, error)
+        if flight is not None:
+            self.collapser.land(flight, error)
+        writer.write(error_response(502))
+        self.log_access(client_ip, url, method, 502, 0)
+
+    async def send_cached_async(self, writer, cached, meter=None):
+        """Send a cached response; a body in a blob file goes out with the loop's sendfile"""
+        body = self.cache.open_body(cached)
+        # This engine closes the connection after one request
+        writer.write(self.client_head(cached.head, cached.headers, False))
+        if body is None:
+            writer.write(cached.body)
+            await writer.drain()
+        else:
+            with body:
+                await writer.drain()
+                await asyncio.get_running_loop().sendfile(writer.transport, body, 0, cached.body_size)
+        if meter is not None:
+            await self.throttle(meter, cached.size)
+
+    async def follow_async(self, writer, flight, url, request_headers, meter):
+        """Answer a request from an identical request's upstream fetch (see HTTPProxyServer.follow)"""
+        outcome = await flight.wait_head_async(self.collapser.timeout)
+        if outcome == 'failed':
+            return self.flight_failed_async(writer, url, CollapsedRequestError(
+                f"upstream request failed: {flight.error}"))
+        if outcome == 'refreshed':
+            loop = asyncio.get_running_loop()
+            cached = await loop.run_in_executor(None, self.cache.lookup, url, request_headers)
+            if cached and self.cache.can_serve(cached, request_headers):
+                await self.send_cached_async(writer, cached, meter)
+                self.cache.record_hit(cached)
+                self.collapser.record(True)
+                return cached.status_code
+        elif outcome == 'shared' and flight.matches(request_headers):
+            status_code = await self.send_flight_async(writer, flight, url, meter)
+            self.collapser.record(True)
+            return status_code
+        self.collapser.record(False)
+        return None
+
+    async def send_flight_async(self, writer, flight, url, meter=None):
+        """Copy a flight's shared response to a client as it arrives (see HTTPProxyServer.send_flight)"""
+        try:
+            data = await flight.read_async(0, self.collapser.timeout)
+        except CollapsedRequestError as e:
+            return self.flight_failed_async(writer, url, e)
+        status_code, response_headers = parse_response_head(flight.head)
+        started = time.perf_counter()
+        writer.write(self.client_head(flight.head, response_headers, False) + data)
+        sent = len(data)
+        while data:
+            await writer.drain()
+            if meter is not None:
+                await self.throttle(meter, len(data))
+            data = await flight.read_async(sent, self.collapser.timeout)
+            writer.write(data)
+            sent += len(data)
+        self.metrics.observe('transfer', started)
+        self.metrics.inc('proxy_bytes_total{kind="http",direction="downstream"}', len(flight.head) + sent)
+        return status_code
+
+    def flight_failed_async(self, writer, url, error):
+        """Tell a client that has received nothing yet that the fetch it waited on failed"""
+        logger.info("Shared fetch of %s failed: %s", url, error)
+        writer.write(error_response(error.status))
+        return error.status
+
+    async def fetch_shared_async(self, target_reader, framer, flight):
+        """Read a shared response body into its flight at the origin's pace; returns the error, if any"""
+        try:
+            while not framer.done:
+                data = await target_reader.read(config.RELAY_BUFFER_SIZE)
+                if not data:
+                    raise HTTPRelayError("connection closed before end of body")
+                end = framer.feed(data, 0, len(data))
+                flight.feed(data[:end] if end < len(data) else data)
+            flight.finish()
+        except Exception as e:
+            flight.fail(e)
+            return e
+        return None
+
+    async def relay_request_body(self, reader, target_writer, framer, meter):
+        """Forward the request body (Content-Length or chunked) as it arrives"""
+        while not framer.done:
+            data = await reader.read(config.RELAY_BUFFER_SIZE)
+            if not data:
+                raise HTTPRelayError("client closed inside request body")
+            try:
+                end = framer.feed(data, 0, len(data))
+            except FramingError as e:
+                raise HTTPParseError(f"invalid request body: {e}")
+            target_writer.write(data[:end] if end < len(data) else data)
+            await target_writer.drain()
+            await self.throttle(meter, end)
+
+    async def read_response_head(self, target_reader, writer, version):
+        """The origin's final response head, passing 1xx responses on to the client"""
+        started = time.perf_counter()
+        head = await target_reader.readuntil(b'\r\n\r\n')
+        while is_interim(head):
+            # 1xx responses are not for HTTP/1.0 clients
+            if version != 'HTTP/1.0':
+                writer.write(head)
+            head = await target_reader.readuntil(b'\r\n\r\n')
+        self.metrics.observe('ttfb', started)
+        return head
+
+    async def relay_response_async(self, target_reader, writer, head, method, url, request_headers,
+                                   use_cache, cached, flight=None, meter=None):
+        """Stream the origin response to the client (and a flight's followers); returns the status code.
+
+        A shared response is read into the flight by a task of its own and this
+        client reads it back like a follower (see HTTPProxyServer.relay_response).
+        """
+        status_code, response_headers = parse_response_head(head)
+        loop = asyncio.get_running_loop()
+
+        if cached is not None and status_code == 304:
+            await loop.run_in_executor(None, self.cache.refresh, cached, response_headers)
+            if flight is not None:
+                flight.refreshed()
+            self.cache.record_hit(cached, revalidated=True)
+            await self.send_cached_async(writer, cached, meter)
+            return cached.status_code
+
+        try:
+            framing, length = response_framing(method, status_code, response_headers)
+        except FramingError as e:
+            # Nothing has reached the client yet, so it can still be told
+            logger.info("Invalid response for %s: %s", url, e)
+            if flight is not None:
+                flight.fail(e)
+            writer.write(error_response(502))
+            return 502
+        framer = BodyFramer(framing, length)
+        sharing = False
+        if flight is not None:
+            sharing = framing == 'length' and length <= self.cache.max_object_size \
+                and self.cache.can_share(status_code, response_headers)
+            if sharing:
+                flight.publish(head, response_headers.get('vary', ''))
+            else:
+                flight.unshare()
+        capture = None
+        if use_cache and status_code in CACHEABLE_STATUS and \
+                (framing != 'length' or length <= self.cache.max_object_size):
+            capture = bytearray(head)
+
+        if sharing:
+            # The fetch does not wait on this client: a slow, rate-limited or
+            # vanished leader must not hold back or cut short its followers
+            fetch = asyncio.ensure_future(self.fetch_shared_async(target_reader, framer, flight))
+            try:
+                status_code = await self.send_flight_async(writer, flight, url, meter)
+            finally:
+                await asyncio.wait([fetch])
+            if fetch.result() is not None:
+                # send_flight_async only returns before the body is complete
+                # once it has answered with 502 or 504
+                return status_code
+            if capture is not None:
+                capture += flight.body
+        else:
+            started = time.perf_counter()
+            writer.write(self.client_head(head, response_headers, False))
+            while not framer.done:
+                data = await target_reader.read(config.RELAY_BUFFER_SIZE)
+                if not data:
+                    if framing == 'close':
+                        break
+                    raise HTTPRelayError("connection closed before end of body")
+                end = framer.feed(data, 0, len(data))
+                piece = data[:end] if end < len(data) else data
+                writer.write(piece)
+                await writer.drain()
+                if meter is not None:
+                    await self.throttle(meter, len(piece))
+                if capture is not None:
+                    capture += piece
+                    if len(capture) > self.cache.max_object_size:
+                        capture = None
+            self.metrics.observe('transfer', started)
+            self.metrics.inc('proxy_bytes_total{kind="http",direction="downstream"}', len(head) + framer.bytes)
+
+        if use_cache:
+            self.cache.record_miss()
+            if capture is not None:
+                await loop.run_in_executor(None, self.cache.store, url, request_headers, capture)
+        return status_code
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Block list reload benchmark
+Times a bulk hosts-file import (parse, one-transaction insert, snapshot build)
+against adding the same sites one at a time, then measures lookup latency in
+request threads while the block list is being swapped under them.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+
+from common import percentile
+import config
+
+config.LOG_LEVEL = 'OFF'
+config.DATABASE_FILE = os.path.join(tempfile.mkdtemp(prefix='bench-blocklist-'), 'proxy.db')
+
+from bench_blocklist import build_hosts, random_domain
+from blocklist import parse_blocklist
+from proxy_server import HTTPProxyServer
+
+
+def summarize_us(values):
+    """Lookup latency summary in microseconds (lookups are far below a millisecond)"""
+    return {f'p{pct}_us': round(percentile(values, pct) * 1e6, 2) for pct in (50, 99, 99.9)} | {
+        'max_us': round(max(values) * 1e6, 1) if values else 0
+    }
+
+
+def hosts_file(rng, size):
+    lines = ['# Generated hosts file', '127.0.0.1 localhost', '::1 localhost']
+    lines += [f'0.0.0.0 {random_domain(rng)}' for _ in range(size)]
+    return '\n'.join(lines)
+
+
+def time_import(server, text, legacy_sample):
+    started = time.perf_counter()
+    patterns = list(parse_blocklist(text.splitlines()))
+    parsed = time.perf_counter() - started
+    added, _ = server.import_blocked_sites(patterns, replace=True)
+    total = time.perf_counter() - started
+
+    # The old way: one INSERT and COMMIT per site, timed on a sample
+    server.import_blocked_sites([], replace=True)
+    started = time.perf_counter()
+    for pattern in patterns[:legacy_sample]:
+        server.add_blocked_site(pattern)
+    legacy = (time.perf_counter() - started) / legacy_sample * len(patterns)
+    server.import_blocked_sites(patterns, replace=True)
+    return {
+        'patterns': added,
+        'parse_seconds': round(parsed, 3),
+        'import_seconds': round(total, 3),
+        'one_by_one_seconds_estimated': round(legacy, 1)
+    }
+
+
+def lookup_latencies(server, hosts, threads, duration, writer=None):
+    """Per-lookup latencies from several request threads, optionally while writer runs"""
+    stop = threading.Event()
+    results, errors = [], []
+
+    def reader(offset):
+        latencies = []
+        i = offset
+        while not stop.is_set():
+            host = hosts[i % len(hosts)]
+            i += 1
+            start = time.perf_counter()
+            try:
+                server.blocklist.match(host)
+            except Exception as e:
+                errors.append(repr(e))
+            latencies.append(time.perf_counter() - start)
+        results.append(latencies)
+
+    workers = [threading.Thread(target=reader, args=(n * 7919,)) for n in range(threads)]
+    if writer:
+        workers.append(threading.Thread(target=writer, args=(stop,)))
+    for worker in workers:
+        worker.start()
+    time.sleep(duration)
+    stop.set()
+    for worker in workers:
+        worker.join()
+    return [value for latencies in results for value in latencies], errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=100000, help='domains in the imported hosts file')
+    parser.add_argument('--threads', type=int, default=4, help='request threads doing lookups')
+    parser.add_argument('--duration', type=float, default=3, help='seconds per lookup run')
+    parser.add_argument('--legacy-sample', type=int, default=500,
+                        help='sites added one at a time to estimate the old import cost')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    # The server prints every block list change
+    quiet = contextlib.redirect_stdout(io.StringIO())
+    quiet.__enter__()
+    server = HTTPProxyServer('127.0.0.1', 0)
+    text = hosts_file(rng, args.size)
+    results = {'import': time_import(server, text, args.legacy_sample)}
+
+    patterns = sorted(server.blocked_sites)
+    hosts = build_hosts(rng, patterns, 100000)
+    swaps = {'single': 0, 'bulk': 0}
+
+    def writer(stop):
+        extra = [random_domain(rng) for _ in range(1000)]
+        while not stop.is_set():
+            site = rng.choice(extra)
+            server.add_blocked_site(site)
+            server.remove_blocked_site(site)
+            swaps['single'] += 2
+            if swaps['single'] % 20 == 0:
+                server.import_blocked_sites(extra, replace=False)
+                server.import_blocked_sites(patterns, replace=True)
+                swaps['bulk'] += 2
+
+    for name, run_writer in (('steady', None), ('during_swaps', writer)):
+        latencies, errors = lookup_latencies(server, hosts, args.threads, args.duration, run_writer)
+        results[name] = {
+            'lookups': len(latencies),
+            'errors': len(errors),
+            'latency': summarize_us(latencies)
+        }
+    results['during_swaps']['swaps'] = swaps
+    results['blocklist_version'] = server.blocklist.version
+    server.log_writer.stop()
+    quiet.__exit__(None, None, None)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
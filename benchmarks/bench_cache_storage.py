@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Cache storage benchmark
+Fills the response cache with distinct cacheable objects, then measures cache
+hit throughput with many concurrent clients, the size of the SQLite database
+and blob directory, and the time to clear the cache. Runs once with response
+bodies stored as BLOBs in the cache table and once with bodies in blob files
+sent with sendfile (CACHE_STORAGE = 'files').
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+
+from common import OriginServer, ProxyProcess, http_get, raise_fd_limit, summarize_latencies
+
+
+def disk_usage(path):
+    """Bytes in a file (with its SQLite -wal/-shm companions) or a directory tree"""
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, name))
+                   for root, _, names in os.walk(path) for name in names)
+    return sum(os.path.getsize(path + suffix) for suffix in ('', '-wal', '-shm')
+               if os.path.exists(path + suffix))
+
+
+async def fill(proxy_port, urls, concurrency=8):
+    queue = list(urls)
+
+    async def worker():
+        while queue:
+            await http_get(proxy_port, queue.pop())
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def hit_load(proxy_port, urls, concurrency, duration):
+    latencies, received, errors = [], [], []
+    deadline = time.monotonic() + duration
+
+    async def loop():
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                received.append(await asyncio.wait_for(http_get(proxy_port, random.choice(urls)), 60))
+            except (OSError, asyncio.TimeoutError):
+                errors.append(1)
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(loop() for _ in range(concurrency)))
+    return latencies, sum(received), len(errors), time.perf_counter() - started
+
+
+def time_clear(db_file, storage):
+    """Seconds ResponseCache.clear() takes on the database the proxy left behind"""
+    import config
+    config.DATABASE_FILE = db_file
+    from blob_store import BlobStore
+    from database import Database
+    from http_cache import ResponseCache
+    blobs = BlobStore(f"{db_file}.cache") if storage == 'files' else None
+    cache = ResponseCache(Database(db_file), blobs=blobs)
+    started = time.perf_counter()
+    cache.clear()
+    return time.perf_counter() - started
+
+
+def run(storage, args, origin):
+    proxy = ProxyProcess(args.engine, settings={
+        'LOG_LEVEL': 'OFF',
+        'CACHE_STORAGE': storage,
+        'MAX_CONNECTIONS': 0,
+        'MAX_CONNECTIONS_PER_CLIENT': 0
+    }).start()
+    urls = [f'http://127.0.0.1:{origin.http_port}/{storage}/{i}/static/{args.size}'
+            for i in range(args.objects)]
+    try:
+        asyncio.run(fill(proxy.port, urls))
+        # Stores finish after the response went out
+        time.sleep(1)
+        before = origin.requests
+        latencies, received, errors, elapsed = asyncio.run(
+            hit_load(proxy.port, urls, args.concurrency, args.duration))
+        process = proxy.stats()
+    finally:
+        proxy.stop()
+    db_file = os.path.join(proxy.workdir, 'proxy_server.db')
+    return {
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'mb_per_second': round(received / elapsed / 1e6, 1),
+        'origin_fetches_during_hits': origin.requests - before,
+        'errors': errors,
+        'latency': summarize_latencies(latencies),
+        'database_mb': round(disk_usage(db_file) / 1e6, 1),
+        'blob_files_mb': round(disk_usage(f"{db_file}.cache") / 1e6, 1) if storage == 'files' else 0,
+        'clear_ms': round(time_clear(db_file, storage) * 1000, 1),
+        **process
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--engine', choices=('threaded', 'asyncio'), default='threaded')
+    parser.add_argument('--objects', type=int, default=200, help='distinct cached objects')
+    parser.add_argument('--size', type=int, default=1024 * 1024, help='object size in bytes')
+    parser.add_argument('--concurrency', type=int, default=32, help='concurrent clients')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of cache hits per storage')
+    args = parser.parse_args()
+    raise_fd_limit()
+
+    origin = OriginServer().start()
+    results = {'objects': args.objects, 'object_bytes': args.size}
+    try:
+        for storage in ('sqlite', 'files'):
+            results[storage] = run(storage, args, origin)
+    finally:
+        origin.stop()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Collapsed forwarding benchmark
+Sends a burst of identical GETs for a slow, cacheable URL that is not cached
+yet and counts how many requests reach the origin, with request collapsing
+on and off. Collapsed, the whole burst costs one origin fetch and every
+client gets the full body. A second burst hits a URL whose origin drops the
+connection: every client gets 502 as soon as the fetch fails instead of
+waiting out COLLAPSE_TIMEOUT. Exits with status 1 if a collapsed burst did not behave
+like that.
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from common import OriginServer, ProxyProcess, raise_fd_limit, summarize_latencies
+
+
+async def fetch(proxy_port, url):
+    """(status code, body bytes, seconds) for one request through the proxy; status 'closed'
+    if the proxy closed the connection without answering"""
+    started = time.perf_counter()
+    reader, writer = await asyncio.open_connection('127.0.0.1', proxy_port)
+    try:
+        writer.write(f'GET {url} HTTP/1.1\r\nHost: bench\r\nConnection: close\r\n\r\n'.encode())
+        await writer.drain()
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return 'closed', 0, time.perf_counter() - started
+        body = 0
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            body += len(data)
+        return int(head.split()[1]), body, time.perf_counter() - started
+    finally:
+        writer.close()
+
+
+async def burst(proxy_port, url, clients):
+    results = await asyncio.gather(*(fetch(proxy_port, url) for _ in range(clients)), return_exceptions=True)
+    replies = [result for result in results if not isinstance(result, BaseException)]
+    statuses = {}
+    for status, _, _ in replies:
+        statuses[status] = statuses.get(status, 0) + 1
+    return {
+        'statuses': statuses,
+        'full_bodies': sum(1 for status, body, _ in replies if status == 200 and body == 1024),
+        'errors': len(results) - len(replies),
+        'latency': summarize_latencies([seconds for _, _, seconds in replies])
+    }
+
+
+def run(engine, collapse, origin, clients, delay):
+    proxy = ProxyProcess(engine, settings={'LOG_LEVEL': 'OFF', 'COLLAPSE_REQUESTS': collapse}).start()
+    results = {}
+    try:
+        for name, path in (('cacheable', f'cacheable/{delay}'), ('dropped', f'drop/{delay}')):
+            url = f'http://127.0.0.1:{origin.http_port}/{engine}-{int(collapse)}/{path}'
+            before = origin.requests
+            results[name] = asyncio.run(burst(proxy.port, url, clients))
+            results[name]['origin_fetches'] = origin.requests - before
+    finally:
+        proxy.stop()
+    return results
+
+
+def check(results, clients):
+    """What a collapsed run must show: one origin fetch per burst, full bodies, 502s for a dropped fetch"""
+    failures = []
+    cacheable, dropped = results['cacheable'], results['dropped']
+    if cacheable['origin_fetches'] != 1:
+        failures.append(f"{clients} identical requests made {cacheable['origin_fetches']} origin fetches")
+    if cacheable['full_bodies'] != clients:
+        failures.append(f"{cacheable['full_bodies']} of {clients} clients got the full body")
+    # A pooled connection that closes without a response is retried once on a fresh one
+    if dropped['origin_fetches'] > 2:
+        failures.append(f"the dropped URL was fetched {dropped['origin_fetches']} times")
+    if dropped['statuses'].get(502, 0) != clients:
+        failures.append(f"clients of the dropped fetch got {dropped['statuses']}, not 502")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--engine', choices=('threaded', 'asyncio', 'both'), default='both')
+    parser.add_argument('--clients', type=int, default=100, help='concurrent identical requests')
+    parser.add_argument('--delay', type=int, default=500, help='origin response time in milliseconds')
+    args = parser.parse_args()
+    raise_fd_limit()
+
+    origin = OriginServer().start()
+    engines = ('threaded', 'asyncio') if args.engine == 'both' else (args.engine,)
+    results = {}
+    failures = []
+    try:
+        for engine in engines:
+            for collapse in (True, False):
+                name = f'{engine}_{"collapsed" if collapse else "uncollapsed"}'
+                results[name] = run(engine, collapse, origin, args.clients, args.delay)
+                if collapse:
+                    failures += [f"{name}: {failure}" for failure in check(results[name], args.clients)]
+    finally:
+        origin.stop()
+    print(json.dumps(results, indent=2))
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Threaded vs asyncio engine benchmark
+Holds N idle-but-alive CONNECT tunnels open and measures proxy RSS/threads,
+then measures plain-HTTP request latency while the tunnels stay open.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from common import (OriginServer, ProxyProcess, http_get, open_tunnel, raise_fd_limit,
+                    summarize_latencies)
+
+
+async def hold_tunnel(proxy_port, echo_port, stop, opened, failed):
+    try:
+        reader, writer = await asyncio.wait_for(open_tunnel(proxy_port, echo_port), 15)
+    except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+        failed.append(1)
+        return
+    opened.append(1)
+    try:
+        while not stop.is_set():
+            writer.write(b'ping')
+            await writer.drain()
+            await reader.readexactly(4)
+            try:
+                await asyncio.wait_for(stop.wait(), 1)
+            except asyncio.TimeoutError:
+                pass
+    except (OSError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def request_loop(proxy_port, url, deadline, latencies, errors):
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            await http_get(proxy_port, url)
+            latencies.append(time.perf_counter() - start)
+        except OSError:
+            errors.append(1)
+
+
+async def run_engine(engine, origin, args):
+    # Admission limits off: every tunnel should be held, not shed
+    proxy = ProxyProcess(engine, settings={'TUNNEL_IDLE_TIMEOUT': 30,
+                                           'LISTEN_BACKLOG': args.backlog,
+                                           'MAX_CONNECTIONS': 0,
+                                           'MAX_CONNECTIONS_PER_CLIENT': 0}).start()
+    try:
+        stop = asyncio.Event()
+        opened, failed = [], []
+        tunnels = [asyncio.ensure_future(hold_tunnel(proxy.port, origin.echo_port, stop, opened, failed))
+                   for _ in range(args.tunnels)]
+        start = time.monotonic()
+        while len(opened) + len(failed) < args.tunnels and time.monotonic() - start < 60:
+            await asyncio.sleep(0.2)
+        open_time = time.monotonic() - start
+        idle_stats = proxy.stats()
+
+        latencies, errors = [], []
+        deadline = time.monotonic() + args.duration
+        url = f'http://127.0.0.1:{origin.http_port}/bytes/{args.size}'
+        await asyncio.gather(*(request_loop(proxy.port, url, deadline, latencies, errors)
+                               for _ in range(args.concurrency)))
+        load_stats = proxy.stats()
+
+        stop.set()
+        await asyncio.gather(*tunnels, return_exceptions=True)
+        return {
+            'engine': engine,
+            'tunnels_requested': args.tunnels,
+            'tunnels_opened': len(opened),
+            'tunnels_failed': len(failed),
+            'tunnel_open_seconds': round(open_time, 2),
+            'with_tunnels': idle_stats,
+            'under_load': load_stats,
+            'requests_per_second': round(len(latencies) / args.duration, 1),
+            'request_errors': len(errors),
+            'latency': summarize_latencies(latencies)
+        }
+    finally:
+        proxy.stop()
+
+
+async def main_async(args):
+    origin = OriginServer().start()
+    results = []
+    for engine in args.engines:
+        results.append(await run_engine(engine, origin, args))
+    origin.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--engines', nargs='+', default=['threaded', 'asyncio'])
+    parser.add_argument('--tunnels', type=int, default=2000, help='concurrent CONNECT tunnels')
+    parser.add_argument('--concurrency', type=int, default=50, help='concurrent HTTP clients')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of HTTP load')
+    parser.add_argument('--size', type=int, default=1024, help='response size in bytes')
+    parser.add_argument('--backlog', type=int, default=1024)
+    args = parser.parse_args()
+    raise_fd_limit()
+    print(json.dumps(asyncio.run(main_async(args)), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Access log storage benchmark
+Seeds a partitioned store and the old single unindexed access_logs table with
+the same rows, then measures /logs page latency (first page, deep keyset
+pages, filtered pages), the throughput and memory growth of a streaming
+export (/api/logs/export) and the cost of dropping the oldest day of logs.
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from common import summarize_latencies
+from log_export import encode_export
+from log_store import AccessLogStore, LEGACY_TABLE
+
+BATCH = 50000
+
+
+def generate(rows, days, seed=1):
+    """(client_ip, url, method, status_code, blocked, timestamp, block_rule) records, oldest first"""
+    rng = random.Random(seed)
+    start = datetime.utcnow().replace(microsecond=0) - timedelta(days=days)
+    step = days * 86400 / rows
+    hosts = [f'site{i}.example.com' for i in range(1000)]
+    for i in range(rows):
+        host = rng.choice(hosts)
+        blocked = 1 if rng.random() < 0.1 else 0
+        yield (
+            f'10.0.{rng.randrange(4)}.{rng.randrange(256)}',
+            f'http://{host}/page/{rng.randrange(100)}',
+            rng.choice(('GET', 'GET', 'GET', 'POST', 'CONNECT')),
+            403 if blocked else rng.choice((200, 200, 200, 304, 404)),
+            blocked,
+            (start + timedelta(seconds=i * step)).strftime('%Y-%m-%d %H:%M:%S'),
+            f'{host} (exact match)' if blocked else None
+        )
+
+
+def seed(store, legacy_file, rows, days):
+    part = store.connect()
+    legacy = sqlite3.connect(legacy_file) if legacy_file else None
+    for conn in filter(None, (part, legacy)):
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = OFF")
+    if legacy:
+        legacy.execute(f'''
+            CREATE TABLE {LEGACY_TABLE} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                client_ip TEXT, url TEXT, method TEXT, status_code INTEGER,
+                blocked INTEGER DEFAULT 0, timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+    started = time.perf_counter()
+    batch = []
+    for record in generate(rows, days):
+        batch.append(record)
+        if len(batch) >= BATCH:
+            write(store, part, legacy, batch)
+            batch = []
+    if batch:
+        write(store, part, legacy, batch)
+    elapsed = time.perf_counter() - started
+    return part, legacy, round(elapsed, 1)
+
+
+def write(store, part, legacy, batch):
+    with part:
+        store.insert(part, batch)
+    if legacy:
+        with legacy:
+            legacy.executemany(f'''
+                INSERT INTO {LEGACY_TABLE} (client_ip, url, method, status_code, blocked, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', [record[:6] for record in batch])
+
+
+def time_pages(store, conn, pages, repeat, **filters):
+    """Latency of walking the first `pages` pages, repeated"""
+    first = []
+    deep = []
+    for _ in range(repeat):
+        cursor = None
+        for page in range(pages):
+            started = time.perf_counter()
+            _, cursor = store.query(conn, cursor=cursor, **filters)
+            (first if page == 0 else deep).append(time.perf_counter() - started)
+            if not cursor:
+                break
+    return {'first_page': summarize_latencies(first), 'later_pages': summarize_latencies(deep)}
+
+
+def time_legacy_page(conn, repeat):
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        conn.execute(f'''
+            SELECT client_ip, url, method, status_code, blocked, timestamp
+            FROM {LEGACY_TABLE} ORDER BY timestamp DESC LIMIT 200
+        ''').fetchall()
+        latencies.append(time.perf_counter() - started)
+    return summarize_latencies(latencies)
+
+
+def rss_mb():
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1e6
+
+
+def first_rows(batches, limit):
+    taken = 0
+    for batch in batches:
+        batch = batch[:limit - taken]
+        taken += len(batch)
+        yield batch
+        if taken >= limit:
+            return
+
+
+def time_export(store, conn, limit=None, fmt='ndjson', compress=False):
+    """Stream an export (the first limit rows, or all) to nowhere; reports rows/s and
+    how far RSS rose above where it started"""
+    rows = []
+    batches = store.export(conn)
+    if limit:
+        batches = first_rows(batches, limit)
+    start_rss = peak_rss = rss_mb()
+    size = 0
+    started = time.perf_counter()
+    for chunk in encode_export((rows.append(len(batch)) or batch for batch in batches), fmt, compress):
+        size += len(chunk)
+        peak_rss = max(peak_rss, rss_mb())
+    elapsed = time.perf_counter() - started
+    return {
+        'rows': sum(rows),
+        'mb': round(size / 1e6, 1),
+        'rows_per_second': round(sum(rows) / elapsed),
+        'rss_growth_mb': round(peak_rss - start_rss, 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    parser.add_argument('--days', type=int, default=30, help='days the rows are spread over')
+    parser.add_argument('--pages', type=int, default=20, help='pages walked per run')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--no-legacy', action='store_true', help='skip the single-table baseline')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_logs_')
+    store = AccessLogStore(os.path.join(workdir, 'partitioned.db'), retention_days=args.days - 1)
+    legacy_file = None if args.no_legacy else os.path.join(workdir, 'legacy.db')
+    part, legacy, seed_seconds = seed(store, legacy_file, args.rows, args.days)
+
+    sample_client, sample_url = part.execute(
+        f"SELECT client_ip, url FROM {store.partitions(part)[0]} LIMIT 1"
+    ).fetchone()
+    sample_host = sample_url.split('/')[2]
+    result = {
+        'rows': args.rows,
+        'partitions': len(store.partitions(part)),
+        'seed_seconds': seed_seconds,
+        'pages': {
+            'unfiltered': time_pages(store, part, args.pages, args.repeat),
+            'client': time_pages(store, part, args.pages, args.repeat, client_ip=sample_client),
+            'host': time_pages(store, part, args.pages, args.repeat, host=sample_host),
+            'blocked': time_pages(store, part, args.pages, args.repeat, blocked=True),
+            'status_404': time_pages(store, part, args.pages, args.repeat, status=404),
+        }
+    }
+    if legacy:
+        result['legacy_first_page'] = time_legacy_page(legacy, args.repeat)
+    # Pages read through mmap would show up as RSS growth of the export
+    part.execute("PRAGMA mmap_size = 0")
+    result['export'] = {
+        'first_1k_ndjson': time_export(store, part, limit=1000),
+        'all_ndjson': time_export(store, part),
+        'all_csv_gzip': time_export(store, part, fmt='csv', compress=True),
+    }
+
+    started = time.perf_counter()
+    removed, _ = store.drop_expired(part)
+    result['retention_drop'] = {'rows': removed, 'seconds': round(time.perf_counter() - started, 3)}
+    if legacy:
+        cutoff = (datetime.utcnow() - timedelta(days=args.days - 1)).strftime('%Y-%m-%d 00:00:00')
+        started = time.perf_counter()
+        with legacy:
+            deleted = legacy.execute(f"DELETE FROM {LEGACY_TABLE} WHERE timestamp < ?", (cutoff,)).rowcount
+        result['legacy_retention_delete'] = {'rows': deleted,
+                                             'seconds': round(time.perf_counter() - started, 3)}
+
+    part.close()
+    if legacy:
+        legacy.close()
+    shutil.rmtree(workdir, ignore_errors=True)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
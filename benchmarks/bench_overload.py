@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Overload benchmark
+Offers far more concurrent requests than the proxy is allowed to serve and
+compares latency with admission control on and off. With limits, requests
+over capacity get a quick 503 and the p99 of the requests that are served
+stays bounded; without them every request queues behind every other one.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from common import OriginServer, ProxyProcess, raise_fd_limit, summarize_latencies
+
+
+async def fetch_status(proxy_port, url):
+    """Send one request through the proxy and return its status code"""
+    reader, writer = await asyncio.open_connection('127.0.0.1', proxy_port)
+    try:
+        writer.write(f'GET {url} HTTP/1.1\r\nHost: bench\r\nConnection: close\r\n\r\n'.encode())
+        await writer.drain()
+        status_line = await reader.readline()
+        while await reader.read(65536):
+            pass
+        return int(status_line.split()[1])
+    finally:
+        writer.close()
+
+
+async def offer_load(proxy_port, url, concurrency, duration):
+    served, shed, errors = [], [], []
+    deadline = time.monotonic() + duration
+
+    async def loop():
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                status = await asyncio.wait_for(fetch_status(proxy_port, url), 60)
+            except (OSError, ValueError, IndexError, asyncio.TimeoutError):
+                errors.append(1)
+                continue
+            elapsed = time.perf_counter() - start
+            if status == 503:
+                shed.append(elapsed)
+                # Honour Retry-After loosely so shed clients do not spin
+                await asyncio.sleep(0.05)
+            else:
+                served.append(elapsed)
+
+    await asyncio.gather(*(loop() for _ in range(concurrency)))
+    return served, shed, len(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--engine', choices=('threaded', 'asyncio'), default='threaded')
+    parser.add_argument('--concurrency', type=int, default=500, help='concurrent client connections')
+    parser.add_argument('--limit', type=int, default=50, help='MAX_CONNECTIONS for the limited run')
+    parser.add_argument('--queue', type=int, default=50, help='ACCEPT_QUEUE_SIZE for the limited run')
+    parser.add_argument('--delay', type=int, default=20, help='origin response time in milliseconds')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of load per run')
+    args = parser.parse_args()
+    raise_fd_limit()
+
+    origin = OriginServer().start()
+    url = f'http://127.0.0.1:{origin.http_port}/delay/{args.delay}'
+    runs = (('limited', args.limit, args.queue), ('unlimited', 0, 0))
+    results = []
+    for name, limit, queue in runs:
+        proxy = ProxyProcess(args.engine, settings={'MAX_CONNECTIONS': limit,
+                                                    'ACCEPT_QUEUE_SIZE': queue,
+                                                    'MAX_CONNECTIONS_PER_CLIENT': 0,
+                                                    'LISTEN_BACKLOG': 4096,
+                                                    'UPSTREAM_MAX_PER_HOST': max(limit, args.concurrency),
+                                                    'LOG_LEVEL': 'OFF'}).start()
+        try:
+            served, shed, errors = asyncio.run(offer_load(proxy.port, url, args.concurrency, args.duration))
+            results.append({
+                'run': name,
+                'engine': args.engine,
+                'max_connections': limit,
+                'served_per_second': round(len(served) / args.duration, 1),
+                'shed': len(shed),
+                'errors': errors,
+                'served_latency': summarize_latencies(served),
+                'shed_latency': summarize_latencies(shed),
+                'proxy': proxy.stats()
+            })
+        finally:
+            proxy.stop()
+    origin.stop()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
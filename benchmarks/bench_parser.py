@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Request parser microbenchmark
+Times parse_request against the previous decode-and-split parsing for the
+requests in parser_corpus/, and read_head assembling a head that arrives in
+small segments.
+"""
+
+import argparse
+import json
+import os
+import timeit
+from urllib.parse import urlparse
+
+from common import ROOT
+
+from http_parser import HTTPParseError, parse_header_lines, parse_request, request_target
+from http_relay import read_head
+
+CORPUS = os.path.join(ROOT, 'benchmarks', 'parser_corpus')
+
+
+def legacy_parse(head):
+    """What the proxy used to do: decode the head, split it, parse the headers and the URL"""
+    request = head.decode('iso-8859-1')
+    parts = request.split('\r\n', 1)[0].split()
+    headers = parse_header_lines(request.split('\r\n\r\n', 1)[0].splitlines()[1:])
+    if parts[0] != 'CONNECT':
+        url = parts[1] if '://' in parts[1] else 'http://' + parts[1]
+        parsed_url = urlparse(url)
+        parsed_url.hostname, parsed_url.port
+    return headers
+
+
+def strict_parse(head):
+    method, target, version, headers, request = parse_request(head)
+    if method != 'CONNECT':
+        request_target(target, headers)
+    return headers
+
+
+class SegmentedSocket:
+    def __init__(self, data, segment):
+        self.data = data
+        self.segment = segment
+        self.pos = 0
+
+    def recv_into(self, buffer):
+        size = min(self.segment, len(self.data) - self.pos)
+        buffer[:size] = self.data[self.pos:self.pos + size]
+        self.pos += size
+        return size
+
+
+def per_call_us(func, number):
+    return round(min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--number', type=int, default=20000, help='calls per timing')
+    parser.add_argument('--segment', type=int, default=64, help='bytes per recv for read_head')
+    args = parser.parse_args()
+
+    results = []
+    buffer = bytearray(65536)
+    for name in sorted(os.listdir(CORPUS)):
+        with open(os.path.join(CORPUS, name), 'rb') as corpus_file:
+            data = corpus_file.read()
+        head = data[:data.find(b'\r\n\r\n') + 4]
+        try:
+            strict_parse(head)
+        except HTTPParseError as e:
+            results.append({'request': name, 'rejected': e.status})
+            continue
+        results.append({
+            'request': name,
+            'head_bytes': len(head),
+            'legacy_us': per_call_us(lambda: legacy_parse(head), args.number),
+            'parse_request_us': per_call_us(lambda: strict_parse(head), args.number),
+            'read_head_segmented_us': per_call_us(
+                lambda: read_head(SegmentedSocket(data, args.segment), buffer), args.number // 10
+            )
+        })
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Rate limit benchmark
+Two clients (127.0.0.1 and 127.0.0.2) download through CONNECT tunnels at
+the same time; the greedy one opens several tunnels, the other one. Without
+limits the greedy client takes most of the bandwidth; with a per-client byte
+limit each gets its own budget whatever its connection count, and with a
+per-host limit their tunnels together stay within the host's budget. A last
+run sends requests as fast as possible under a per-client request limit and
+reports the rate the proxy let through. Exits with status 1 if a limited run
+strays from its expected share or rate by more than --tolerance.
+"""
+
+import argparse
+import json
+import socket
+import sys
+import threading
+import time
+
+from common import OriginServer, ProxyProcess, raise_fd_limit
+
+CLIENTS = ('127.0.0.1', '127.0.0.2')
+
+
+def open_tunnel(proxy_port, target_port, source_ip):
+    sock = socket.create_connection(('127.0.0.1', proxy_port), source_address=(source_ip, 0))
+    sock.sendall(f'CONNECT 127.0.0.1:{target_port} HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n'.encode())
+    status = b''
+    while b'\r\n\r\n' not in status:
+        data = sock.recv(1)
+        if not data:
+            raise ConnectionError('proxy closed during CONNECT')
+        status += data
+    if b' 200 ' not in status.split(b'\r\n', 1)[0]:
+        raise ConnectionError(status.split(b'\r\n', 1)[0].decode())
+    return sock
+
+
+def download(sock, deadline, received, slot):
+    """Read until the deadline, counting into received[slot] (one slot per tunnel)"""
+    buffer = bytearray(262144)
+    sock.settimeout(1)
+    try:
+        while time.monotonic() < deadline:
+            try:
+                count = sock.recv_into(buffer)
+            except socket.timeout:
+                continue
+            received[slot] += count
+    except OSError:
+        pass
+    finally:
+        sock.close()
+
+
+def compete(proxy_port, origin, greedy_tunnels, duration):
+    """MB/s each client got, and the share of the total the polite client got"""
+    owners = [0] * greedy_tunnels + [1]
+    received = [0] * len(owners)
+    deadline = time.monotonic() + duration
+    threads = []
+    for slot, owner in enumerate(owners):
+        sock = open_tunnel(proxy_port, origin.source_port, CLIENTS[owner])
+        threads.append(threading.Thread(target=download, args=(sock, deadline, received, slot)))
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    greedy, polite = sum(received[:-1]), received[-1]
+    return {
+        'greedy_mb_per_second': round(greedy / elapsed / 1e6, 1),
+        'polite_mb_per_second': round(polite / elapsed / 1e6, 1),
+        'polite_share': round(polite / max(1, greedy + polite), 3)
+    }
+
+
+def request_rate(proxy_port, origin, duration):
+    """Requests per second a client sending back to back gets through, by status"""
+    url = f'http://127.0.0.1:{origin.http_port}/bytes/16'
+    statuses = {}
+    deadline = time.monotonic() + duration
+    started = time.monotonic()
+    while time.monotonic() < deadline:
+        with socket.create_connection(('127.0.0.1', proxy_port), source_address=(CLIENTS[0], 0)) as sock:
+            sock.sendall(f'GET {url} HTTP/1.1\r\nHost: bench\r\nConnection: close\r\n\r\n'.encode())
+            response = b''
+            while True:
+                data = sock.recv(65536)
+                if not data:
+                    break
+                response += data
+        status = response.split(b' ', 2)[1].decode() if response else 'closed'
+        statuses[status] = statuses.get(status, 0) + 1
+    elapsed = time.monotonic() - started
+    return {'statuses': statuses, 'ok_per_second': round(statuses.get('200', 0) / elapsed, 1)}
+
+
+def check(results, args):
+    """Failures of the limited runs: the polite client's share under per-client
+    limits, and the totals against the limits plus one burst's allowance"""
+    failures = []
+    allowance = 1 + args.burst / args.duration + args.tolerance
+    share = results['client_limit']['polite_share']
+    if abs(share - 0.5) > args.tolerance:
+        failures.append(f"client_limit: polite client got {share:.0%} of the bandwidth, not 50%")
+    host = results['host_limit']
+    total = host['greedy_mb_per_second'] + host['polite_mb_per_second']
+    if total > args.host_limit / 1e6 * allowance:
+        failures.append(f"host_limit: {total} MB/s through a {args.host_limit / 1e6} MB/s host limit")
+    rate = results['request_limit']['ok_per_second']
+    if rate > args.request_limit * allowance:
+        failures.append(f"request_limit: {rate} requests/s through a {args.request_limit}/s limit")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--engine', choices=('threaded', 'asyncio'), default='threaded')
+    parser.add_argument('--duration', type=float, default=5, help='seconds per run')
+    parser.add_argument('--greedy-tunnels', type=int, default=4, help='tunnels opened by the greedy client')
+    parser.add_argument('--client-limit', type=int, default=20 * 1000 * 1000, help='bytes/s per client')
+    parser.add_argument('--host-limit', type=int, default=40 * 1000 * 1000, help='bytes/s per host')
+    parser.add_argument('--request-limit', type=float, default=20, help='requests/s per client')
+    parser.add_argument('--burst', type=float, default=1.0, help='RATE_LIMIT_BURST for the limited runs')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='allowed deviation from a 50%% share, and from the limits as a fraction')
+    args = parser.parse_args()
+    raise_fd_limit()
+
+    runs = {
+        'unlimited': {},
+        'client_limit': {'CLIENT_BYTES_PER_SECOND': args.client_limit, 'RATE_LIMIT_BURST': args.burst},
+        'host_limit': {'HOST_BYTES_PER_SECOND': args.host_limit, 'RATE_LIMIT_BURST': args.burst},
+    }
+    origin = OriginServer().start()
+    results = {'engine': args.engine, 'greedy_tunnels': args.greedy_tunnels,
+               'client_limit_mb': args.client_limit / 1e6, 'host_limit_mb': args.host_limit / 1e6}
+    try:
+        for name, limits in runs.items():
+            proxy = ProxyProcess(args.engine, settings={'LOG_LEVEL': 'OFF', **limits}).start()
+            try:
+                results[name] = compete(proxy.port, origin, args.greedy_tunnels, args.duration)
+            finally:
+                proxy.stop()
+        proxy = ProxyProcess(args.engine, settings={
+            'LOG_LEVEL': 'OFF', 'CLIENT_REQUESTS_PER_SECOND': args.request_limit, 'RATE_LIMIT_MAX_DELAY': 1,
+            'RATE_LIMIT_BURST': args.burst
+        }).start()
+        try:
+            results['request_limit'] = {'limit_per_second': args.request_limit,
+                                        **request_rate(proxy.port, origin, args.duration)}
+        finally:
+            proxy.stop()
+    finally:
+        origin.stop()
+    print(json.dumps(results, indent=2))
+    failures = check(results, args)
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark
+Seeds a scratch database with a large block list, then starts fresh proxy
+processes the way run.py --start does and reports, from process launch:
+importing the proxy modules, the first accepted proxy
+connection, the first request to a blocked host answered with 403, and the
+full block list being loaded. Runs once with the precompiled block list
+snapshot and once rebuilding the list from the database rows.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from common import free_port, percentile
+
+BLOCKED_HOST = 'blocked.startup.test'
+
+
+def seed(db_file, sites):
+    """Fill blocked_sites and wait for the snapshot file to be written"""
+    import config
+    config.LOG_LEVEL = 'OFF'
+    config.DATABASE_FILE = db_file
+    from proxy_server import get_proxy_server
+    with contextlib.redirect_stdout(io.StringIO()):
+        server = get_proxy_server()
+        server.import_blocked_sites([f'site{i}.example.com' for i in range(sites)] + [BLOCKED_HOST], replace=True)
+    while server.snapshot_writer is not None:
+        time.sleep(0.05)
+    server.log_writer.stop()
+
+
+def first_connection(port, deadline):
+    """Launch-relative time of the first accepted connection"""
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return time.time()
+        except OSError:
+            time.sleep(0.001)
+    raise TimeoutError("proxy never accepted a connection")
+
+
+def first_blocked_answer(port):
+    with socket.create_connection(('127.0.0.1', port), timeout=60) as sock:
+        sock.sendall(f'GET http://{BLOCKED_HOST}/ HTTP/1.1\r\nHost: {BLOCKED_HOST}\r\n\r\n'.encode())
+        status = sock.recv(64)
+    if b' 403 ' not in status:
+        raise RuntimeError(f"expected a 403, got {status!r}")
+    return time.time()
+
+
+def start_once(db_file, snapshot):
+    port = free_port()
+    launched = time.time()
+    child = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--child', db_file, str(port), str(int(snapshot))],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
+    )
+    try:
+        connected = first_connection(port, launched + 120)
+        answered = first_blocked_answer(port)
+        child_times = json.loads(child.stdout.readline())
+    finally:
+        child.terminate()
+        child.wait(30)
+    return {
+        'import_s': child_times['imported'] - child_times['started'],
+        'first_connection_s': connected - launched,
+        'first_blocked_answer_s': answered - launched,
+        'full_blocklist_s': child_times['blocklist'] - launched,
+        'schema_checked_s': child_times['database'] - launched
+    }
+
+
+def run_child(db_file, port, snapshot):
+    """One proxy start: report epoch timestamps of each step on stdout"""
+    started = time.time()
+    import config
+    config.LOG_LEVEL = 'OFF'
+    config.DATABASE_FILE = db_file
+    config.BLOCKLIST_SNAPSHOT = bool(int(snapshot))
+    with contextlib.redirect_stdout(io.StringIO()):
+        from proxy_server import get_proxy_server
+        imported = time.time()
+        server = get_proxy_server()
+        server.host, server.port = '127.0.0.1', int(port)
+        threading.Thread(target=server.start_server, daemon=True).start()
+        server.blocklist_ready.wait()
+        blocklist = time.time()
+        server.db.ready.wait()
+        database = time.time()
+    print(json.dumps({'started': started, 'imported': imported, 'blocklist': blocklist,
+                      'database': database}), flush=True)
+    time.sleep(3600)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sites', type=int, default=1000000, help='blocked sites in the database')
+    parser.add_argument('--runs', type=int, default=5, help='starts measured per mode')
+    parser.add_argument('--child', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        run_child(*args.child)
+        return
+
+    db_file = os.path.join(tempfile.mkdtemp(prefix='bench-startup-'), 'proxy.db')
+    started = time.perf_counter()
+    seed(db_file, args.sites)
+    results = {'sites': args.sites, 'seed_seconds': round(time.perf_counter() - started, 1)}
+    for name, snapshot in (('snapshot', True), ('database_rows', False)):
+        runs = [start_once(db_file, snapshot) for _ in range(args.runs)]
+        results[name] = {
+            metric: {'p50': round(percentile([run[metric] for run in runs], 50), 3),
+                     'max': round(max(run[metric] for run in runs), 3)}
+            for metric in runs[0]
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
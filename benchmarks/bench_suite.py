@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Proxy load-generation suite
+Starts the proxy in a child process against the local origin stand-ins and
+runs one workload after another: small GETs, GETs to blocked hosts, large
+downloads, uploads, long-lived CONNECT tunnels doing round trips, and bulk
+tunnel downloads. Each reports requests/second, throughput, latency
+percentiles and the proxy's peak RSS and thread count, as JSON.
+
+Save a run with --save and check a later one with --compare: metrics that got
+worse by more than --tolerance are listed and the exit status is 1, so a
+regression in request handling, tunnelling or block checks shows up.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+
+from common import (OriginServer, ProxyProcess, http_get, open_tunnel, raise_fd_limit,
+                    summarize_latencies)
+
+SCENARIOS = ('get', 'blocked', 'download', 'upload', 'tunnels', 'tunnel_download')
+
+# Compared metrics and whether a higher value is better
+COMPARED = (
+    ('requests_per_second', True),
+    ('throughput_mb_s', True),
+    ('latency.p50_ms', False),
+    ('latency.p99_ms', False),
+    ('peak_rss_mb', False),
+)
+
+BLOCKED_HOST = 'blocked.bench.test'
+
+
+async def sample_process(proxy, stop, peak):
+    """Track the proxy's peak RSS and thread count while a workload runs"""
+    while not stop.is_set():
+        for name, value in proxy.stats().items():
+            peak[name] = max(peak.get(name, 0), value)
+        try:
+            await asyncio.wait_for(stop.wait(), 0.2)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def request_loops(request, concurrency, duration):
+    """Run request() in concurrency loops for duration seconds"""
+    latencies, errors, received = [], [], []
+    deadline = time.monotonic() + duration
+
+    async def loop():
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                received.append(await request())
+                latencies.append(time.perf_counter() - start)
+            except (OSError, asyncio.IncompleteReadError):
+                errors.append(1)
+
+    await asyncio.gather(*(loop() for _ in range(concurrency)))
+    return latencies, len(errors), sum(received)
+
+
+async def tunnel_round_trips(proxy_port, target_port, count, duration, interval):
+    """Open count tunnels, then have each do a small echo round trip every interval seconds"""
+    latencies, errors = [], []
+    payload = b'x' * 64
+
+    async def connect():
+        try:
+            return await asyncio.wait_for(open_tunnel(proxy_port, target_port), 15)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            errors.append(1)
+            return None
+
+    async def round_trips(reader, writer, deadline):
+        try:
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                writer.write(payload)
+                await writer.drain()
+                await reader.readexactly(len(payload))
+                latencies.append(time.perf_counter() - start)
+                await asyncio.sleep(interval)
+        except (OSError, asyncio.IncompleteReadError):
+            errors.append(1)
+        finally:
+            writer.close()
+
+    # Every tunnel is open before the clock starts, as with long-lived browser tunnels
+    tunnels = [tunnel for tunnel in await asyncio.gather(*(connect() for _ in range(count))) if tunnel]
+    deadline = time.monotonic() + duration
+    await asyncio.gather(*(round_trips(reader, writer, deadline) for reader, writer in tunnels))
+    return latencies, len(errors), len(latencies) * len(payload) * 2
+
+
+async def tunnel_downloads(proxy_port, target_port, count, duration):
+    """Read as fast as possible through count tunnels for duration seconds"""
+    errors, received = [], []
+    deadline = time.monotonic() + duration
+
+    async def tunnel():
+        total = 0
+        try:
+            reader, writer = await asyncio.wait_for(open_tunnel(proxy_port, target_port), 15)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            errors.append(1)
+            return
+        try:
+            while time.monotonic() < deadline:
+                data = await reader.read(262144)
+                if not data:
+                    break
+                total += len(data)
+        except OSError:
+            errors.append(1)
+        finally:
+            writer.close()
+            received.append(total)
+
+    await asyncio.gather(*(tunnel() for _ in range(count)))
+    return [], len(errors), sum(received)
+
+
+def workloads(args, origin, proxy_port):
+    """Name -> coroutine factory taking the run duration"""
+    base = f'http://127.0.0.1:{origin.http_port}'
+    upload = b'u' * args.upload_size
+
+    async def post():
+        return len(upload) + await http_get(proxy_port, f'{base}/upload', 'POST', upload)
+
+    return {
+        'get': lambda duration: request_loops(
+            lambda: http_get(proxy_port, f'{base}/bytes/{args.get_size}'), args.concurrency, duration),
+        'blocked': lambda duration: request_loops(
+            lambda: http_get(proxy_port, f'http://{BLOCKED_HOST}/'), args.concurrency, duration),
+        'download': lambda duration: request_loops(
+            lambda: http_get(proxy_port, f'{base}/bytes/{args.download_size}'), args.transfers, duration),
+        'upload': lambda duration: request_loops(
+            post, args.transfers, duration),
+        'tunnels': lambda duration: tunnel_round_trips(
+            proxy_port, origin.echo_port, args.tunnels, duration, args.tunnel_interval),
+        'tunnel_download': lambda duration: tunnel_downloads(
+            proxy_port, origin.source_port, args.transfers, duration),
+    }
+
+
+async def run_scenario(name, workload, proxy, args):
+    if args.warmup:
+        await workload(args.warmup)
+    stop = asyncio.Event()
+    peak = {}
+    sampler = asyncio.ensure_future(sample_process(proxy, stop, peak))
+    started = time.perf_counter()
+    latencies, errors, received = await workload(args.duration)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await sampler
+    result = {
+        'throughput_mb_s': round(received / elapsed / 1e6, 2),
+        'errors': errors,
+        'peak_rss_mb': peak.get('rss_mb'),
+        'peak_threads': peak.get('threads')
+    }
+    if name not in ('tunnels', 'tunnel_download'):
+        result['requests_per_second'] = round(len(latencies) / elapsed, 1)
+    if latencies:
+        result['latency'] = summarize_latencies(latencies)
+    return result
+
+
+async def run_suite(args):
+    origin = OriginServer().start()
+    settings = {'LOG_LEVEL': 'OFF', 'LISTEN_BACKLOG': 1024, 'TUNNEL_IDLE_TIMEOUT': 60,
+                'MAX_CONNECTIONS': 0, 'MAX_CONNECTIONS_PER_CLIENT': 0}
+    proxy = ProxyProcess(args.engine, settings=settings, blocked_sites=[BLOCKED_HOST]).start()
+    results = {}
+    try:
+        available = workloads(args, origin, proxy.port)
+        for name in args.scenarios:
+            results[name] = await run_scenario(name, available[name], proxy, args)
+    finally:
+        proxy.stop()
+        origin.stop()
+    return results
+
+
+def metric(result, path):
+    for key in path.split('.'):
+        if not isinstance(result, dict) or key not in result:
+            return None
+        result = result[key]
+    return result
+
+
+def compare(baseline, current, tolerance):
+    """Metrics that got worse than the baseline by more than tolerance (a fraction)"""
+    regressions = []
+    for name, result in current['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if not before:
+            continue
+        for path, higher_is_better in COMPARED:
+            old, new = metric(before, path), metric(result, path)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append({'scenario': name, 'metric': path, 'baseline': old,
+                                    'current': new, 'change': f'{change:+.1%}'})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--engine', choices=('threaded', 'asyncio'), default='threaded')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--duration', type=float, default=5, help='measured seconds per scenario')
+    parser.add_argument('--warmup', type=float, default=1, help='unmeasured seconds before each scenario')
+    parser.add_argument('--concurrency', type=int, default=50, help='concurrent small requests')
+    parser.add_argument('--transfers', type=int, default=4, help='concurrent downloads/uploads')
+    parser.add_argument('--tunnels', type=int, default=500, help='long-lived tunnels held open')
+    parser.add_argument('--tunnel-interval', type=float, default=0.5,
+                        help='seconds between round trips on each tunnel')
+    parser.add_argument('--get-size', type=int, default=1024, help='small response size in bytes')
+    parser.add_argument('--download-size', type=int, default=16 * 1024 * 1024)
+    parser.add_argument('--upload-size', type=int, default=4 * 1024 * 1024)
+    parser.add_argument('--save', metavar='FILE', help='write the results as a baseline')
+    parser.add_argument('--compare', metavar='FILE', help='baseline to check the results against')
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help='allowed slowdown before a metric counts as a regression')
+    args = parser.parse_args()
+    raise_fd_limit()
+
+    report = {
+        'meta': {
+            'engine': args.engine,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'options': {name: value for name, value in vars(args).items()
+                        if name not in ('save', 'compare', 'tolerance', 'scenarios')}
+        },
+        'scenarios': asyncio.run(run_suite(args))
+    }
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('meta', {}).get('options') != report['meta']['options']:
+            print("Warning: baseline was recorded with different options", file=sys.stderr)
+        regressions = compare(baseline, report, args.tolerance)
+        report['regressions'] = regressions
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+CONNECT tunnel throughput benchmark
+Pushes bytes through tunnels to a local sink (upload) and pulls them from a
+local source (download), with splice on and off and different buffer sizes.
+Also checks on both engines that bytes sent in the same segment as the CONNECT
+head (as a TLS ClientHello often is) reach the target.
+"""
+
+import argparse
+import json
+import socket
+import threading
+import time
+
+from common import OriginServer, ProxyProcess, open_tunnel_socket, raise_fd_limit
+
+
+def upload(proxy_port, sink_port, total):
+    sock = open_tunnel_socket(proxy_port, sink_port)
+    block = memoryview(b'x' * 262144)
+    sent = 0
+    while sent < total:
+        sock.sendall(block)
+        sent += len(block)
+    sock.close()
+    return sent
+
+
+def download(proxy_port, source_port, total):
+    sock = open_tunnel_socket(proxy_port, source_port)
+    buffer = bytearray(262144)
+    received = 0
+    while received < total:
+        count = sock.recv_into(buffer)
+        if not count:
+            break
+        received += count
+    sock.close()
+    return received
+
+
+def early_data(proxy_port, echo_port, payload=b'HELLO-EARLY', timeout=5):
+    """Send the CONNECT head and payload in one write; returns the seconds until the
+    payload came back through the tunnel, or None if it never did"""
+    sock = socket.create_connection(('127.0.0.1', proxy_port))
+    sock.settimeout(timeout)
+    started = time.perf_counter()
+    try:
+        sock.sendall(f'CONNECT 127.0.0.1:{echo_port} HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n'.encode() + payload)
+        received = b''
+        while not received.endswith(payload):
+            data = sock.recv(65536)
+            if not data:
+                return None
+            received += data
+        if b' 200 ' not in received.split(b'\r\n', 1)[0]:
+            return None
+        return round(time.perf_counter() - started, 4)
+    except socket.timeout:
+        return None
+    finally:
+        sock.close()
+
+
+def measure(func, proxy_port, target_port, total, streams):
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(func(proxy_port, target_port, total)))
+               for _ in range(streams)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return round(sum(results) / elapsed / 1e6, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--megabytes', type=int, default=512, help='bytes per stream, in MB')
+    parser.add_argument('--streams', type=int, default=4, help='concurrent tunnels')
+    parser.add_argument('--buffers', type=int, nargs='+', default=[8192, 65536, 262144])
+    args = parser.parse_args()
+    raise_fd_limit()
+
+    origin = OriginServer().start()
+    total = args.megabytes * 1024 * 1024
+    results = []
+    for engine in ('threaded', 'asyncio'):
+        proxy = ProxyProcess(engine).start()
+        try:
+            results.append({'engine': engine, 'early_data_seconds': early_data(proxy.port, origin.echo_port)})
+        finally:
+            proxy.stop()
+    for splice in (False, True):
+        for buffer_size in args.buffers:
+            proxy = ProxyProcess(settings={'TUNNEL_SPLICE': splice,
+                                           'TUNNEL_BUFFER_SIZE': buffer_size}).start()
+            try:
+                results.append({
+                    'splice': splice,
+                    'buffer_size': buffer_size,
+                    'upload_mb_per_s': measure(upload, proxy.port, origin.sink_port, total, args.streams),
+                    'download_mb_per_s': measure(download, proxy.port, origin.source_port, total, args.streams),
+                    'proxy': proxy.stats()
+                })
+            finally:
+                proxy.stop()
+    origin.stop()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
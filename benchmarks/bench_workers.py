@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Multi-process worker scaling benchmark
+Runs the proxy with 1, 2, 4... SO_REUSEPORT worker processes and drives
+plain-HTTP load from several client processes, reporting requests/second
+for each worker count.
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import time
+
+from common import OriginServer, ProxyProcess, http_get, raise_fd_limit, summarize_latencies
+
+
+async def client_loops(proxy_port, url, concurrency, duration):
+    latencies, errors = [], []
+    deadline = time.monotonic() + duration
+
+    async def loop():
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                await http_get(proxy_port, url)
+                latencies.append(time.perf_counter() - start)
+            except OSError:
+                errors.append(1)
+
+    await asyncio.gather(*(loop() for _ in range(concurrency)))
+    return latencies, len(errors)
+
+
+def client_process(proxy_port, url, concurrency, duration, results):
+    raise_fd_limit()
+    results.put(asyncio.run(client_loops(proxy_port, url, concurrency, duration)))
+
+
+def drive_load(proxy_port, url, args):
+    """Run the client processes and combine their results"""
+    results = multiprocessing.Queue()
+    clients = [multiprocessing.Process(target=client_process,
+                                       args=(proxy_port, url, args.concurrency, args.duration, results))
+               for _ in range(args.clients)]
+    for client in clients:
+        client.start()
+    latencies, errors = [], 0
+    for _ in clients:
+        client_latencies, client_errors = results.get()
+        latencies.extend(client_latencies)
+        errors += client_errors
+    for client in clients:
+        client.join()
+    return latencies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--engine', choices=('threaded', 'asyncio'), default='threaded')
+    parser.add_argument('--clients', type=int, default=max(2, (os.cpu_count() or 2) // 2),
+                        help='load generator processes')
+    parser.add_argument('--concurrency', type=int, default=50, help='connections per client process')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of load per run')
+    parser.add_argument('--size', type=int, default=1024, help='response size in bytes')
+    args = parser.parse_args()
+    raise_fd_limit()
+
+    origin = OriginServer().start()
+    url = f'http://127.0.0.1:{origin.http_port}/bytes/{args.size}'
+    results = []
+    for workers in args.workers:
+        proxy = ProxyProcess(args.engine, settings={'PROXY_WORKERS': workers,
+                                                    'LISTEN_BACKLOG': 1024,
+                                                    'LOG_LEVEL': 'OFF'}).start()
+        try:
+            # The port answers as soon as the first worker binds it
+            time.sleep(2)
+            latencies, errors = drive_load(proxy.port, url, args)
+            results.append({
+                'workers': workers,
+                'engine': args.engine,
+                'requests_per_second': round(len(latencies) / args.duration, 1),
+                'request_errors': errors,
+                'latency': summarize_latencies(latencies)
+            })
+        finally:
+            proxy.stop()
+    origin.stop()
+
+    base = results[0]['requests_per_second'] or 1
+    for result in results:
+        result['speedup'] = round(result['requests_per_second'] / base, 2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
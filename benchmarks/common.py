@@ -0,0 +1,320 @@
+"""
+Shared helpers for the benchmark scripts: local origin servers, a proxy
+child process, and latency/process statistics.
+"""
+
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def raise_fd_limit():
+    """Allow as many open sockets as the hard limit permits"""
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"nothing listening on port {port}")
+
+
+def percentile(values, pct):
+    if not values:
+        return 0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize_latencies(values):
+    """Latency summary in milliseconds"""
+    return {
+        'count': len(values),
+        'p50_ms': round(percentile(values, 50) * 1000, 3),
+        'p90_ms': round(percentile(values, 90) * 1000, 3),
+        'p99_ms': round(percentile(values, 99) * 1000, 3),
+        'max_ms': round(max(values) * 1000, 3) if values else 0
+    }
+
+
+def process_stats(pid):
+    """RSS (MB) and thread count of a process, from /proc (Linux only)"""
+    stats = {}
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    stats['rss_mb'] = round(int(line.split()[1]) / 1024, 1)
+                elif line.startswith('Threads:'):
+                    stats['threads'] = int(line.split()[1])
+    except OSError:
+        pass
+    return stats
+
+
+class OriginServer:
+    """Local origin on its own event loop thread.
+
+    HTTP port:
+      GET /bytes/<n>   -> n bytes with Content-Length
+      GET /chunked/<n> -> n bytes with chunked encoding
+      GET /delay/<ms>  -> 1024 bytes after waiting ms milliseconds
+      GET /cacheable/<ms> -> like /delay, but cacheable for a minute
+      GET /drop/<ms>   -> closes the connection without a response after ms milliseconds
+      GET /static/<n>  -> n bytes starting with the request target, cacheable for a minute
+      POST anything    -> echoes the body length
+    Echo port: echoes raw bytes back (CONNECT tunnel target)
+    Sink port: discards everything it receives (tunnel upload target)
+    Source port: streams bytes until the client closes (tunnel download target)
+    """
+
+    def __init__(self):
+        self.http_port = free_port()
+        self.echo_port = free_port()
+        self.sink_port = free_port()
+        self.source_port = free_port()
+        self.requests = 0
+        self.loop = asyncio.new_event_loop()
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        self.ready.wait(10)
+        return self
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(asyncio.gather(
+            asyncio.start_server(self._http, '127.0.0.1', self.http_port, backlog=4096),
+            asyncio.start_server(self._echo, '127.0.0.1', self.echo_port, backlog=4096),
+            asyncio.start_server(self._sink, '127.0.0.1', self.sink_port, backlog=4096),
+            asyncio.start_server(self._source, '127.0.0.1', self.source_port, backlog=4096)
+        ))
+        self.ready.set()
+        self.loop.run_forever()
+
+    async def _http(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+                self.requests += 1
+                lines = head.decode('iso-8859-1').split('\r\n')
+                method, target = lines[0].split()[:2]
+                headers = {}
+                for line in lines[1:]:
+                    name, _, value = line.partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                if method == 'POST':
+                    remaining = int(headers.get('content-length', 0))
+                    received = 0
+                    while remaining:
+                        data = await reader.read(min(remaining, 65536))
+                        if not data:
+                            return
+                        remaining -= len(data)
+                        received += len(data)
+                    body = str(received).encode()
+                    writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n' % len(body) + body)
+                    await writer.drain()
+                    continue
+
+                size = int(target.rsplit('/', 1)[-1] or 0) if target.rsplit('/', 1)[-1].isdigit() else 1024
+                if '/delay/' in target or '/cacheable/' in target or '/drop/' in target:
+                    await asyncio.sleep(size / 1000)
+                    size = 1024
+                if '/drop/' in target:
+                    return
+                if '/static/' in target:
+                    prefix = target.encode()[:size]
+                    writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: %d\r\n'
+                                 b'Cache-Control: max-age=60\r\n\r\n' % size + prefix)
+                    await self._write_body(writer, size - len(prefix))
+                elif '/chunked/' in target:
+                    writer.write(b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n')
+                    await self._write_body(writer, size, chunked=True)
+                    writer.write(b'0\r\n\r\n')
+                else:
+                    cache_control = b'max-age=60' if '/cacheable/' in target else b'no-store'
+                    writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: %d\r\n'
+                                 b'Cache-Control: %s\r\n\r\n' % (size, cache_control))
+                    await self._write_body(writer, size)
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def _write_body(self, writer, size, chunked=False):
+        block = b'x' * 65536
+        while size > 0:
+            piece = block[:min(size, len(block))]
+            if chunked:
+                writer.write(b'%x\r\n' % len(piece) + piece + b'\r\n')
+            else:
+                writer.write(piece)
+            await writer.drain()
+            size -= len(piece)
+
+    async def _echo(self, reader, writer):
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                writer.write(data)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _sink(self, reader, writer):
+        try:
+            while await reader.read(262144):
+                pass
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _source(self, reader, writer):
+        block = b'x' * 262144
+        try:
+            while not reader.at_eof():
+                writer.write(block)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+class ProxyProcess:
+    """Runs a proxy engine in a child process with its own scratch database
+    (optionally seeded with blocked_sites)"""
+
+    def __init__(self, engine='threaded', port=None, settings=None, blocked_sites=()):
+        self.engine = engine
+        self.port = port or free_port()
+        self.settings = settings or {}
+        self.blocked_sites = list(blocked_sites)
+        self.workdir = tempfile.mkdtemp(prefix='proxy-bench-')
+        self.process = None
+
+    def start(self):
+        env = dict(os.environ, BENCH_PROXY_SETTINGS=json.dumps(self.settings),
+                   BENCH_BLOCKED_SITES=json.dumps(self.blocked_sites))
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--serve', self.engine, str(self.port)],
+            cwd=self.workdir, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        wait_for_port(self.port)
+        return self
+
+    def stats(self):
+        return process_stats(self.process.pid)
+
+    def stop(self):
+        if self.process:
+            self.process.terminate()
+            self.process.wait(10)
+            self.process = None
+
+
+def serve_proxy(engine, port):
+    """Child process entry point: apply settings overrides and run the proxy"""
+    raise_fd_limit()
+    import config
+    for name, value in json.loads(os.environ.get('BENCH_PROXY_SETTINGS', '{}')).items():
+        setattr(config, name, value)
+    from proxy_server import create_proxy_server
+    server = create_proxy_server(engine=engine, host='127.0.0.1', port=port)
+    blocked_sites = json.loads(os.environ.get('BENCH_BLOCKED_SITES', '[]'))
+    if blocked_sites:
+        server.import_blocked_sites(blocked_sites)
+    server.start_server()
+
+
+async def open_tunnel(proxy_port, target_port):
+    """Open a CONNECT tunnel through the proxy and return (reader, writer)"""
+    reader, writer = await asyncio.open_connection('127.0.0.1', proxy_port)
+    writer.write(f'CONNECT 127.0.0.1:{target_port} HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n'.encode())
+    await writer.drain()
+    status = await reader.readuntil(b'\r\n\r\n')
+    if b' 200 ' not in status.split(b'\r\n', 1)[0]:
+        writer.close()
+        raise ConnectionError(status.split(b'\r\n', 1)[0].decode())
+    return reader, writer
+
+
+def open_tunnel_socket(proxy_port, target_port):
+    """Blocking version of open_tunnel, for throughput measurements"""
+    sock = socket.create_connection(('127.0.0.1', proxy_port))
+    sock.sendall(f'CONNECT 127.0.0.1:{target_port} HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n'.encode())
+    status = b''
+    while b'\r\n\r\n' not in status:
+        data = sock.recv(1)
+        if not data:
+            raise ConnectionError('proxy closed during CONNECT')
+        status += data
+    if b' 200 ' not in status.split(b'\r\n', 1)[0]:
+        sock.close()
+        raise ConnectionError(status.split(b'\r\n', 1)[0].decode())
+    return sock
+
+
+async def http_get(proxy_port, url, method='GET', body=b''):
+    """Send one request through the proxy and read the whole response; returns bytes read"""
+    reader, writer = await asyncio.open_connection('127.0.0.1', proxy_port)
+    try:
+        request = f'{method} {url} HTTP/1.1\r\nHost: bench\r\nConnection: close\r\n'
+        if body:
+            request += f'Content-Length: {len(body)}\r\n'
+        writer.write(request.encode() + b'\r\n' + body)
+        await writer.drain()
+        total = 0
+        while True:
+            data = await reader.read(262144)
+            if not data:
+                return total
+            total += len(data)
+    finally:
+        writer.close()
+
+
+if __name__ == '__main__' and len(sys.argv) == 4 and sys.argv[1] == '--serve':
+    serve_proxy(sys.argv[2], int(sys.argv[3]))
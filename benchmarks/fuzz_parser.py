@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Request parser fuzzer
+Mutates the requests in parser_corpus/ and feeds them to the proxy's request
+parsing path (read_head with random segment sizes, parse_request,
+request_target, request_framing and the body framer). Any exception other
+than HTTPParseError/HTTPRelayError, or a result that depends on how the bytes
+were split across reads, is a failure; failing inputs are written to
+--crashes for replay.
+"""
+
+import argparse
+import os
+import random
+import sys
+
+from common import ROOT
+
+from http_parser import HTTPParseError, parse_request, request_framing, request_target
+from http_relay import BodyFramer, HTTPRelayError, read_head
+
+CORPUS = os.path.join(ROOT, 'benchmarks', 'parser_corpus')
+INTERESTING = [b'\r\n', b'\r', b'\n', b'\0', b' ', b'\t', b':', b',', b';', b'0', b'-1',
+               b'chunked', b'Content-Length: ', b'Transfer-Encoding: ', b'\xff', b'HTTP/1.1',
+               b'99999999999999999999', b'%', b'[', b'@', b'//']
+
+
+class SegmentedSocket:
+    """Stands in for a client socket that delivers data in random pieces"""
+
+    def __init__(self, data, rng):
+        self.data = data
+        self.pos = 0
+        self.rng = rng
+
+    def recv_into(self, buffer):
+        size = min(len(buffer), self.rng.randint(1, 64), len(self.data) - self.pos)
+        buffer[:size] = self.data[self.pos:self.pos + size]
+        self.pos += size
+        return size
+
+
+def mutate(data, corpus, rng):
+    data = bytearray(data)
+    for _ in range(rng.randint(1, 4)):
+        choice = rng.randrange(6)
+        pos = rng.randint(0, len(data))
+        if choice == 0 and data:
+            data[min(pos, len(data) - 1)] ^= 1 << rng.randrange(8)
+        elif choice == 1:
+            data[pos:pos] = rng.choice(INTERESTING)
+        elif choice == 2:
+            del data[pos:pos + rng.randint(1, 16)]
+        elif choice == 3:
+            other = rng.choice(corpus)
+            start = rng.randint(0, len(other))
+            data[pos:pos] = other[start:start + rng.randint(1, 64)]
+        elif choice == 4:
+            data[pos:pos] = data[pos:pos + rng.randint(1, 32)] * rng.randint(2, 8)
+        else:
+            del data[pos:]
+    return bytes(data)
+
+
+def parse(data, rng, limit):
+    """Run the request path over data; returns a summary of what was accepted"""
+    try:
+        head, rest = read_head(SegmentedSocket(data, rng), bytearray(4096), limit=limit)
+        if not head:
+            return ('closed',)
+        body = data[len(head):]
+        if not data.startswith(head) or not body.startswith(rest):
+            raise AssertionError("read_head returned bytes out of order")
+        method, target, version, headers, _ = parse_request(head)
+        if method.upper() != 'CONNECT':
+            request_target(target, headers)
+        framer = BodyFramer(*request_framing(headers))
+        end = framer.feed(body, 0, len(body)) if body else 0
+        return ('ok', head, end, framer.done)
+    except (HTTPParseError, HTTPRelayError) as e:
+        return ('rejected', type(e).__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--iterations', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--limit', type=int, default=8192, help='header size limit passed to read_head')
+    parser.add_argument('--crashes', default='parser_crashes', help='directory for failing inputs')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    corpus = [open(os.path.join(CORPUS, name), 'rb').read() for name in sorted(os.listdir(CORPUS))]
+    outcomes = {}
+    failures = 0
+    for iteration in range(args.iterations):
+        data = mutate(rng.choice(corpus), corpus, rng)
+        try:
+            first = parse(data, rng, args.limit)
+            # The outcome must not depend on how the bytes were split across reads
+            second = parse(data, random.Random(iteration), args.limit)
+            if first != second:
+                raise AssertionError(f"segmentation changed the result: {first!r} != {second!r}")
+        except Exception as e:
+            failures += 1
+            os.makedirs(args.crashes, exist_ok=True)
+            with open(os.path.join(args.crashes, f'crash-{iteration}.http'), 'wb') as crash:
+                crash.write(data)
+            print(f"iteration {iteration}: {type(e).__name__}: {e}", file=sys.stderr)
+            continue
+        outcomes[first[0]] = outcomes.get(first[0], 0) + 1
+
+    print(f"{args.iterations} inputs: {outcomes}, {failures} failures")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
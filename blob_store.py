@@ -0,0 +1,120 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+# Files younger than this may belong to a store still in progress and are never swept
+ORPHAN_GRACE = 60
+
+
+class BlobStore:
+    """Content-addressed files holding cached response bodies.
+
+    A body is stored under the SHA-256 of its bytes, so identical bodies cached
+    for different URLs share one file. The cache table refers to it by digest;
+    which blobs are still referenced is decided there (see ResponseCache).
+
+    Files are written under tmp/ and renamed into objects/, so a blob name
+    never points at a partial file. A crash can still leave temporary files,
+    blobs no cache row refers to, or trash from an interrupted clear(); sweep()
+    removes them. Size checks (see size()) catch a blob cut short by a crash
+    before it reached the disk.
+    """
+
+    def __init__(self, root, max_bytes=1024 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.objects = os.path.join(root, 'objects')
+        self.tmp = os.path.join(root, 'tmp')
+        os.makedirs(self.tmp, exist_ok=True)
+
+    def path(self, digest):
+        return os.path.join(self.objects, digest[:2], digest)
+
+    def put(self, data):
+        """Store data (bytes-like) and return its digest"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        try:
+            # Already stored: a fresh mtime keeps sweep() from taking it for an orphan
+            os.utime(path)
+            return digest
+        except FileNotFoundError:
+            pass
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temporary = tempfile.mkstemp(dir=self.tmp)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temporary, path)
+        except BaseException:
+            try:
+                os.unlink(temporary)
+            except OSError:
+                pass
+            raise
+        return digest
+
+    def size(self, digest):
+        """Size of a stored blob in bytes, or None if it is gone"""
+        try:
+            return os.stat(self.path(digest)).st_size
+        except OSError:
+            return None
+
+    def open(self, digest):
+        """The blob opened for reading; raises OSError if it was removed"""
+        return open(self.path(digest), 'rb')
+
+    def remove(self, digest):
+        try:
+            os.unlink(self.path(digest))
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        """Drop every blob: objects/ is renamed away at once and deleted in the background"""
+        trash = os.path.join(self.root, f"trash-{os.getpid()}-{time.monotonic_ns()}")
+        try:
+            os.replace(self.objects, trash)
+        except FileNotFoundError:
+            return
+        threading.Thread(target=shutil.rmtree, args=(trash, True), name='blob-clear', daemon=True).start()
+
+    def sweep(self, referenced, grace=ORPHAN_GRACE):
+        """Remove leftovers of interrupted writes and clears, and blobs not in referenced.
+
+        Only files older than grace seconds are removed, so a blob whose cache
+        row is about to be written survives. Returns the digests still on disk.
+        """
+        cutoff = time.time() - grace
+        for name in os.listdir(self.root):
+            if name.startswith('trash-'):
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+        for entry in os.scandir(self.tmp):
+            self._remove_older(entry, cutoff)
+
+        present = set()
+        try:
+            fanout = list(os.scandir(self.objects))
+        except FileNotFoundError:
+            return present
+        for directory in fanout:
+            if not directory.is_dir():
+                continue
+            for entry in os.scandir(directory.path):
+                if entry.name in referenced or not self._remove_older(entry, cutoff):
+                    present.add(entry.name)
+        return present
+
+    def _remove_older(self, entry, cutoff):
+        """Unlink a directory entry last modified before cutoff; True if it is gone"""
+        try:
+            if entry.stat().st_mtime >= cutoff:
+                return False
+            os.unlink(entry.path)
+        except FileNotFoundError:
+            pass
+        return True
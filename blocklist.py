@@ -0,0 +1,387 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+
+# Domains that belong to YouTube; any pattern mentioning "youtube" blocks every host
+# containing one of them (so country domains such as youtube.com.br are covered too)
+YOUTUBE_DOMAINS = frozenset({
+    'youtube.com',
+    'youtu.be',
+    'ytimg.com',
+    'googlevideo.com',
+    'ggpht.com',
+    'youtube-nocookie.com',
+    'youtubei.googleapis.com'
+})
+
+# Dotted patterns made only of hostname characters are treated as domains;
+# single labels such as "facebook" keep matching anywhere in the host as regexes
+DOMAIN_PATTERN = re.compile(r'^[a-z0-9_-]+(\.[a-z0-9_-]+)+$')
+
+
+# Names hosts files map to themselves, never worth blocking
+HOSTS_FILE_NAMES = frozenset({
+    'localhost',
+    'localhost.localdomain',
+    'local',
+    'broadcasthost',
+    'ip6-localhost',
+    'ip6-loopback',
+    '0.0.0.0'
+})
+
+# First line of a block list snapshot file, followed by the fingerprint and section sizes
+SNAPSHOT_MAGIC = 'proxy-blocklist-snapshot 1'
+
+
+def normalize_domain(host):
+    """Normalize domain for comparison"""
+    if not host:
+        return ""
+    host = host.lower().strip()
+    if host.startswith('www.'):
+        host = host[4:]
+    return host
+
+
+def clean_pattern(pattern):
+    """Reduce a URL or domain typed by a user to the pattern stored in the block list"""
+    pattern = pattern.strip().lower()
+
+    # Remove protocol
+    if '://' in pattern:
+        pattern = pattern.split('://', 1)[1]
+
+    # Remove path
+    if '/' in pattern:
+        pattern = pattern.split('/')[0]
+
+    # Remove www.
+    if pattern.startswith('www.'):
+        pattern = pattern[4:]
+    return pattern
+
+
+def parse_blocklist(lines):
+    """Yield the patterns in a block list file.
+
+    Accepts hosts-file lines ("0.0.0.0 ads.example.com", several names per
+    line allowed) as well as one plain domain or pattern per line. Comments
+    after '#' and loopback names are skipped.
+    """
+    for line in lines:
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        fields = line.split()
+        if len(fields) > 1 and (':' in fields[0] or fields[0].replace('.', '').isdigit()):
+            fields = fields[1:]
+        for field in fields:
+            pattern = clean_pattern(field)
+            if pattern and pattern not in HOSTS_FILE_NAMES:
+                yield pattern
+
+
+def format_blocklist(patterns, hosts=False):
+    """Yield the lines of a block list export, sorted.
+
+    The plain format has one pattern per line and imports back unchanged.
+    The hosts format maps every domain to 0.0.0.0; regex patterns cannot be
+    expressed there and are written as comments.
+    """
+    for pattern in sorted(patterns):
+        if not hosts:
+            yield f"{pattern}\n"
+        elif DOMAIN_PATTERN.match(pattern):
+            yield f"0.0.0.0 {pattern}\n"
+        else:
+            yield f"# regex: {pattern}\n"
+
+
+def host_suffixes(host):
+    """Yield host and every parent domain, longest first"""
+    yield host
+    index = host.find('.')
+    while index != -1:
+        yield host[index + 1:]
+        index = host.find('.', index + 1)
+
+
+class BlocklistMatcher:
+    """Compiled, immutable block list snapshot.
+
+    Plain domains live in a dict keyed by domain, so a lookup probes one key per
+    label of the host. A plain domain therefore blocks itself and its
+    subdomains only: example.com blocks www.example.com but not
+    myexample.com or example.com.evil.org. Real regex patterns are folded into
+    a single precompiled alternation that is only searched once the domain
+    lookup misses.
+
+    Patterns that normalize to the same domain (e.g. Example.com and
+    example.com) share its key; the extra ones are kept in shadowed so that
+    removing one of them leaves the domain blocked by the others.
+
+    A snapshot is never changed after it is built: updated() returns a new one
+    with a higher version, and the server swaps it in with a single assignment.
+    Request threads therefore match against a consistent list without locking.
+    """
+
+    def __init__(self, patterns=(), version=0):
+        self.version = version
+        self.patterns = frozenset(patterns)
+        self.domains = {}
+        self.shadowed = {}
+        self.regexes = {}
+        self.youtube_rules = set()
+        self.combined_regex = None
+        for pattern in self.patterns:
+            self._add(pattern)
+        self._compile_regexes()
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def __contains__(self, pattern):
+        return pattern in self.patterns
+
+    def __iter__(self):
+        return iter(self.patterns)
+
+    def _add(self, pattern):
+        """Index a pattern without recompiling the regex alternation"""
+        normalized = normalize_domain(pattern)
+        if not normalized:
+            return False
+
+        if 'youtube' in normalized:
+            self.youtube_rules.add(pattern)
+
+        if DOMAIN_PATTERN.match(normalized):
+            rule = self.domains.setdefault(normalized, pattern)
+            if rule != pattern:
+                self.shadowed.setdefault(normalized, set()).add(pattern)
+            return False
+
+        try:
+            self.regexes[pattern] = re.compile(normalized, re.IGNORECASE)
+        except re.error:
+            return False
+        return True
+
+    def _remove(self, pattern):
+        """Unindex a pattern; True if the regex alternation must be rebuilt"""
+        normalized = normalize_domain(pattern)
+        self.youtube_rules.discard(pattern)
+        others = self.shadowed.get(normalized)
+        if others is not None:
+            if self.domains.get(normalized) == pattern:
+                # Another pattern for the same domain takes over its key
+                self.domains[normalized] = others.pop()
+            else:
+                others.discard(pattern)
+            if not others:
+                del self.shadowed[normalized]
+        elif self.domains.get(normalized) == pattern:
+            del self.domains[normalized]
+        return self.regexes.pop(pattern, None) is not None
+
+    def _compile_regexes(self):
+        """Rebuild the single alternation over all regex patterns"""
+        if not self.regexes:
+            self.combined_regex = None
+            return
+        alternation = '|'.join(f'(?:{regex.pattern})' for regex in self.regexes.values())
+        try:
+            self.combined_regex = re.compile(alternation, re.IGNORECASE)
+        except re.error:
+            # Patterns with numbered backreferences cannot be combined
+            self.combined_regex = None
+
+    def updated(self, add=(), remove=()):
+        """A new snapshot with patterns added and removed; this one is left as it is.
+
+        The indexes are copied rather than rebuilt, so a small change to a large
+        list costs a dict copy instead of re-parsing every pattern.
+        """
+        add = set(add) - self.patterns
+        remove = set(remove) & self.patterns
+        snapshot = BlocklistMatcher.__new__(BlocklistMatcher)
+        snapshot.version = self.version + 1
+        snapshot.patterns = (self.patterns - remove) | add
+        snapshot.domains = dict(self.domains)
+        snapshot.shadowed = {key: set(others) for key, others in self.shadowed.items()}
+        snapshot.regexes = dict(self.regexes)
+        snapshot.youtube_rules = set(self.youtube_rules)
+        snapshot.combined_regex = self.combined_regex
+        recompile = False
+        for pattern in remove:
+            recompile |= snapshot._remove(pattern)
+        for pattern in add:
+            recompile |= snapshot._add(pattern)
+        if recompile:
+            snapshot._compile_regexes()
+        return snapshot
+
+    def save(self, path, fingerprint):
+        """Write the compiled indexes to path so load() can skip classifying every pattern.
+
+        fingerprint identifies the database state this snapshot was built from.
+        The file is written next to path and renamed over it, so a reader sees
+        either the old snapshot or the complete new one.
+        """
+        # Most domains are their own rule and are written once; the rest as key/rule line pairs
+        plain = [key for key, rule in self.domains.items() if key == rule]
+        aliased = [line for key, rule in self.domains.items() if key != rule for line in (key, rule)]
+        indexed = set(self.domains.values()) | set(self.regexes)
+        sections = (
+            plain,
+            aliased,
+            list(self.regexes),
+            sorted(self.youtube_rules),
+            sorted(self.patterns - indexed)
+        )
+        # Domains cannot contain a line break, other patterns might
+        if any('\n' in pattern for section in sections[2:] for pattern in section):
+            raise ValueError("a pattern contains a line break")
+        header = '\t'.join([SNAPSHOT_MAGIC, fingerprint] + [str(len(section)) for section in sections])
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as f:
+            f.write(header + '\n')
+            for section in sections:
+                if section:
+                    f.write('\n'.join(section) + '\n')
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path, version=0):
+        """(matcher, fingerprint) from a file written by save(), or None if it is missing or damaged.
+
+        Domains are already normalized and classified, so loading is one read
+        and a few splits; only the regex patterns are compiled again.
+        """
+        try:
+            with open(path, encoding='utf-8') as f:
+                lines = f.read().split('\n')
+        except (OSError, UnicodeDecodeError):
+            return None
+        header = lines[0].split('\t')
+        if len(header) != 7 or header[0] != SNAPSHOT_MAGIC:
+            return None
+        try:
+            sizes = [int(size) for size in header[2:]]
+        except ValueError:
+            return None
+        # Sizes count lines; the file ends with a newline
+        if len(lines) != sum(sizes) + 2 or lines[-1]:
+            return None
+        sections = []
+        start = 1
+        for size in sizes:
+            sections.append(lines[start:start + size])
+            start += size
+        plain, aliased, regex_rules, youtube_rules, others = sections
+
+        matcher = cls.__new__(cls)
+        matcher.version = version
+        matcher.domains = dict(zip(plain, plain))
+        matcher.domains.update(zip(aliased[::2], aliased[1::2]))
+        matcher.regexes = {}
+        for pattern in regex_rules:
+            try:
+                matcher.regexes[pattern] = re.compile(normalize_domain(pattern), re.IGNORECASE)
+            except re.error:
+                return None
+        matcher.youtube_rules = set(youtube_rules)
+        matcher.patterns = frozenset(plain).union(aliased[1::2], regex_rules, others)
+        # Patterns left out of the indexes are mostly ones sharing an indexed domain
+        matcher.shadowed = {}
+        for pattern in others:
+            normalized = normalize_domain(pattern)
+            if normalized in matcher.domains:
+                matcher.shadowed.setdefault(normalized, set()).add(pattern)
+        matcher._compile_regexes()
+        return matcher, header[1]
+
+    def match(self, host):
+        """Return (rule, reason) for a blocked host, or None if allowed"""
+        normalized_host = normalize_domain(host).rstrip('.')
+        if not normalized_host:
+            return None
+
+        domains = self.domains
+        for suffix in host_suffixes(normalized_host):
+            rule = domains.get(suffix)
+            if rule is not None:
+                reason = 'exact match' if suffix is normalized_host else 'subdomain match'
+                return rule, reason
+        if self.youtube_rules and any(domain in normalized_host for domain in YOUTUBE_DOMAINS):
+            return min(self.youtube_rules), 'YouTube-related'
+
+        if self.regexes:
+            combined = self.combined_regex
+            if combined is not None and not combined.search(normalized_host):
+                return None
+            for rule, regex in self.regexes.items():
+                if regex.search(normalized_host):
+                    return rule, 'regex match'
+
+        return None
+
+
+def describe_match(match):
+    """How a block decision is recorded in the access log, e.g. 'youtube.com (subdomain match)'"""
+    return f"{match[0]} ({match[1]})" if match else None
+
+
+class BlockDecisionCache:
+    """Bounded LRU of host -> block decision (the result of BlocklistMatcher.match).
+
+    Browsers open many connections to the same few hosts, so most checks are
+    answered here without matching. Entries belong to one block list
+    generation (the snapshot version): the first lookup against a newer
+    snapshot empties the cache, so a change takes effect on the next request.
+    Lookups still holding an older snapshot bypass the cache.
+    A max_entries of 0 disables caching.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.generation = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def match(self, host, blocklist):
+        """blocklist.match(host), answered from the cache when possible"""
+        if not self.max_entries:
+            return blocklist.match(host)
+        with self.lock:
+            if self.generation is None or blocklist.version > self.generation:
+                self.entries.clear()
+                self.generation = blocklist.version
+            elif blocklist.version == self.generation and host in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(host)
+                return self.entries[host]
+            self.misses += 1
+
+        decision = blocklist.match(host)
+        with self.lock:
+            # Skip results computed against a snapshot that has since been replaced
+            if self.generation == blocklist.version:
+                self.entries[host] = decision
+                if len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        return decision
+
+    def get_stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'block_cache_hits': self.hits,
+                'block_cache_misses': self.misses,
+                'block_cache_hit_ratio': round(self.hits / lookups, 3) if lookups else 0,
+                'block_cache_entries': len(self.entries)
+            }
@@ -0,0 +1,213 @@
+import asyncio
+import threading
+import time
+
+from http_cache import build_vary_key
+
+# Request headers that make a response specific to one client's request
+PRIVATE_REQUEST_HEADERS = ('if-none-match', 'if-modified-since', 'if-match', 'if-unmodified-since',
+                           'if-range', 'range')
+
+
+class CollapsedRequestError(Exception):
+    """The upstream fetch a follower was waiting on failed (status 502) or stalled (504)"""
+
+    def __init__(self, message, status=502):
+        super().__init__(message)
+        self.status = status
+
+
+class Flight:
+    """One upstream fetch that concurrent requests for the same URL wait on.
+
+    The leader publishes the response head (publish), then the body as it
+    arrives (feed) and finally finish() or fail(). Followers, and the
+    leader's own client, copy the same bytes from the start as they arrive. The whole body stays in memory until
+    the flight lands, so leaders only share responses of a known, bounded size.
+
+    outcome is None while the head is pending, then one of:
+      'shared'    - head and body are being published
+      'refreshed' - the origin confirmed the cached copy (304); read it from the cache
+      'unshared'  - the response is not for sharing; followers fetch it themselves
+      'failed'    - the upstream request failed (see error)
+
+    Threaded followers wait on the condition; asyncio followers register an
+    event that is set from whichever thread publishes.
+    """
+
+    def __init__(self, url, request_headers):
+        self.url = url
+        self.request_headers = request_headers
+        self.condition = threading.Condition()
+        self.waiters = []
+        self.outcome = None
+        self.head = None
+        self.vary = ''
+        self.body = bytearray()
+        self.complete = False
+        self.error = None
+
+    def publish(self, head, vary):
+        with self.condition:
+            self.head = head
+            self.vary = vary
+            self._change('shared')
+
+    def feed(self, data):
+        with self.condition:
+            self.body += data
+            self._change(self.outcome)
+
+    def finish(self):
+        with self.condition:
+            self.complete = True
+            self._change(self.outcome)
+
+    def refreshed(self):
+        with self.condition:
+            self._change('refreshed')
+
+    def unshare(self):
+        with self.condition:
+            self._change('unshared')
+
+    def fail(self, error):
+        with self.condition:
+            if self.complete or self.outcome in ('refreshed', 'unshared', 'failed'):
+                return
+            self.error = error
+            self._change('failed')
+
+    def matches(self, request_headers):
+        """Whether the shared response is the variant this request asks for (Vary)"""
+        if not self.vary:
+            return True
+        return build_vary_key(self.vary, request_headers) == build_vary_key(self.vary, self.request_headers)
+
+    def _change(self, outcome):
+        """Record a new state and wake every follower (caller holds the condition)"""
+        self.outcome = outcome
+        self.condition.notify_all()
+        for loop, event in self.waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def _head_known(self):
+        return self.outcome is not None
+
+    def _read(self, offset):
+        """(bytes past offset, body finished) once there is something new, else None"""
+        if self.outcome == 'failed':
+            raise CollapsedRequestError(f"upstream request failed: {self.error}")
+        if len(self.body) > offset or self.complete:
+            return bytes(self.body[offset:]), self.complete
+        return None
+
+    def wait_head(self, timeout):
+        """The outcome once the head is known, or None after timeout seconds"""
+        with self.condition:
+            self.condition.wait_for(self._head_known, timeout)
+            return self.outcome
+
+    def read(self, offset, timeout):
+        """Body bytes after offset as they arrive, b'' at the end.
+
+        Raises CollapsedRequestError if the fetch failed or sent nothing for
+        timeout seconds.
+        """
+        with self.condition:
+            result = self.condition.wait_for(lambda: self._read(offset), timeout)
+        if result is None:
+            raise CollapsedRequestError("upstream request stalled", 504)
+        return result[0]
+
+    async def wait_head_async(self, timeout):
+        return await self._wait_async(lambda: self.outcome if self._head_known() else None, timeout)
+
+    async def read_async(self, offset, timeout):
+        result = await self._wait_async(lambda: self._read(offset), timeout)
+        if result is None:
+            raise CollapsedRequestError("upstream request stalled", 504)
+        return result[0]
+
+    async def _wait_async(self, check, timeout):
+        """Like Condition.wait_for for a coroutine: check's first truthy result, or None"""
+        event = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), event)
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            self.waiters.append(waiter)
+        try:
+            while True:
+                with self.condition:
+                    result = check()
+                    if result:
+                        return result
+                    event.clear()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                try:
+                    await asyncio.wait_for(event.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self.condition:
+                self.waiters.remove(waiter)
+
+
+class RequestCollapser:
+    """Coalesces concurrent cacheable GETs for the same URL into one upstream fetch.
+
+    The first request for a URL leads a Flight; requests for the URL that
+    arrive while it is in the air follow it instead of contacting the origin.
+    Flights are keyed by URL; a follower whose Vary-selected request headers
+    differ from the leader's fetches for itself once the head shows the Vary.
+    """
+
+    def __init__(self, enabled=True, timeout=10):
+        self.enabled = enabled
+        self.timeout = timeout
+        self.flights = {}
+        self.lock = threading.Lock()
+        self.collapsed = 0
+        self.fallbacks = 0
+
+    def collapsible(self, request_headers):
+        """Conditional and range requests want a response of their own"""
+        return self.enabled and not any(name in request_headers for name in PRIVATE_REQUEST_HEADERS)
+
+    def join(self, url, request_headers):
+        """(flight, leading): the leader fetches and publishes, followers wait on the flight"""
+        with self.lock:
+            flight = self.flights.get(url)
+            if flight is not None:
+                return flight, False
+            flight = Flight(url, request_headers)
+            self.flights[url] = flight
+            return flight, True
+
+    def land(self, flight, error=None):
+        """Leader is done with the flight: later requests start a new one.
+
+        A flight that never finished fails its followers with error.
+        """
+        with self.lock:
+            if self.flights.get(flight.url) is flight:
+                del self.flights[flight.url]
+        flight.fail(error or CollapsedRequestError("upstream request ended early"))
+
+    def record(self, collapsed):
+        """Count a follower answered from the flight, or one that had to fetch for itself"""
+        with self.lock:
+            if collapsed:
+                self.collapsed += 1
+            else:
+                self.fallbacks += 1
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'collapsed_requests': self.collapsed,
+                'collapse_fallbacks': self.fallbacks,
+                'collapse_flights': len(self.flights)
+            }
@@ -5,22 +5,88 @@ PROXY_HOST = 'localhost'
 PROXY_PORT = 8080
 WEB_INTERFACE_HOST = 'localhost'
 WEB_INTERFACE_PORT = 5000
+STREAM_INTERVAL = 1  # Seconds between live dashboard updates pushed on /api/stream
+STREAM_KEEPALIVE = 15  # Seconds between keep-alive comments on an idle /api/stream
+PROXY_ENGINE = 'threaded'  # 'threaded' (thread per connection) or 'asyncio' (single event loop)
+LISTEN_BACKLOG = 128  # Pending connections the listening socket will queue
+PROXY_WORKERS = 1  # Worker processes sharing the proxy port with SO_REUSEPORT (1 = serve in-process)
+DRAIN_TIMEOUT = 10  # Seconds a stopping proxy lets open connections finish before closing them
+WORKER_STATS_INTERVAL = 1  # Seconds between stats reports from each worker
+
+# Admission control (connections over a limit get an immediate 503)
+MAX_CONNECTIONS = 1024  # Connections served at once (threaded engine: handler threads; 0 = unlimited)
+ACCEPT_QUEUE_SIZE = 256  # Threaded engine: accepted connections waiting for a free handler thread
+MAX_CONNECTIONS_PER_CLIENT = 256  # Open connections per client IP, queued ones included (0 = unlimited)
+
+# Rate limits (token buckets; 0 = unlimited). Relays pause instead of dropping data.
+# Also adjustable on the settings page; with PROXY_WORKERS > 1 each worker applies them on its own
+CLIENT_BYTES_PER_SECOND = 0  # Bytes relayed per second per client IP, both directions together
+CLIENT_REQUESTS_PER_SECOND = 0  # Requests (and CONNECTs) per second per client IP
+HOST_BYTES_PER_SECOND = 0  # Bytes relayed per second per destination host
+HOST_REQUESTS_PER_SECOND = 0  # Requests per second per destination host
+RATE_LIMIT_BURST = 1.0  # Seconds of traffic a bucket saves up for a burst after a quiet spell
+RATE_LIMIT_MAX_DELAY = 5  # Seconds a request may be held back before it is refused with 429
+RATE_LIMIT_TRACKED = 1024  # Clients and hosts (each) whose buckets and traffic totals are kept
 
 # Cache settings
 CACHE_ENABLED = True
 CACHE_DURATION = 300  # 5 minutes in seconds
-MAX_CACHE_SIZE = 100  # Maximum number of cached items
+MAX_CACHE_SIZE = 100  # Maximum number of cached items kept in memory
+CACHE_MAX_MEMORY = 64 * 1024 * 1024  # Maximum bytes of responses kept in memory
+CACHE_MAX_OBJECT_SIZE = 8 * 1024 * 1024  # Larger responses are never cached
+CACHE_MAX_STORED = 10000  # Maximum number of responses kept in the database
+CACHE_STORAGE = 'sqlite'  # or 'files': bodies in <DATABASE_FILE>.cache/, served with sendfile
+CACHE_DISK_MAX_BYTES = 1024 * 1024 * 1024  # Bytes of response bodies kept in files ('files' storage)
+COLLAPSE_REQUESTS = True  # Concurrent identical cacheable GETs share one upstream fetch
+COLLAPSE_TIMEOUT = 10  # Seconds a collapsed request waits on the shared fetch before giving up on it
+
+# Relay settings
+RELAY_BUFFER_SIZE = 64 * 1024  # Bytes read from the origin before forwarding to the client
+TUNNEL_IDLE_TIMEOUT = 120  # Seconds a CONNECT tunnel may stay idle in both directions
+TUNNEL_BUFFER_SIZE = 256 * 1024  # Bytes moved per read in each tunnel direction
+TUNNEL_SPLICE = True  # Use os.splice on Linux so tunnel bytes stay in the kernel
+TUNNEL_SOCKET_BUFFER = 0  # SO_RCVBUF/SO_SNDBUF for tunnel sockets (0 = OS default)
+KEEP_ALIVE_TIMEOUT = 15  # Seconds an idle client connection is kept open between requests
+UPSTREAM_MAX_PER_HOST = 32  # Connections (in use or idle) per origin host and port
+UPSTREAM_IDLE_TIMEOUT = 30  # Seconds an idle origin connection is kept for reuse
+
+# DNS cache settings
+DNS_CACHE_TTL = 60  # Seconds a resolved address is reused
+DNS_NEGATIVE_TTL = 10  # Seconds a failed lookup is remembered
+DNS_CACHE_SIZE = 10000  # Maximum number of cached host names
+DNS_HAPPY_EYEBALLS = False  # Race connections across resolved addresses (IPv6/IPv4)
+DNS_FALLBACK_DELAY = 0.25  # Seconds before starting the next address when racing
+
+# Block list settings
+BLOCK_CACHE_SIZE = 10000  # Hosts whose block decision is remembered (0 disables)
+BLOCKLIST_SNAPSHOT = True  # Keep a precompiled copy of the block list in <DATABASE_FILE>.blocklist for fast startup
 
 # Security settings
-MAX_REQUEST_SIZE = 8192  # 8KB
+MAX_REQUEST_SIZE = 32 * 1024  # Longest request head (request line and headers) accepted from a client
 CONNECTION_TIMEOUT = 30  # seconds
 
 # Logging settings
-LOG_LEVEL = 'INFO'
+LOG_LEVEL = 'INFO'  # DEBUG also logs allowed hosts; OFF disables proxy logging
 LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+METRICS_ENABLED = True  # Record per-phase latency histograms and counters for /metrics
+
+# Access log writer settings (records are dropped and counted when the queue is full)
+LOG_QUEUE_SIZE = 10000  # Maximum number of pending access log records
+LOG_BATCH_SIZE = 500  # Records written per transaction
+LOG_FLUSH_INTERVAL = 0.5  # Maximum seconds a record waits before being written
+LOG_RETENTION_DAYS = 30  # Daily log partitions older than this are dropped (0 keeps everything)
+LOG_RETENTION_INTERVAL = 3600  # Seconds between retention checks
+LOG_PAGE_SIZE = 200  # Rows per page on /logs
+LOG_EXPORT_BATCH_SIZE = 5000  # Rows read per query by /api/logs/export
+LOG_REBUILD_TOTALS = True  # Count existing log rows at startup (workers only count their own)
+LOG_RECENT_SIZE = 500  # Newest log records kept in memory for the live views
 
 # Database settings
 DATABASE_FILE = 'proxy_server.db'
+SQLITE_SYNCHRONOUS = 'NORMAL'  # With WAL, NORMAL only syncs at checkpoints; FULL syncs every commit
+SQLITE_CACHE_SIZE_KB = 16384  # Page cache per connection
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024  # Bytes of the database file read through mmap (0 disables)
+SQLITE_BUSY_TIMEOUT = 30  # Seconds a connection waits for a lock before failing
 
 # Default blocked sites (can be empty initially)
 DEFAULT_BLOCKED_SITES = []
\ No newline at end of file
@@ -0,0 +1,162 @@
+import select
+import socket
+import threading
+import time
+from collections import deque
+
+
+class PoolExhaustedError(OSError):
+    """Raised when no upstream connection frees up in time"""
+
+
+class UpstreamPool:
+    """Keep-alive connections to origin servers, keyed by (host, port).
+
+    At most max_per_host connections per origin exist at once, in use or idle.
+    Idle connections are closed after idle_timeout seconds and are checked on
+    reuse: one the origin has closed (or sent unexpected bytes on) is discarded.
+    """
+
+    def __init__(self, max_per_host=32, idle_timeout=30, connect_timeout=10, wait_timeout=30,
+                 connector=None):
+        self.connector = connector or socket.create_connection
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.wait_timeout = wait_timeout
+        self.idle = {}
+        self.counts = {}
+        self.condition = threading.Condition()
+        self.last_sweep = time.monotonic()
+
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+
+    def acquire(self, host, port, fresh=False):
+        """Return (socket, reused) for an origin, waiting while the host is at its limit"""
+        key = (host, port)
+        deadline = time.monotonic() + self.wait_timeout
+        with self.condition:
+            while True:
+                if not fresh:
+                    sock = self._pop_idle(key)
+                    if sock is not None:
+                        self.reused += 1
+                        return sock, True
+                if self.counts.get(key, 0) < self.max_per_host:
+                    self.counts[key] = self.counts.get(key, 0) + 1
+                    break
+                if fresh and self._close_one_idle(key):
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolExhaustedError(f"no free upstream connection to {host}:{port}")
+                self.condition.wait(remaining)
+
+        try:
+            sock = self.connect(host, port)
+        except Exception:
+            self._forget(key)
+            raise
+        self.created += 1
+        return sock, False
+
+    def connect(self, host, port):
+        """Open a new upstream connection"""
+        sock = self.connector((host, port), self.connect_timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def release(self, host, port, sock, reusable):
+        """Return a connection; it is kept for reuse only if reusable"""
+        key = (host, port)
+        if not reusable:
+            self._close(sock)
+            self._forget(key)
+            return
+        with self.condition:
+            self.idle.setdefault(key, deque()).append((sock, time.monotonic()))
+            self.condition.notify()
+            if time.monotonic() - self.last_sweep > self.idle_timeout:
+                self._sweep()
+
+    def close_all(self):
+        """Close every idle connection"""
+        with self.condition:
+            for key, connections in self.idle.items():
+                for sock, _ in connections:
+                    self._close(sock)
+                self.counts[key] -= len(connections)
+            self.idle.clear()
+            self.condition.notify_all()
+
+    def get_stats(self):
+        with self.condition:
+            idle = sum(len(connections) for connections in self.idle.values())
+            open_connections = sum(self.counts.values())
+        return {
+            'upstream_connections_created': self.created,
+            'upstream_connections_reused': self.reused,
+            'upstream_connections_open': open_connections,
+            'upstream_connections_idle': idle
+        }
+
+    def _pop_idle(self, key):
+        """Newest healthy idle connection for key, or None (caller holds the lock)"""
+        connections = self.idle.get(key)
+        now = time.monotonic()
+        while connections:
+            sock, released_at = connections.pop()
+            if now - released_at < self.idle_timeout and self._is_healthy(sock):
+                return sock
+            self._close(sock)
+            self.counts[key] -= 1
+            self.discarded += 1
+        return None
+
+    def _close_one_idle(self, key):
+        """Free a slot held by an idle connection (caller holds the lock)"""
+        connections = self.idle.get(key)
+        if not connections:
+            return False
+        sock, _ = connections.popleft()
+        self._close(sock)
+        self.counts[key] -= 1
+        return True
+
+    def _sweep(self):
+        """Close idle connections past their timeout (caller holds the lock)"""
+        now = time.monotonic()
+        self.last_sweep = now
+        for key, connections in list(self.idle.items()):
+            while connections and now - connections[0][1] >= self.idle_timeout:
+                sock, _ = connections.popleft()
+                self._close(sock)
+                self.counts[key] -= 1
+            if not connections:
+                del self.idle[key]
+
+    def _forget(self, key):
+        with self.condition:
+            self.counts[key] -= 1
+            if not self.counts[key]:
+                del self.counts[key]
+            self.condition.notify()
+
+    @staticmethod
+    def _is_healthy(sock):
+        """An idle keep-alive connection must have nothing to read"""
+        try:
+            poller = select.poll()
+            poller.register(sock, select.POLLIN)
+            return not poller.poll(0)
+        except (OSError, ValueError):
+            return False
+
+    @staticmethod
+    def _close(sock):
+        try:
+            sock.close()
+        except OSError:
+            pass
@@ -0,0 +1,86 @@
+import socket
+import threading
+
+
+def shutdown_socket(sock):
+    """Force a socket closed from another thread, waking any blocked reads or writes"""
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+class ConnectionTracker:
+    """Open client connections, so a stopping server can drain and then close them.
+
+    Each connection is registered with a function that force-closes it (more
+    can be attached, e.g. for the upstream side of a tunnel) and is marked idle
+    while it waits for its next request. Draining closes idle connections at
+    once, lets busy ones finish their current request, and closes whatever is
+    left at the deadline.
+    """
+
+    def __init__(self):
+        self.connections = {}
+        self.draining = False
+        self.changed = threading.Condition()
+
+    def __len__(self):
+        return len(self.connections)
+
+    def reset(self):
+        with self.changed:
+            self.draining = False
+
+    def add(self, key, close):
+        with self.changed:
+            self.connections[key] = [False, [close]]
+
+    def remove(self, key):
+        with self.changed:
+            self.connections.pop(key, None)
+            self.changed.notify_all()
+
+    def attach(self, key, close):
+        """Also run close when the connection is forced closed"""
+        with self.changed:
+            entry = self.connections.get(key)
+            if entry:
+                entry[1].append(close)
+
+    def detach(self, key, close):
+        with self.changed:
+            entry = self.connections.get(key)
+            if entry and close in entry[1]:
+                entry[1].remove(close)
+
+    def idle(self, key):
+        """Mark a connection as waiting for a request; False if it should close instead"""
+        with self.changed:
+            if self.draining:
+                return False
+            self.connections[key][0] = True
+            return True
+
+    def busy(self, key):
+        with self.changed:
+            self.connections[key][0] = False
+
+    def drain(self, timeout):
+        """Close idle connections, wait up to timeout for the rest, then force them closed.
+
+        Returns the number of connections that were still busy at the deadline.
+        """
+        with self.changed:
+            self.draining = True
+            idle = [closers for is_idle, closers in self.connections.values() if is_idle]
+        for closers in idle:
+            for close in closers:
+                close()
+        with self.changed:
+            self.changed.wait_for(lambda: not self.connections, timeout)
+            remaining = [list(closers) for _, closers in self.connections.values()]
+        for closers in remaining:
+            for close in closers:
+                close()
+        return len(remaining)
@@ -0,0 +1,64 @@
+import sqlite3
+import threading
+
+import config
+
+
+def pragmas():
+    """Connection pragmas from config, in the order they are applied"""
+    return (
+        ('journal_mode', 'WAL'),
+        ('synchronous', config.SQLITE_SYNCHRONOUS),
+        ('cache_size', -config.SQLITE_CACHE_SIZE_KB),
+        ('mmap_size', config.SQLITE_MMAP_SIZE),
+        ('temp_store', 'MEMORY'),
+        ('busy_timeout', int(config.SQLITE_BUSY_TIMEOUT * 1000)),
+    )
+
+
+def connect(db_file=None):
+    """Open a connection to the proxy database with the tuned pragmas applied.
+
+    In WAL mode readers see the last committed state without taking locks that
+    block a writer, and synchronous=NORMAL only syncs at checkpoints.
+    """
+    conn = sqlite3.connect(db_file or config.DATABASE_FILE, timeout=config.SQLITE_BUSY_TIMEOUT)
+    for name, value in pragmas():
+        conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
+
+class Database:
+    """Hands every thread its own connection to the proxy database.
+
+    sqlite3 connections must not be shared between threads without locking,
+    so each proxy, writer and Flask thread gets a private connection on first
+    use. Long-lived threads keep theirs; threads that serve one request and
+    exit (the web UI's) close() it when they are done.
+
+    With ready=False, connection() waits until ready is set: the owner can
+    check the schema in the background while the rest of it starts.
+    """
+
+    def __init__(self, db_file=None, ready=True):
+        self.db_file = db_file or config.DATABASE_FILE
+        self.local = threading.local()
+        self.ready = threading.Event()
+        if ready:
+            self.ready.set()
+
+    def connection(self):
+        """The calling thread's connection, opened on first use"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            self.ready.wait()
+            conn = connect(self.db_file)
+            self.local.conn = conn
+        return conn
+
+    def close(self):
+        """Close the calling thread's connection"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
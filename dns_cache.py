@@ -0,0 +1,216 @@
+import errno
+import os
+import selectors
+import socket
+import threading
+import time
+
+
+class _Lookup:
+    """A resolution in progress that other threads can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.addresses = None
+        self.error = None
+
+
+class DNSCache:
+    """Caching resolver in front of getaddrinfo.
+
+    getaddrinfo does not expose record TTLs, so successful lookups are kept for
+    ttl seconds and failures for negative_ttl seconds. Concurrent lookups of
+    the same name wait for the one already in flight instead of issuing their
+    own.
+    """
+
+    def __init__(self, ttl=60, negative_ttl=10, max_entries=10000,
+                 happy_eyeballs=False, fallback_delay=0.25, metrics=None):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.happy_eyeballs = happy_eyeballs
+        self.fallback_delay = fallback_delay
+        self.metrics = metrics
+
+        self.entries = {}
+        self.lookups = {}
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.coalesced = 0
+
+    def resolve(self, host, port, wait=True):
+        """Return getaddrinfo-style results for host with port filled in.
+
+        With wait=False only the cache is consulted and None is returned on a
+        miss, so callers on an event loop can avoid blocking.
+        """
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(host)
+            if entry is not None and entry[0] > now:
+                addresses, error = entry[1], entry[2]
+                if error is not None:
+                    self.negative_hits += 1
+                    raise error
+                self.hits += 1
+                return self._with_port(addresses, port)
+            if not wait:
+                return None
+
+            lookup = self.lookups.get(host)
+            leader = lookup is None
+            if leader:
+                lookup = self.lookups[host] = _Lookup()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            lookup.done.wait()
+        else:
+            try:
+                lookup.addresses = socket.getaddrinfo(host, None, 0, socket.SOCK_STREAM)
+            except (OSError, UnicodeError) as e:
+                lookup.error = e
+            finally:
+                self._finish(host, lookup)
+
+        if lookup.error is not None:
+            raise lookup.error
+        return self._with_port(lookup.addresses, port)
+
+    def create_connection(self, address, timeout=10):
+        """Connect to a (host, port) address using cached addresses"""
+        host, port = address
+        started = time.perf_counter()
+        addresses = self.resolve(host, port)
+        if self.metrics is not None:
+            self.metrics.observe('dns', started)
+            started = time.perf_counter()
+        sock = self._connect(host, addresses, timeout)
+        if self.metrics is not None:
+            self.metrics.observe('upstream_connect', started)
+        return sock
+
+    def _connect(self, host, addresses, timeout):
+        if self.happy_eyeballs and len(addresses) > 1:
+            return self._connect_racing(addresses, timeout)
+
+        error = None
+        for family, type_, proto, _, sockaddr in addresses:
+            sock = socket.socket(family, type_, proto)
+            try:
+                sock.settimeout(timeout)
+                sock.connect(sockaddr)
+                return sock
+            except OSError as e:
+                error = e
+                sock.close()
+        raise error or OSError(f"no addresses for {host}")
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def get_stats(self):
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            'dns_hits': self.hits,
+            'dns_misses': self.misses,
+            'dns_negative_hits': self.negative_hits,
+            'dns_coalesced': self.coalesced,
+            'dns_hit_ratio': round((self.hits + self.negative_hits) / lookups, 3) if lookups else 0,
+            'dns_entries': len(self.entries)
+        }
+
+    def _finish(self, host, lookup):
+        ttl = self.ttl if lookup.error is None else self.negative_ttl
+        with self.lock:
+            if len(self.entries) >= self.max_entries:
+                self._evict()
+            self.entries[host] = (time.monotonic() + ttl, lookup.addresses, lookup.error)
+            del self.lookups[host]
+        lookup.done.set()
+
+    def _evict(self):
+        """Drop expired entries, or the oldest tenth if none have expired (caller holds the lock)"""
+        now = time.monotonic()
+        expired = [host for host, entry in self.entries.items() if entry[0] <= now]
+        if not expired:
+            expired = list(self.entries)[:max(1, len(self.entries) // 10)]
+        for host in expired:
+            del self.entries[host]
+
+    @staticmethod
+    def _with_port(addresses, port):
+        return [
+            (family, type_, proto, canonname, (sockaddr[0], port) + tuple(sockaddr[2:]))
+            for family, type_, proto, canonname, sockaddr in addresses
+        ]
+
+    @staticmethod
+    def _interleave(addresses):
+        """Alternate address families, starting with the first one returned"""
+        by_family = {}
+        for address in addresses:
+            by_family.setdefault(address[0], []).append(address)
+        groups = list(by_family.values())
+        ordered = []
+        while any(groups):
+            for group in groups:
+                if group:
+                    ordered.append(group.pop(0))
+        return ordered
+
+    def _connect_racing(self, addresses, timeout):
+        """Happy-eyeballs connect: start the next address if the current one is slow"""
+        candidates = self._interleave(addresses)
+        deadline = time.monotonic() + timeout
+        connecting = []
+        error = None
+        next_attempt = 0
+        try:
+            while True:
+                now = time.monotonic()
+                if candidates and (not connecting or now >= next_attempt):
+                    family, type_, proto, _, sockaddr = candidates.pop(0)
+                    sock = socket.socket(family, type_, proto)
+                    sock.setblocking(False)
+                    result = sock.connect_ex(sockaddr)
+                    if result in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                        connecting.append(sock)
+                        next_attempt = now + self.fallback_delay
+                    else:
+                        error = OSError(result, os.strerror(result))
+                        sock.close()
+                    continue
+
+                if not connecting:
+                    raise error or OSError("all connection attempts failed")
+                if now >= deadline:
+                    raise socket.timeout("timed out")
+
+                wait = deadline - now
+                if candidates:
+                    wait = min(wait, max(0, next_attempt - now))
+                with selectors.DefaultSelector() as selector:
+                    for sock in connecting:
+                        selector.register(sock, selectors.EVENT_WRITE)
+                    writable = [key.fileobj for key, _ in selector.select(wait)]
+                for sock in writable:
+                    result = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    connecting.remove(sock)
+                    if result == 0:
+                        sock.settimeout(timeout)
+                        return sock
+                    error = OSError(result, os.strerror(result))
+                    sock.close()
+                    # A failed attempt starts the next one straight away
+                    next_attempt = 0
+        finally:
+            for sock in connecting:
+                sock.close()
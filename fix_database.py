@@ -1,13 +1,23 @@
 import sqlite3
 import os
 from datetime import datetime
+import config
+from database import pragmas
+from log_store import INDEXES, LEGACY_TABLE, AccessLogStore
+
+DB_FILE = config.DATABASE_FILE
 
 def backup_database():
     """Create backup of existing database"""
-    if os.path.exists('proxy_server.db'):
+    if os.path.exists(DB_FILE):
         backup_name = f'proxy_server_backup_{datetime.now().strftime("%Y%m%d_%H%M%S")}.db'
-        import shutil
-        shutil.copy('proxy_server.db', backup_name)
+        # The backup API also copies changes still in the WAL file
+        source = sqlite3.connect(DB_FILE)
+        target = sqlite3.connect(backup_name)
+        with target:
+            source.backup(target)
+        target.close()
+        source.close()
         print(f"Database backed up to: {backup_name}")
         return True
     return False
@@ -23,32 +33,66 @@ def migrate_database():
     print("Starting database migration...")
     
     # Connect to database
-    conn = sqlite3.connect('proxy_server.db')
+    conn = sqlite3.connect(DB_FILE)
     cursor = conn.cursor()
     
     try:
-        # Check if access_logs table exists
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='access_logs'")
+        apply_pragmas(cursor)
+        
+        # Check if cache table exists
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='cache'")
         if not cursor.fetchone():
-            print("access_logs table doesn't exist!")
+            print("cache table doesn't exist!")
             print("Creating new database schema...")
             create_fresh_database(conn, cursor)
             return
         
-        # Check if 'blocked' column exists
-        if not check_column_exists(cursor, 'access_logs', 'blocked'):
-            print(" 'blocked' column missing in access_logs table")
-            print(" Adding 'blocked' column...")
-            
-            cursor.execute("""
-                ALTER TABLE access_logs 
-                ADD COLUMN blocked INTEGER DEFAULT 0
-            """)
-            
+        # Logs from before partitioning stay in access_logs until they expire
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (LEGACY_TABLE,))
+        if cursor.fetchone():
+            if not check_column_exists(cursor, LEGACY_TABLE, 'blocked'):
+                print(" 'blocked' column missing in access_logs table")
+                print(" Adding 'blocked' column...")
+                
+                cursor.execute("""
+                    ALTER TABLE access_logs 
+                    ADD COLUMN blocked INTEGER DEFAULT 0
+                """)
+                
+                conn.commit()
+                print("Successfully added 'blocked' column")
+            if not check_column_exists(cursor, LEGACY_TABLE, 'host'):
+                print(" Adding 'host' column to access_logs...")
+                cursor.execute("ALTER TABLE access_logs ADD COLUMN host TEXT")
+            print(" Indexing access_logs by timestamp (may take a while on large tables)...")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_access_logs_ts ON access_logs (timestamp)")
             conn.commit()
-            print("Successfully added 'blocked' column")
         else:
-            print(" Database is up to date")
+            print(" No pre-partitioning access_logs table")
+        
+        # Log tables from older versions lack the matched block rule column
+        for table in AccessLogStore().partitions(conn):
+            if not check_column_exists(cursor, table, 'block_rule'):
+                print(f" Adding 'block_rule' column to {table}...")
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN block_rule TEXT")
+        conn.commit()
+        
+        # Daily log partitions need every index the log store queries with
+        for table in AccessLogStore().partitions(conn):
+            if table == LEGACY_TABLE:
+                continue
+            for suffix, columns in INDEXES:
+                cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_{suffix} ON {table} ({columns})")
+        conn.commit()
+        
+        # Add cache revalidation and blob file columns
+        for column, column_type in (('etag', 'TEXT'), ('last_modified', 'TEXT'), ('vary_key', 'TEXT'),
+                                    ('head', 'BLOB'), ('blob', 'TEXT'), ('size', 'INTEGER')):
+            if not check_column_exists(cursor, 'cache', column):
+                print(f" Adding '{column}' column to cache...")
+                cursor.execute(f"ALTER TABLE cache ADD COLUMN {column} {column_type}")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_cache_blob ON cache(blob)")
+        conn.commit()
         
         # Verify all required tables exist
         verify_schema(cursor)
@@ -74,18 +118,7 @@ def create_fresh_database(conn, cursor):
         )
     ''')
     
-    # Create access_logs table with 'blocked' column
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS access_logs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            client_ip TEXT,
-            url TEXT,
-            method TEXT,
-            status_code INTEGER,
-            blocked INTEGER DEFAULT 0,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
+    # Access log partitions (access_logs_YYYYMMDD) are created by the proxy as it logs
     
     # Create cache table
     cursor.execute('''
@@ -94,19 +127,32 @@ def create_fresh_database(conn, cursor):
             content BLOB,
             content_type TEXT,
             expires TIMESTAMP,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            etag TEXT,
+            last_modified TEXT,
+            vary_key TEXT,
+            head BLOB,
+            blob TEXT,
+            size INTEGER
         )
     ''')
     
     conn.commit()
     print("Fresh database created with correct schema")
 
+def apply_pragmas(cursor):
+    """Switch to WAL and apply the tuned pragmas the proxy uses"""
+    for name, value in pragmas():
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.execute("PRAGMA journal_mode")
+    print(f" Journal mode: {cursor.fetchone()[0]}")
+
 def verify_schema(cursor):
     """Verify all tables and columns exist"""
     required_tables = {
         'blocked_sites': ['id', 'url_pattern', 'created_at'],
-        'access_logs': ['id', 'client_ip', 'url', 'method', 'status_code', 'blocked', 'timestamp'],
-        'cache': ['url', 'content', 'content_type', 'expires', 'created_at']
+        'cache': ['url', 'content', 'content_type', 'expires', 'created_at',
+                  'etag', 'last_modified', 'vary_key', 'head', 'blob', 'size']
     }
     
     print("\n Verifying database schema...")
@@ -120,6 +166,9 @@ def verify_schema(cursor):
             print(f" Table '{table}' missing columns: {missing}")
         else:
             print(f" Table '{table}' - OK ({len(existing_columns)} columns)")
+    
+    cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name LIKE 'access_logs_%'")
+    print(f" Access log partitions: {cursor.fetchone()[0]}")
 
 def main():
     """Main entry point"""
@@ -127,11 +176,12 @@ def main():
     print("   HTTP Proxy Server                      \n")
     
     # Check if database exists
-    if not os.path.exists('proxy_server.db'):
+    if not os.path.exists(DB_FILE):
         print(" No existing database found")
         print(" Creating new database...")
-        conn = sqlite3.connect('proxy_server.db')
+        conn = sqlite3.connect(DB_FILE)
         cursor = conn.cursor()
+        apply_pragmas(cursor)
         create_fresh_database(conn, cursor)
         conn.close()
     else:
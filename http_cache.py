@@ -0,0 +1,417 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from http_parser import parse_response_head
+
+CACHEABLE_STATUS = {200, 203, 301, 410}
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def parse_cache_control(value):
+    """Parse a Cache-Control header into {directive: argument}"""
+    directives = {}
+    for part in (value or '').split(','):
+        name, _, argument = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = argument.strip().strip('"')
+    return directives
+
+
+def parse_http_date(value):
+    """Parse an HTTP date into a unix timestamp, or None"""
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def to_db_time(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime(TIMESTAMP_FORMAT)
+
+
+def from_db_time(value):
+    try:
+        return datetime.strptime(value, TIMESTAMP_FORMAT).replace(tzinfo=timezone.utc).timestamp()
+    except (TypeError, ValueError):
+        return 0
+
+
+def freshness_lifetime(headers, default_ttl):
+    """Seconds a response stays fresh, from Cache-Control, Expires or the default"""
+    cache_control = parse_cache_control(headers.get('cache-control'))
+    if 'no-cache' in cache_control:
+        return 0
+    for directive in ('s-maxage', 'max-age'):
+        if directive in cache_control:
+            try:
+                return max(0, int(cache_control[directive]))
+            except ValueError:
+                return 0
+    if 'expires' in headers:
+        expires = parse_http_date(headers['expires'])
+        if expires is None:
+            return 0
+        date = parse_http_date(headers.get('date')) or time.time()
+        return max(0, expires - date)
+    return default_ttl
+
+
+def build_vary_key(vary, request_headers):
+    """Encode the request header values a response varies on"""
+    names = sorted({name.strip().lower() for name in vary.split(',') if name.strip()})
+    return '\n'.join(f"{name}={request_headers.get(name, '')}" for name in names)
+
+
+def split_response(response):
+    """(head, body) of a raw response; the body is a view, not a copy"""
+    head_end = response.find(b'\r\n\r\n') + 4
+    return response[:head_end], memoryview(response)[head_end:]
+
+
+class CacheEntry:
+    """A cached response: raw head and body plus validators and expiry.
+
+    With file storage the body is not held here: blob names the file holding
+    its body_size bytes, which is sent to clients straight from disk.
+    """
+
+    __slots__ = ('url', 'head', 'body', 'blob', 'body_size', 'status_code', 'headers',
+                 'etag', 'last_modified', 'expires', 'vary_key')
+
+    def __init__(self, url, head, body, etag, last_modified, expires, vary_key, blob=None, body_size=None):
+        self.url = url
+        self.head = head
+        self.body = body
+        self.blob = blob
+        self.body_size = len(body) if body_size is None else body_size
+        self.status_code, self.headers = parse_response_head(head)
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires = expires
+        self.vary_key = vary_key or ''
+
+    @property
+    def size(self):
+        return len(self.head) + self.body_size
+
+    @property
+    def memory_size(self):
+        """Bytes this entry keeps in memory"""
+        return len(self.head) + (0 if self.blob else self.body_size)
+
+    def is_fresh(self):
+        return time.time() < self.expires
+
+    def has_validators(self):
+        return bool(self.etag or self.last_modified)
+
+    def matches(self, request_headers):
+        """Check the request selects the same variant (Vary)"""
+        if not self.vary_key:
+            return True
+        names = ','.join(line.partition('=')[0] for line in self.vary_key.split('\n'))
+        return build_vary_key(names, request_headers) == self.vary_key
+
+    def conditional_headers(self):
+        """Headers to revalidate this entry with the origin"""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    """Two-tier HTTP response cache.
+
+    The first tier is an in-process LRU bounded by entry count and total bytes.
+    The second tier is the SQLite `cache` table, which survives restarts and
+    holds entries that were evicted from memory.
+
+    Without blobs the table holds each whole response in its content column.
+    With a BlobStore it holds only the head and metadata; bodies live in blob
+    files, capped at blobs.max_bytes in total, and the memory tier keeps just
+    the heads.
+    """
+
+    def __init__(self, db, max_entries=100, max_bytes=64 * 1024 * 1024,
+                 max_object_size=8 * 1024 * 1024, max_stored=10000, default_ttl=300, blobs=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_object_size = max_object_size
+        self.max_stored = max_stored
+        self.default_ttl = default_ttl
+
+        self.entries = OrderedDict()
+        self.memory_bytes = 0
+        self.lock = threading.Lock()
+
+        self.db = db
+        self.blobs = blobs
+        self.stores_since_prune = 0
+        self.bytes_since_prune = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.bytes_served = 0
+        self.bytes_stored = 0
+
+    def is_cacheable_request(self, method, request_headers):
+        """Only plain GETs without credentials are served from cache"""
+        if method.upper() != 'GET':
+            return False
+        if 'authorization' in request_headers:
+            return False
+        return 'no-store' not in parse_cache_control(request_headers.get('cache-control'))
+
+    def lookup(self, url, request_headers):
+        """Return the cached entry for url (fresh or stale), or None"""
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is not None:
+                self.entries.move_to_end(url)
+
+        if entry is None:
+            entry = self._load(url)
+            if entry is not None:
+                self._remember(entry)
+
+        if entry is None or not entry.matches(request_headers):
+            return None
+        if entry.blob and self.blobs.size(entry.blob) != entry.body_size:
+            # Evicted by another process, or cut short by a crash
+            self._forget(entry)
+            return None
+        return entry
+
+    def open_body(self, entry):
+        """An entry's blob file opened for reading, or None if the body is in memory.
+
+        Raises OSError if the blob was removed since lookup().
+        """
+        return self.blobs.open(entry.blob) if entry.blob else None
+
+    def can_serve(self, entry, request_headers):
+        """Check an entry can be served without contacting the origin"""
+        cache_control = parse_cache_control(request_headers.get('cache-control'))
+        if 'no-cache' in cache_control or 'no-cache' in request_headers.get('pragma', ''):
+            return False
+        return entry.is_fresh()
+
+    def is_storable(self, status_code, headers):
+        """Whether a response may be kept and given to other clients at all"""
+        if status_code not in CACHEABLE_STATUS:
+            return False
+        cache_control = parse_cache_control(headers.get('cache-control'))
+        if 'no-store' in cache_control or 'private' in cache_control:
+            return False
+        if 'set-cookie' in headers:
+            return False
+        return headers.get('vary', '').strip() != '*'
+
+    def can_share(self, status_code, headers):
+        """Whether a response being fetched may also answer concurrent identical requests"""
+        return self.is_storable(status_code, headers) and freshness_lifetime(headers, self.default_ttl) > 0
+
+    def store(self, url, request_headers, response):
+        """Store a complete raw response if it is cacheable"""
+        if len(response) > self.max_object_size:
+            return False
+        status_code, headers = parse_response_head(response)
+        if not self.is_storable(status_code, headers):
+            return False
+
+        vary = headers.get('vary', '')
+        etag = headers.get('etag')
+        last_modified = headers.get('last-modified')
+        lifetime = freshness_lifetime(headers, self.default_ttl)
+        if lifetime <= 0 and not (etag or last_modified):
+            return False
+
+        response = bytes(response)
+        head, body = split_response(response)
+        expires = time.time() + lifetime
+        vary_key = build_vary_key(vary, request_headers)
+        if self.blobs is not None:
+            entry = CacheEntry(url, head, None, etag, last_modified, expires, vary_key,
+                               blob=self.blobs.put(body), body_size=len(body))
+            response = None
+        else:
+            entry = CacheEntry(url, head, body, etag, last_modified, expires, vary_key)
+        self._remember(entry)
+        self._save(entry, headers.get('content-type'), response)
+        self.bytes_stored += entry.size
+        return True
+
+    def refresh(self, entry, headers):
+        """Update an entry after the origin answered 304 Not Modified"""
+        entry.expires = time.time() + freshness_lifetime(headers, self.default_ttl)
+        if headers.get('etag'):
+            entry.etag = headers['etag']
+        conn = self.db.connection()
+        with conn:
+            conn.execute(
+                "UPDATE cache SET expires = ?, etag = ? WHERE url = ?",
+                (to_db_time(entry.expires), entry.etag, entry.url)
+            )
+
+    def record_hit(self, entry, revalidated=False):
+        if revalidated:
+            self.revalidations += 1
+        else:
+            self.hits += 1
+        self.bytes_served += entry.size
+
+    def record_miss(self):
+        self.misses += 1
+
+    def clear(self):
+        """Drop every entry from both tiers"""
+        self.clear_memory()
+        conn = self.db.connection()
+        with conn:
+            conn.execute("DELETE FROM cache")
+        if self.blobs is not None:
+            self.blobs.clear()
+
+    def clear_memory(self):
+        """Drop the in-memory tier only (the shared tier was cleared by another process)"""
+        with self.lock:
+            self.entries.clear()
+            self.memory_bytes = 0
+
+    def sweep(self):
+        """Clean up after a crash: drop blob files no row refers to and rows whose blob is gone"""
+        if self.blobs is None:
+            return
+        conn = self.db.connection()
+        referenced = {row[0] for row in conn.execute("SELECT DISTINCT blob FROM cache WHERE blob IS NOT NULL")}
+        missing = referenced - self.blobs.sweep(referenced)
+        if missing:
+            with conn:
+                conn.executemany("DELETE FROM cache WHERE blob = ?", [(digest,) for digest in missing])
+
+    def get_stats(self):
+        lookups = self.hits + self.revalidations + self.misses
+        return {
+            'cache_hits': self.hits,
+            'cache_misses': self.misses,
+            'cache_revalidations': self.revalidations,
+            'cache_hit_ratio': round((self.hits + self.revalidations) / lookups, 3) if lookups else 0,
+            'cache_bytes_served': self.bytes_served,
+            'cache_bytes_stored': self.bytes_stored,
+            'cache_memory_items': len(self.entries),
+            'cache_memory_bytes': self.memory_bytes
+        }
+
+    def _remember(self, entry):
+        """Insert into the memory LRU, evicting least recently used entries"""
+        with self.lock:
+            old = self.entries.pop(entry.url, None)
+            if old is not None:
+                self.memory_bytes -= old.memory_size
+            self.entries[entry.url] = entry
+            self.memory_bytes += entry.memory_size
+            while self.entries and (len(self.entries) > self.max_entries
+                                    or self.memory_bytes > self.max_bytes):
+                _, evicted = self.entries.popitem(last=False)
+                self.memory_bytes -= evicted.memory_size
+
+    def _forget(self, entry):
+        """Drop an entry whose blob is gone from both tiers"""
+        with self.lock:
+            if self.entries.get(entry.url) is entry:
+                del self.entries[entry.url]
+                self.memory_bytes -= entry.memory_size
+        conn = self.db.connection()
+        with conn:
+            conn.execute("DELETE FROM cache WHERE url = ? AND blob = ?", (entry.url, entry.blob))
+
+    def _load(self, url):
+        row = self.db.connection().execute(
+            "SELECT content, head, blob, size, etag, last_modified, expires, vary_key FROM cache WHERE url = ?",
+            (url,)
+        ).fetchone()
+        if row is None:
+            return None
+        content, head, blob, size, etag, last_modified, expires, vary_key = row
+        if blob is not None:
+            # Rows written with file storage are misses for a cache without it
+            if self.blobs is None:
+                return None
+            return CacheEntry(url, bytes(head), None, etag, last_modified, from_db_time(expires), vary_key,
+                              blob=blob, body_size=size)
+        if content is None:
+            return None
+        head, body = split_response(bytes(content))
+        return CacheEntry(url, head, body, etag, last_modified, from_db_time(expires), vary_key)
+
+    def _save(self, entry, content_type, content):
+        """Write an entry's row; content is the whole response, or None when the body is a blob"""
+        conn = self.db.connection()
+        replaced = set()
+        with conn:
+            if self.blobs is not None:
+                replaced = self._blobs_of(conn, "url = ?", (entry.url,))
+            conn.execute('''
+                INSERT OR REPLACE INTO cache
+                    (url, content, head, blob, size, content_type, expires, etag, last_modified, vary_key)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (entry.url, content, entry.head if entry.blob else None, entry.blob, entry.body_size,
+                  content_type, to_db_time(entry.expires), entry.etag, entry.last_modified, entry.vary_key))
+        self._release(conn, replaced - {entry.blob})
+        with self.lock:
+            self.stores_since_prune += 1
+            self.bytes_since_prune += entry.body_size
+            # Blob files are also pruned whenever a tenth of their budget was written
+            prune = self.stores_since_prune >= 100 or \
+                (self.blobs is not None and self.bytes_since_prune >= self.blobs.max_bytes // 10)
+            if prune:
+                self.stores_since_prune = 0
+                self.bytes_since_prune = 0
+        if prune:
+            self._prune(conn)
+
+    def _prune(self, conn):
+        """Drop expired entries that cannot be revalidated, cap the table size and the
+        bytes in blob files (oldest entries first), then delete blobs left unused"""
+        released = set()
+        with conn:
+            released |= self._delete(conn, "expires < datetime('now') AND etag IS NULL AND last_modified IS NULL")
+            released |= self._delete(conn, '''url IN (
+                SELECT url FROM cache ORDER BY created_at
+                LIMIT max(0, (SELECT COUNT(*) FROM cache) - ?)
+            )''', (self.max_stored,))
+            if self.blobs is not None:
+                # Keep the newest entries whose bodies add up to at most max_bytes
+                released |= self._delete(conn, '''url IN (
+                    SELECT url FROM (
+                        SELECT url, SUM(size) OVER (ORDER BY created_at DESC, rowid DESC) AS newer_bytes
+                        FROM cache WHERE blob IS NOT NULL
+                    ) WHERE newer_bytes > ?
+                )''', (self.blobs.max_bytes,))
+        self._release(conn, released)
+
+    def _delete(self, conn, condition, params=()):
+        """Delete the rows matching condition; returns the blobs they referred to"""
+        blobs = self._blobs_of(conn, condition, params) if self.blobs is not None else set()
+        conn.execute(f"DELETE FROM cache WHERE {condition}", params)
+        return blobs
+
+    def _blobs_of(self, conn, condition, params):
+        return {row[0] for row in conn.execute(
+            f"SELECT blob FROM cache WHERE blob IS NOT NULL AND ({condition})", params
+        )}
+
+    def _release(self, conn, blobs):
+        """Delete the blob files no row refers to any more"""
+        for digest in blobs:
+            if conn.execute("SELECT 1 FROM cache WHERE blob = ? LIMIT 1", (digest,)).fetchone() is None:
+                self.blobs.remove(digest)
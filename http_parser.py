@@ -0,0 +1,194 @@
+"""Small helpers for reading HTTP/1.x message heads"""
+
+import re
+from urllib.parse import urlsplit
+
+HOP_BY_HOP_HEADERS = ('connection', 'keep-alive', 'proxy-connection', 'proxy-authorization', 'te',
+                      'upgrade')
+
+# RFC 9110 token characters: methods and header names
+TOKEN = rb"[!#$%&'*+\-.^_`|~0-9A-Za-z]+"
+REQUEST_LINE = re.compile(rb"(" + TOKEN + rb") ([\x21-\x7e\x80-\xff]+) (HTTP/[0-9]\.[0-9])\r\n")
+# Every header line is token ':' value, with no whitespace before the colon,
+# no folding and no stray CR, LF or NUL bytes
+HEADER_BLOCK = re.compile(rb"(?:" + TOKEN + rb":[^\x00\r\n]*\r\n)*")
+HTTP_VERSIONS = ('HTTP/1.1', 'HTTP/1.0')
+
+REASONS = {
+    400: 'Bad Request',
+    429: 'Too Many Requests',
+    431: 'Request Header Fields Too Large',
+    501: 'Not Implemented',
+    502: 'Bad Gateway',
+    504: 'Gateway Timeout',
+    505: 'HTTP Version Not Supported',
+}
+
+
+class HTTPParseError(Exception):
+    """Raised for a request the proxy refuses to forward; status is the reply to send"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def error_response(status):
+    """A minimal response that reports a rejected request and closes the connection"""
+    return (f"HTTP/1.1 {status} {REASONS.get(status, 'Error')}\r\n"
+            f"Content-Length: 0\r\nConnection: close\r\n\r\n").encode()
+
+
+def parse_header_lines(lines):
+    """Parse header lines into a dict with lowercase names"""
+    headers = {}
+    for line in lines:
+        name, sep, value = line.partition(':')
+        if not sep:
+            continue
+        name = name.strip().lower()
+        value = value.strip()
+        if name in headers:
+            headers[name] = f"{headers[name]}, {value}"
+        else:
+            headers[name] = value
+    return headers
+
+
+def parse_request(head):
+    """Parse and validate a request head (raw bytes ending with the blank line).
+
+    Validates the bytes as read from the socket, so nothing is lost to decoding,
+    and refuses anything a server behind the proxy could read differently:
+    malformed request lines, whitespace around header names, obsolete line
+    folding, stray CR/LF/NUL bytes and conflicting body framing.
+
+    Returns (method, target, version, headers, request) where request is the
+    whole head decoded as ISO-8859-1. Raises HTTPParseError otherwise.
+    """
+    match = REQUEST_LINE.match(head)
+    if not match:
+        line = head.split(b'\r\n', 1)[0]
+        raise HTTPParseError(f"invalid request line: {line[:64]!r}")
+    # Both patterns are checked on the bytes, so the head is decoded only once
+    header_end = HEADER_BLOCK.match(head, match.end()).end()
+    if header_end != len(head) - 2 or not head.endswith(b'\r\n'):
+        line = head[header_end:].split(b'\r\n', 1)[0]
+        raise HTTPParseError(f"invalid header line: {line[:64]!r}")
+    request = head.decode('iso-8859-1')
+    # The pattern allows exactly two spaces in the request line
+    method, target, version = request[:match.end() - 2].split(' ')
+    if version not in HTTP_VERSIONS:
+        raise HTTPParseError(f"unsupported version: {version}", 505)
+
+    headers = {}
+    block = request[match.end():-4]
+    for line in block.split('\r\n') if block else ():
+        name, _, value = line.partition(':')
+        name = name.lower()
+        value = value.strip(' \t')
+        if name in headers:
+            headers[name] = f"{headers[name]}, {value}"
+        else:
+            headers[name] = value
+
+    if 'transfer-encoding' in headers:
+        if 'content-length' in headers:
+            raise HTTPParseError("both Content-Length and Transfer-Encoding")
+        if headers['transfer-encoding'].rsplit(',', 1)[-1].strip().lower() != 'chunked':
+            raise HTTPParseError("request body not chunked last", 501)
+    elif 'content-length' in headers:
+        lengths = {value.strip() for value in headers['content-length'].split(',')}
+        if len(lengths) != 1 or not lengths.pop().isdigit():
+            raise HTTPParseError("invalid Content-Length")
+
+    return method, target, version, headers, request
+
+
+def request_target(target, headers):
+    """Resolve a proxy request target.
+
+    Clients send the absolute form ('http://host/path'); a bare path is taken
+    relative to the Host header. Returns (url, host, port, path, authority)
+    where path is the origin form to send upstream and authority the Host
+    header value for it.
+    """
+    if target.startswith('/'):
+        if not headers.get('host'):
+            raise HTTPParseError("origin-form request without Host")
+        url = f"http://{headers['host']}{target}"
+    elif '://' not in target:
+        url = 'http://' + target
+    else:
+        url = target
+    try:
+        parts = urlsplit(url)
+        port = parts.port or 80
+    except ValueError:
+        raise HTTPParseError(f"invalid request target: {target[:64]!r}")
+    if parts.scheme.lower() != 'http' or not parts.hostname:
+        raise HTTPParseError(f"unsupported request target: {target[:64]!r}")
+    path = parts.path or '/'
+    if parts.query:
+        path = f"{path}?{parts.query}"
+    return url, parts.hostname, port, path, parts.netloc.rpartition('@')[2]
+
+
+def set_request_line(request, method, target, version):
+    """Return a decoded request head with its first line replaced"""
+    line_end = request.index('\r\n')
+    return f"{method} {target} {version}" + request[line_end:]
+
+
+def parse_response_head(response):
+    """Return (status_code, headers) for raw response bytes"""
+    head, sep, _ = response.partition(b'\r\n\r\n')
+    if not sep:
+        return None, {}
+    lines = head.decode('iso-8859-1').split('\r\n')
+    parts = lines[0].split(None, 2)
+    status_code = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else None
+    return status_code, parse_header_lines(lines[1:])
+
+
+def set_headers(head, headers=None, remove=()):
+    """Return a decoded message head with headers added or replaced and others removed"""
+    head, sep, body = head.partition('\r\n\r\n')
+    headers = headers or {}
+    names = {name.lower() for name in headers} | {name.lower() for name in remove}
+    lines = head.split('\r\n')
+    kept = [lines[0]] + [
+        line for line in lines[1:]
+        if line.partition(':')[0].strip().lower() not in names
+    ]
+    kept.extend(f"{name}: {value}" for name, value in headers.items())
+    return '\r\n'.join(kept) + '\r\n\r\n' + body
+
+
+def hop_by_hop_headers(headers):
+    """Names of headers that apply to one connection only and must not be forwarded"""
+    names = set(HOP_BY_HOP_HEADERS)
+    for value in (headers.get('connection', ''), headers.get('proxy-connection', '')):
+        names.update(name.strip().lower() for name in value.split(',') if name.strip())
+    return names
+
+
+def wants_keep_alive(version, headers):
+    """Check whether the sender of a message wants the connection kept open"""
+    connection = f"{headers.get('connection', '')},{headers.get('proxy-connection', '')}".lower()
+    if 'close' in connection:
+        return False
+    if version.upper() == 'HTTP/1.0':
+        return 'keep-alive' in connection
+    return True
+
+
+def request_framing(headers):
+    """Return (framing, length) for a request body: 'chunked' or 'length'"""
+    if 'chunked' in headers.get('transfer-encoding', '').lower():
+        return 'chunked', 0
+    try:
+        # parse_request has already checked repeated values are identical
+        return 'length', max(0, int(headers.get('content-length', '0').split(',', 1)[0] or 0))
+    except ValueError:
+        return 'length', 0
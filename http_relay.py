@@ -0,0 +1,219 @@
+"""Streaming relay of HTTP/1.x messages between sockets"""
+
+import re
+
+MAX_HEAD_SIZE = 64 * 1024
+MAX_CHUNK_LINE = 4096
+CONTINUE_RESPONSE = b"HTTP/1.1 100 Continue\r\n\r\n"
+# Hex digits, optional extensions, then the CR of the line's CRLF: no signs,
+# prefixes, underscores or whitespace that one parser reads and another skips
+CHUNK_SIZE_LINE = re.compile(rb"([0-9A-Fa-f]{1,16})(?:;[^\r\n\x00]*)?\r")
+
+
+class HTTPRelayError(Exception):
+    """Raised when a message cannot be framed or ends early"""
+
+
+class HeadTooLargeError(HTTPRelayError):
+    """Raised when a header block does not end within the size limit"""
+
+
+class FramingError(HTTPRelayError):
+    """Raised when a message's body framing is malformed (bad chunk or Content-Length)"""
+
+
+class ChunkedScanner:
+    """Tracks chunked transfer-encoding framing without decoding the body.
+
+    The bytes are passed through unchanged; the scanner only works out where
+    the message ends so the relay does not have to wait for the peer to close.
+    """
+
+    def __init__(self):
+        self.state = 'size'
+        self.remaining = 0
+        self.line = bytearray()
+        self.done = False
+
+    def feed(self, data, start, stop):
+        """Consume data[start:stop]; return the offset where the body ends (or stop).
+
+        Raises FramingError for anything but strict chunked framing: every
+        line must end with CRLF and every chunk's data must be followed by
+        exactly CRLF.
+        """
+        pos = start
+        while pos < stop and not self.done:
+            if self.state == 'data':
+                take = min(self.remaining, stop - pos)
+                pos += take
+                self.remaining -= take
+                if self.remaining == 0:
+                    self.state = 'data_crlf'
+                    self.remaining = 2
+                continue
+            if self.state == 'data_crlf':
+                take = min(self.remaining, stop - pos)
+                expected = b'\r\n'[2 - self.remaining:2 - self.remaining + take]
+                if data[pos:pos + take] != expected:
+                    raise FramingError("chunk data not followed by CRLF")
+                pos += take
+                self.remaining -= take
+                if self.remaining == 0:
+                    self.state = 'size'
+                continue
+
+            newline = data.find(b'\n', pos, stop)
+            if newline == -1:
+                self.line += data[pos:stop]
+                if len(self.line) > MAX_CHUNK_LINE:
+                    raise FramingError("chunk header line too long")
+                return stop
+
+            self.line += data[pos:newline]
+            pos = newline + 1
+            line = bytes(self.line)
+            self.line.clear()
+
+            if self.state == 'size':
+                match = CHUNK_SIZE_LINE.fullmatch(line)
+                if not match:
+                    raise FramingError(f"invalid chunk size line: {line[:32]!r}")
+                size = int(match.group(1), 16)
+                if size == 0:
+                    self.state = 'trailer'
+                else:
+                    self.state = 'data'
+                    self.remaining = size
+            elif not line.endswith(b'\r') or b'\r' in line[:-1]:
+                raise FramingError(f"invalid trailer line: {line[:32]!r}")
+            elif line == b'\r':
+                # Empty line after the last chunk's trailers ends the message
+                self.done = True
+        return pos
+
+
+class BodyFramer:
+    """Works out where a message body ends for a given framing"""
+
+    def __init__(self, framing, length=0):
+        self.framing = framing
+        self.remaining = length
+        self.scanner = ChunkedScanner() if framing == 'chunked' else None
+        self.done = framing == 'length' and length == 0
+        self.bytes = 0
+
+    def feed(self, data, start, stop):
+        """Return the offset in data where this message's bytes stop"""
+        if self.framing == 'chunked':
+            end = self.scanner.feed(data, start, stop)
+            self.done = self.scanner.done
+        elif self.framing == 'length':
+            end = min(stop, start + self.remaining)
+            self.remaining -= end - start
+            self.done = self.remaining == 0
+        else:
+            end = stop
+        self.bytes += end - start
+        return end
+
+
+def read_head(sock, buffer, initial=b'', limit=MAX_HEAD_SIZE):
+    """Read up to the end of the header block.
+
+    initial holds bytes already read from the connection (e.g. left over from
+    the previous message). Returns (head, rest) where rest is whatever was read
+    past the blank line: the start of a body, the next message or, after a
+    CONNECT, tunnel bytes. Callers must pass it on to whatever reads next from
+    the socket. Returns (b'', b'') if the peer closed before sending
+    anything. Raises HeadTooLargeError if the head is longer than limit bytes.
+    """
+    data = bytearray(initial)
+    view = memoryview(buffer)
+    searched = 0
+    while True:
+        end = data.find(b'\r\n\r\n', max(0, searched - 3))
+        if end != -1:
+            if end + 4 > limit:
+                raise HeadTooLargeError("header block too large")
+            return bytes(data[:end + 4]), bytes(data[end + 4:])
+        searched = len(data)
+        if searched >= limit:
+            raise HeadTooLargeError("header block too large")
+        received = sock.recv_into(buffer)
+        if not received:
+            if data.strip():
+                raise HTTPRelayError("connection closed inside header block")
+            return b'', b''
+        data += view[:received]
+
+
+def is_interim(head):
+    """True for a 1xx response head other than 101 (e.g. 103 Early Hints); the
+    final response follows it on the same connection"""
+    parts = head.split(None, 2)
+    return len(parts) > 1 and len(parts[1]) == 3 and parts[1].isdigit() \
+        and parts[1].startswith(b'1') and parts[1] != b'101'
+
+
+def response_framing(method, status_code, headers):
+    """Return (framing, length) for a response: 'length', 'chunked' or 'close'"""
+    if method.upper() == 'HEAD' or status_code is None or 100 <= status_code < 200 \
+            or status_code in (204, 304):
+        return 'length', 0
+    if 'chunked' in headers.get('transfer-encoding', '').lower():
+        return 'chunked', 0
+    if 'content-length' in headers:
+        # Repeated identical values are allowed; signs, spaces inside and other
+        # junk are not (int() would accept "-5" or "+5")
+        lengths = {value.strip() for value in headers['content-length'].split(',')}
+        length = lengths.pop()
+        if lengths or not length.isdigit():
+            raise FramingError("invalid Content-Length")
+        return 'length', int(length)
+    return 'close', 0
+
+
+def relay_body(source, dest, buffer, framer, initial=b'', on_data=None, throttle=None):
+    """Copy a body from source to dest as it arrives.
+
+    Each read goes straight into the reusable buffer and is sent on before the
+    next read, so memory use is bounded by the buffer size. With dest None the
+    body is only read (on_data sees it). on_data, if given,
+    is called with each piece that was sent, and throttle with its length
+    before the next read (it may block to slow the relay down). Returns any
+    bytes read past the end of the body (the start of the next message on a
+    persistent connection).
+    """
+    if initial:
+        if framer.done:
+            return initial
+        end = framer.feed(initial, 0, len(initial))
+        piece = memoryview(initial)[:end]
+        if dest is not None:
+            dest.sendall(piece)
+        if on_data:
+            on_data(piece)
+        if throttle:
+            throttle(end)
+        if end < len(initial):
+            return initial[end:]
+
+    view = memoryview(buffer)
+    while not framer.done:
+        received = source.recv_into(buffer)
+        if not received:
+            if framer.framing == 'close':
+                break
+            raise HTTPRelayError("connection closed before end of body")
+        end = framer.feed(buffer, 0, received)
+        piece = view[:end]
+        if dest is not None:
+            dest.sendall(piece)
+        if on_data:
+            on_data(piece)
+        if throttle:
+            throttle(end)
+        if end < received:
+            return bytes(buffer[end:received])
+    return b''
@@ -0,0 +1,118 @@
+import threading
+import time
+from collections import deque
+
+# Field names of the access log records kept by AccessLogWriter
+LOG_FIELDS = ('client_ip', 'url', 'method', 'status_code', 'blocked', 'timestamp', 'block_rule')
+
+
+class LiveFeed:
+    """Dashboard updates shared by every open /api/stream connection.
+
+    One publisher thread runs while anyone is subscribed. Every interval it
+    reads the server's stats once and sends only the values that changed,
+    plus the access log records committed since its last pass (taken from the
+    log writer's in-memory ring). So the cost follows how much happens, not
+    how many tabs are open. Events are kept in a bounded history; a
+    subscriber that falls behind it gets a full stats snapshot instead.
+
+    get_server returns the proxy server; it is only called once someone
+    subscribes, so creating the feed does not create the server.
+    """
+
+    def __init__(self, get_server, interval=1, keepalive=15, history=100):
+        self.get_server = get_server
+        self.interval = interval
+        self.keepalive = keepalive
+        self.events = deque(maxlen=history)
+        self.last_id = 0
+        self.stats = None
+        self.log_sequence = None
+        self.subscribers = 0
+        self.publisher = None
+        self.changed = threading.Condition()
+
+    def current_stats(self):
+        server = self.get_server()
+        stats = server.get_stats()
+        stats['server_running'] = server.is_running
+        return stats
+
+    def subscribe(self):
+        """Yield (event_id, kind, data) for one client, starting with all the stats.
+
+        Yields None after keepalive seconds without events so the caller can
+        write a comment and notice a client that has gone away.
+        """
+        with self.changed:
+            self.subscribers += 1
+            if self.publisher is None:
+                self.publisher = threading.Thread(target=self.publish, name='live-feed', daemon=True)
+                self.publisher.start()
+        try:
+            with self.changed:
+                seen = self.last_id
+                snapshot = self.stats
+            # Without a snapshot the publisher has not run yet; its first event has every value
+            if snapshot is not None:
+                yield seen, 'stats', snapshot
+            while True:
+                with self.changed:
+                    if not self.changed.wait_for(lambda: self.last_id > seen, self.keepalive):
+                        pending = None
+                    elif self.events and self.events[0][0] > seen + 1:
+                        # Missed events have left the history: start over from a snapshot
+                        pending = [(self.last_id, 'stats', self.stats)]
+                    else:
+                        pending = [event for event in self.events if event[0] > seen]
+                    seen = self.last_id
+                if pending is None:
+                    yield None
+                    continue
+                for event in pending:
+                    yield event
+        finally:
+            with self.changed:
+                self.subscribers -= 1
+
+    def publish(self):
+        """Publisher thread: runs until the last subscriber has left"""
+        while True:
+            with self.changed:
+                if not self.subscribers:
+                    self.publisher = None
+                    self.stats = None
+                    self.log_sequence = None
+                    return
+            started = time.monotonic()
+            try:
+                self.publish_once()
+            except Exception as e:
+                print(f"Live feed error: {e}")
+            time.sleep(max(0, self.interval - (time.monotonic() - started)))
+
+    def publish_once(self):
+        stats = self.current_stats()
+        log_writer = self.get_server().log_writer
+        if self.log_sequence is None:
+            # Start from now; the page already shows older entries
+            self.log_sequence = log_writer.recent_sequence
+            records = []
+        else:
+            records, self.log_sequence = log_writer.recent_since(self.log_sequence)
+        with self.changed:
+            previous = self.stats or {}
+            delta = {name: value for name, value in stats.items() if previous.get(name) != value}
+            self.stats = stats
+            if delta:
+                self._append('stats', delta)
+            if records:
+                # Records from several workers arrive per worker; send them oldest first
+                records.sort(key=lambda record: record[5])
+                self._append('logs', [dict(zip(LOG_FIELDS, record)) for record in records])
+
+    def _append(self, kind, data):
+        """Add an event to the history and wake the subscribers (caller holds changed)"""
+        self.last_id += 1
+        self.events.append((self.last_id, kind, data))
+        self.changed.notify_all()
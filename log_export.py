@@ -0,0 +1,58 @@
+"""Streaming encoders for access log exports: NDJSON or CSV, optionally gzipped"""
+
+import csv
+import io
+import json
+import zlib
+
+# Field order of the rows AccessLogStore.export yields
+FIELDS = ('id', 'client_ip', 'url', 'method', 'status_code', 'blocked', 'timestamp', 'block_rule', 'host')
+
+# format -> (mimetype, file extension)
+FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+}
+
+
+def ndjson_chunks(batches):
+    """One JSON object per line, one chunk per batch"""
+    for batch in batches:
+        lines = []
+        for row in batch:
+            record = dict(zip(FIELDS, row))
+            record['blocked'] = bool(record['blocked'])
+            lines.append(json.dumps(record, separators=(',', ':')))
+        lines.append('')
+        yield '\n'.join(lines).encode()
+
+
+def csv_chunks(batches):
+    """A header line, then one chunk of rows per batch"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(FIELDS)
+    for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        # Nothing matched: still send the header
+        yield buffer.getvalue().encode()
+
+
+def gzip_chunks(chunks, level=6):
+    """Compress a stream of chunks into one gzip member as it goes"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def encode_export(batches, fmt='ndjson', compress=False):
+    """Byte chunks of an export of batches (see AccessLogStore.export)"""
+    chunks = csv_chunks(batches) if fmt == 'csv' else ndjson_chunks(batches)
+    return gzip_chunks(chunks) if compress else chunks
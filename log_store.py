@@ -0,0 +1,355 @@
+import re
+import sqlite3
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+
+from database import connect
+
+LEGACY_TABLE = 'access_logs'
+PARTITION_PREFIX = 'access_logs_'
+PARTITION_PATTERN = re.compile(r'^access_logs_(\d{8})$')
+
+# Export ids are '<partition day>-<row id>' since row ids restart in every partition
+EXPORT_ID_PATTERN = re.compile(r'^(\d{8})-(\d+)$')
+LEGACY_KEY = '00000000'
+
+COLUMNS = 'client_ip, url, method, status_code, blocked, timestamp, block_rule'
+
+# Columns added after the first partitioned release, with their types
+ADDED_COLUMNS = (
+    ('host', 'TEXT'),
+    ('block_rule', 'TEXT'),
+)
+
+INDEXES = (
+    ('ts', 'timestamp'),
+    ('client', 'client_ip, timestamp'),
+    ('host', 'host, timestamp'),
+    ('status', 'status_code, timestamp'),
+    ('blocked', 'blocked, timestamp'),
+)
+
+
+def partition_for(timestamp):
+    """Partition table holding a 'YYYY-MM-DD HH:MM:SS' timestamp"""
+    return PARTITION_PREFIX + timestamp[:10].replace('-', '')
+
+
+def normalize_time(value):
+    """Accept 'YYYY-MM-DD', 'YYYY-MM-DD HH:MM[:SS]' or the HTML datetime-local form"""
+    if not value:
+        return None
+    value = value.strip().replace('T', ' ')
+    if len(value) == 10:
+        value += ' 00:00:00'
+    elif len(value) == 16:
+        value += ':00'
+    datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+    return value
+
+
+def encode_cursor(row):
+    """Keyset cursor for the page after row (timestamp and id of the last row shown)"""
+    return f"{row[5]}|{row[-1]}"
+
+
+def decode_cursor(cursor):
+    timestamp, _, row_id = cursor.rpartition('|')
+    return normalize_time(timestamp), int(row_id)
+
+
+def partition_key(table):
+    """'YYYYMMDD' of a partition; the legacy table sorts before every day"""
+    return LEGACY_KEY if table == LEGACY_TABLE else table[len(PARTITION_PREFIX):]
+
+
+def decode_export_id(export_id):
+    """(partition key, row id) of an export id ('YYYYMMDD-<id>')"""
+    match = EXPORT_ID_PATTERN.match(export_id.strip())
+    if not match:
+        raise ValueError(f"invalid export id {export_id!r}")
+    return match.group(1), int(match.group(2))
+
+
+class AccessLogStore:
+    """Access logs split into one table per UTC day (access_logs_YYYYMMDD).
+
+    Each partition is indexed on timestamp and on client, host, status and
+    blocked (each followed by timestamp), so a filtered page is an index range
+    scan instead of a sort. Pages are fetched newest first with a keyset
+    cursor, visiting partitions in date order until the page is full.
+
+    Retention drops whole partitions, which is a cheap schema change instead
+    of a DELETE that rewrites the table. A pre-partitioning access_logs table
+    is kept as the oldest partition and dropped once all its rows expire.
+
+    Methods take the caller's connection so each thread uses its own.
+    """
+
+    def __init__(self, db_file=None, retention_days=30, page_size=200):
+        self.db_file = db_file
+        self.retention_days = retention_days
+        self.page_size = page_size
+        self.known = set()
+
+    def connect(self):
+        return connect(self.db_file)
+
+    def prepare(self, conn):
+        """Bring older tables up to date: add missing columns everywhere and index the
+        legacy table if there is one (a one-off build on old databases)"""
+        with conn:
+            for table in self.partitions(conn):
+                self._add_columns(conn, table)
+            if self._has_legacy(conn):
+                conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS idx_{LEGACY_TABLE}_ts ON {LEGACY_TABLE} (timestamp)"
+                )
+
+    def forget(self):
+        """Recheck partition tables on the next insert (after a rolled back write)"""
+        self.known.clear()
+
+    def partitions(self, conn):
+        """Partition tables, newest first, with the legacy table last"""
+        names = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'access_logs%'"
+        )]
+        tables = sorted((name for name in names if PARTITION_PATTERN.match(name)), reverse=True)
+        if LEGACY_TABLE in names:
+            tables.append(LEGACY_TABLE)
+        return tables
+
+    def insert(self, conn, batch):
+        """Write (client_ip, url, method, status_code, blocked, timestamp, block_rule) records;
+        caller commits"""
+        groups = {}
+        for record in batch:
+            host = urlparse(record[1]).hostname if '://' in record[1] else None
+            groups.setdefault(partition_for(record[5]), []).append(record + (host,))
+        for table, rows in groups.items():
+            self._ensure_partition(conn, table)
+            sql = f"INSERT INTO {table} ({COLUMNS}, host) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+            try:
+                conn.executemany(sql, rows)
+            except sqlite3.OperationalError:
+                # Another process may have dropped the partition since we created it
+                self.known.discard(table)
+                self._ensure_partition(conn, table)
+                conn.executemany(sql, rows)
+
+    def totals(self, conn):
+        """(total, blocked) across all partitions; scans every row"""
+        total = blocked = 0
+        for table in self.partitions(conn):
+            count, blocked_count = self._count(conn, table)
+            total += count
+            blocked += blocked_count
+        return total, blocked
+
+    def drop_expired(self, conn, now=None):
+        """Drop partitions older than the retention period; returns the (total, blocked) removed"""
+        if not self.retention_days:
+            return 0, 0
+        now = now or datetime.utcnow()
+        cutoff = (now - timedelta(days=self.retention_days)).strftime('%Y-%m-%d %H:%M:%S')
+        oldest_kept = partition_for(cutoff)
+
+        removed_total = removed_blocked = 0
+        for table in self.partitions(conn):
+            if table == LEGACY_TABLE:
+                newest = conn.execute(f"SELECT MAX(timestamp) FROM {table}").fetchone()[0]
+                if newest is not None and newest >= cutoff:
+                    continue
+            elif table >= oldest_kept:
+                continue
+            count, blocked = self._count(conn, table)
+            with conn:
+                conn.execute(f"DROP TABLE {table}")
+            self.known.discard(table)
+            removed_total += count
+            removed_blocked += blocked
+        return removed_total, removed_blocked
+
+    def clear(self, conn):
+        """Drop every partition"""
+        with conn:
+            for table in self.partitions(conn):
+                conn.execute(f"DROP TABLE {table}")
+        self.known.clear()
+
+    def query(self, conn, client_ip=None, host=None, status=None, blocked=None,
+              since=None, until=None, cursor=None, limit=None):
+        """One page of logs, newest first.
+
+        Returns (rows, next_cursor) where rows are (client_ip, url, method,
+        status_code, blocked, timestamp, block_rule) tuples and next_cursor is
+        None on the last page.
+        """
+        limit = limit or self.page_size
+        since = normalize_time(since)
+        until = normalize_time(until)
+        after = decode_cursor(cursor) if cursor else None
+
+        filters, params = self._filters(client_ip, status, blocked, since, until)
+        if after:
+            filters.append("timestamp <= ? AND (timestamp < ? OR id < ?)")
+            params.extend((after[0], after[0], after[1]))
+
+        rows = []
+        for table in self.partitions(conn):
+            if not self._in_range(table, since, until):
+                continue
+            if after and table != LEGACY_TABLE and table > partition_for(after[0]):
+                continue
+
+            where, table_params = self._host_filter(table, host, filters, params)
+            sql = f"SELECT {COLUMNS}, id FROM {table}"
+            if where:
+                sql += " WHERE " + " AND ".join(where)
+            sql += " ORDER BY timestamp DESC, id DESC LIMIT ?"
+            table_params.append(limit + 1 - len(rows))
+            rows.extend(conn.execute(sql, table_params).fetchall())
+            if len(rows) > limit:
+                break
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1])
+        return [row[:-1] for row in rows], next_cursor
+
+    def export(self, conn, client_ip=None, host=None, status=None, blocked=None,
+               since=None, until=None, after=None, batch_size=5000):
+        """Every matching row, oldest first, in batches of at most batch_size.
+
+        Rows are (export_id, client_ip, url, method, status_code, blocked,
+        timestamp, block_rule, host) tuples. Passing the export id of the
+        last row received as after resumes the export where it stopped,
+        including rows logged since.
+
+        The arguments are checked straight away and a generator of batches
+        is returned. Each batch is its own short query, walking a partition
+        by id, so no read transaction stays open while the caller consumes
+        it and the log writer and checkpoints are never held up.
+        """
+        since = normalize_time(since)
+        until = normalize_time(until)
+        resume = decode_export_id(after) if after else None
+        filters, params = self._filters(client_ip, status, blocked, since, until)
+        return self._export_batches(conn, host, filters, params, since, until, resume, batch_size)
+
+    def _export_batches(self, conn, host, filters, params, since, until, resume, batch_size):
+        # partitions() lists newest first with the legacy (oldest) table last
+        for table in reversed(self.partitions(conn)):
+            key = partition_key(table)
+            if resume and key < resume[0]:
+                continue
+            if not self._in_range(table, since, until):
+                continue
+            last_id = resume[1] if resume and key == resume[0] else 0
+
+            where, table_params = self._host_filter(table, host, filters, params)
+            # NOT INDEXED keeps SQLite on the rowid range instead of a filter
+            # index plus a sort, so every batch carries on where the last ended
+            sql = f"SELECT id, {COLUMNS}, host FROM {table} NOT INDEXED WHERE id > ?"
+            if where:
+                sql += " AND " + " AND ".join(where)
+            sql += " ORDER BY id LIMIT ?"
+            while True:
+                try:
+                    rows = conn.execute(sql, [last_id, *table_params, batch_size]).fetchall()
+                except sqlite3.OperationalError:
+                    # Dropped by retention or cleared while being exported
+                    break
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                yield [(f"{key}-{row[0]}",) + row[1:] for row in rows]
+                if len(rows) < batch_size:
+                    break
+
+    def _filters(self, client_ip, status, blocked, since, until):
+        """WHERE terms and parameters shared by every partition"""
+        filters = []
+        params = []
+        if client_ip:
+            filters.append("client_ip = ?")
+            params.append(client_ip)
+        if status is not None:
+            filters.append("status_code = ?")
+            params.append(int(status))
+        if blocked is not None:
+            filters.append("blocked = ?")
+            params.append(1 if blocked else 0)
+        if since:
+            filters.append("timestamp >= ?")
+            params.append(since)
+        if until:
+            filters.append("timestamp <= ?")
+            params.append(until)
+        return filters, params
+
+    def _host_filter(self, table, host, filters, params):
+        """Copies of filters and params with the host filter for table added"""
+        where = list(filters)
+        table_params = list(params)
+        if host and table == LEGACY_TABLE:
+            # Rows written before partitioning have no host column value
+            host = host.lower()
+            where.append("(host = ? OR (host IS NULL AND (url LIKE ? OR url LIKE ? OR url LIKE ?)))")
+            table_params.extend((host, f'%://{host}/%', f'%://{host}:%', f'%://{host}'))
+        elif host:
+            where.append("host = ?")
+            table_params.append(host.lower())
+        return where, table_params
+
+    def _in_range(self, table, since, until):
+        """Whether a partition can hold rows between since and until"""
+        if table == LEGACY_TABLE:
+            return True
+        if since and table < partition_for(since):
+            return False
+        if until and table > partition_for(until):
+            return False
+        return True
+
+    def _has_legacy(self, conn):
+        return conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (LEGACY_TABLE,)
+        ).fetchone() is not None
+
+    def _ensure_partition(self, conn, table):
+        if table in self.known:
+            return
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                client_ip TEXT,
+                url TEXT,
+                method TEXT,
+                status_code INTEGER,
+                blocked INTEGER DEFAULT 0,
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                host TEXT,
+                block_rule TEXT
+            )
+        ''')
+        # Today's partition may have been created by an older version
+        self._add_columns(conn, table)
+        for suffix, columns in INDEXES:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_{suffix} ON {table} ({columns})")
+        self.known.add(table)
+
+    def _add_columns(self, conn, table):
+        """Add the columns an older table lacks (a schema-only change in SQLite)"""
+        columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        for column, kind in ADDED_COLUMNS:
+            if column not in columns:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {kind}")
+
+    def _count(self, conn, table):
+        count, blocked = conn.execute(
+            f"SELECT COUNT(*), COALESCE(SUM(blocked != 0), 0) FROM {table}"
+        ).fetchone()
+        return count, blocked
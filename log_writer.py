@@ -0,0 +1,210 @@
+import queue
+from collections import deque
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+
+class AccessLogWriter:
+    """Background writer for an AccessLogStore.
+
+    Request threads only enqueue records; a single writer thread inserts them
+    with executemany in one transaction per batch. A batch is written once it
+    reaches batch_size records or flush_interval seconds after its first record.
+
+    When the queue is full the record is dropped and counted rather than
+    blocking the request thread.
+
+    Running totals of logged and blocked requests are rebuilt with one scan
+    when the writer starts and then kept up to date as batches are committed
+    and partitions expire, so reading them never touches the log tables.
+    Expired partitions are dropped every retention_interval seconds (0
+    disables retention). With rebuild_totals off the totals count only the
+    records this writer commits, which lets several processes share one store.
+
+    The last recent_size committed records are also kept in memory, numbered
+    in commit order, so live views can follow new entries without querying.
+    """
+
+    def __init__(self, store, queue_size=10000, batch_size=500, flush_interval=0.5,
+                 retention_interval=3600, rebuild_totals=True, recent_size=500):
+        self.store = store
+        self.rebuild_totals = rebuild_totals
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention_interval = retention_interval
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.written = 0
+        self.dropped = 0
+        self.total_requests = 0
+        self.blocked_requests = 0
+        self.recent = deque(maxlen=recent_size)
+        self.recent_sequence = 0
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """Start the writer thread if it is not already running"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name='access-log-writer', daemon=True)
+        self._thread.start()
+
+    def log(self, client_ip, url, method, status_code, blocked=0, rule=None):
+        """Queue a log record without touching the database"""
+        timestamp = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        try:
+            self.queue.put_nowait((client_ip, url, method, status_code, blocked, timestamp, rule))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def totals(self):
+        """Committed request totals, without querying the database"""
+        with self._lock:
+            return {'total_requests': self.total_requests, 'blocked_requests': self.blocked_requests}
+
+    def remember(self, records):
+        """Add committed records to the in-memory ring (also fed by other processes' writers)"""
+        with self._lock:
+            for record in records:
+                self.recent_sequence += 1
+                self.recent.append((self.recent_sequence, record))
+
+    def recent_since(self, sequence):
+        """(records committed after sequence, newest sequence); older ones may have been evicted"""
+        with self._lock:
+            if sequence >= self.recent_sequence:
+                return [], self.recent_sequence
+            records = [record for number, record in self.recent if number > sequence]
+            return records, self.recent_sequence
+
+    def clear(self):
+        """Delete every access log record and reset the totals"""
+        self.flush()
+        with self._write_lock:
+            conn = self.store.connect()
+            try:
+                self.store.clear(conn)
+            finally:
+                conn.close()
+            self.reset_totals()
+
+    def reset_totals(self):
+        """Zero the totals (after another process cleared the store)"""
+        with self._lock:
+            self.total_requests = 0
+            self.blocked_requests = 0
+            self.recent.clear()
+
+    def flush(self, timeout=5):
+        """Block until everything queued so far has been committed"""
+        if not self._thread or not self._thread.is_alive():
+            return False
+        done = threading.Event()
+        try:
+            self.queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def stop(self, timeout=5):
+        """Flush pending records and stop the writer thread"""
+        if not self._thread or not self._thread.is_alive():
+            return
+        self.flush(timeout)
+        self.queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        conn = self.store.connect()
+        try:
+            if self.rebuild_totals:
+                self._load_totals(conn)
+            next_retention = 0 if self.retention_interval else None
+            while True:
+                timeout = None
+                if next_retention is not None:
+                    if time.monotonic() >= next_retention:
+                        self._expire(conn)
+                        next_retention = time.monotonic() + self.retention_interval
+                    timeout = max(0, next_retention - time.monotonic())
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    continue
+                batch = []
+                waiters = []
+                deadline = time.monotonic() + self.flush_interval
+                stop = False
+
+                while True:
+                    if item is None:
+                        stop = True
+                        break
+                    if isinstance(item, threading.Event):
+                        # Flush marker: write what we have now
+                        waiters.append(item)
+                        break
+                    batch.append(item)
+                    if len(batch) >= self.batch_size:
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = self.queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+
+                if batch:
+                    self._write(conn, batch)
+                for waiter in waiters:
+                    waiter.set()
+                if stop:
+                    return
+        finally:
+            conn.close()
+
+    def _load_totals(self, conn):
+        with self._write_lock:
+            try:
+                self.store.prepare(conn)
+                total, blocked = self.store.totals(conn)
+            except sqlite3.Error as e:
+                print(f"Access log totals error: {e}")
+                return
+            with self._lock:
+                self.total_requests = total
+                self.blocked_requests = blocked
+
+    def _expire(self, conn):
+        with self._write_lock:
+            try:
+                total, blocked = self.store.drop_expired(conn)
+            except sqlite3.Error as e:
+                print(f"Access log retention error: {e}")
+                return
+            with self._lock:
+                self.total_requests -= total
+                self.blocked_requests -= blocked
+
+    def _write(self, conn, batch):
+        try:
+            with self._write_lock:
+                with conn:
+                    self.store.insert(conn, batch)
+                blocked = sum(1 for record in batch if record[4])
+                with self._lock:
+                    self.total_requests += len(batch)
+                    self.blocked_requests += blocked
+            self.remember(batch)
+            self.written += len(batch)
+        except sqlite3.Error as e:
+            print(f"Access log write error: {e}")
+            self.store.forget()
+            with self._lock:
+                self.dropped += len(batch)
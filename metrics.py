@@ -0,0 +1,140 @@
+"""In-process metrics with Prometheus text exposition"""
+
+import math
+import threading
+import time
+
+PHASES = ('queue', 'parse', 'block_check', 'dns', 'upstream_connect', 'ttfb', 'transfer')
+
+# Base metric name -> (type, help)
+METRIC_INFO = {
+    'proxy_phase_seconds': ('histogram', 'Time spent in each phase of handling a request'),
+    'proxy_requests_total': ('counter', 'Requests handled, by kind'),
+    'proxy_blocked_total': ('counter', 'Requests refused by the block list'),
+    'proxy_rejected_requests_total': ('counter', 'Malformed or oversized requests refused, by status'),
+    'proxy_bytes_total': ('counter', 'Bytes relayed, by kind and direction'),
+    'proxy_active_connections': ('gauge', 'Client connections currently open'),
+    'proxy_active_tunnels': ('gauge', 'CONNECT tunnels currently open'),
+    'proxy_threads': ('gauge', 'Threads in the proxy process'),
+    'proxy_connections_forced_closed_total': ('counter', 'Connections still open when a drain ran out of time'),
+    'proxy_connections_shed_total': ('counter', 'Connections answered with 503 because a limit was reached'),
+}
+
+
+class Histogram:
+    """Log-linear histogram in the style of HdrHistogram.
+
+    Every power of two between 2**min_exponent and 2**max_exponent seconds is
+    split into sub_buckets equal buckets, so relative error stays bounded at
+    every scale and recording is a frexp plus a list increment. Increments are
+    not locked: under heavy contention an occasional count may be lost, which
+    is an accepted trade for keeping the hot path cheap.
+    """
+
+    def __init__(self, min_exponent=-20, max_exponent=8, sub_buckets=4):
+        self.min_exponent = min_exponent
+        self.sub_buckets = sub_buckets
+        self.bounds = [
+            (0.5 + (sub + 1) / (2 * sub_buckets)) * 2.0 ** exponent
+            for exponent in range(min_exponent, max_exponent)
+            for sub in range(sub_buckets)
+        ]
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        if value <= 0:
+            index = 0
+        else:
+            mantissa, exponent = math.frexp(value)
+            index = (exponent - self.min_exponent) * self.sub_buckets \
+                + int((mantissa - 0.5) * 2 * self.sub_buckets)
+            index = min(max(index, 0), len(self.bounds))
+        self.counts[index] += 1
+        self.sum += value
+
+    def percentile(self, pct):
+        """Upper bound of the bucket holding the given percentile"""
+        total = sum(self.counts)
+        if not total:
+            return 0
+        target = total * pct / 100
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return self.bounds[index] if index < len(self.bounds) else float('inf')
+        return float('inf')
+
+
+class Metrics:
+    """Registry of phase histograms, counters and gauges.
+
+    When disabled every recording call returns immediately, so instrumented
+    code pays only for a perf_counter() call.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.phases = {phase: Histogram() for phase in PHASES}
+        self.counters = {}
+        self.gauges = {}
+        self.callbacks = []
+        self.lock = threading.Lock()
+        self.register_callback('proxy_threads', threading.active_count)
+
+    def observe(self, phase, started):
+        """Record the time since started (a perf_counter() value) for a phase"""
+        if self.enabled:
+            self.phases[phase].observe(time.perf_counter() - started)
+
+    def inc(self, name, amount=1):
+        """Add to a counter; name may carry Prometheus labels, e.g. 'x{kind="a"}'"""
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + amount
+
+    def gauge(self, name, delta):
+        """Move a gauge up or down"""
+        if self.enabled:
+            with self.lock:
+                self.gauges[name] = self.gauges.get(name, 0) + delta
+
+    def register_callback(self, name, func, kind='gauge', help_text=None):
+        """Expose a value computed at scrape time, e.g. an existing stats counter"""
+        if help_text is not None:
+            METRIC_INFO.setdefault(name.split('{', 1)[0], (kind, help_text))
+        self.callbacks.append((name, func))
+
+    def render(self):
+        """Return all metrics in the Prometheus text format"""
+        samples = {}
+
+        for phase, histogram in self.phases.items():
+            lines = samples.setdefault('proxy_phase_seconds', [])
+            cumulative = 0
+            for bound, count in zip(histogram.bounds, histogram.counts):
+                cumulative += count
+                lines.append(f'proxy_phase_seconds_bucket{{phase="{phase}",le="{bound:.6g}"}} {cumulative}')
+            cumulative += histogram.counts[-1]
+            lines.append(f'proxy_phase_seconds_bucket{{phase="{phase}",le="+Inf"}} {cumulative}')
+            lines.append(f'proxy_phase_seconds_sum{{phase="{phase}"}} {histogram.sum:.9f}')
+            lines.append(f'proxy_phase_seconds_count{{phase="{phase}"}} {cumulative}')
+
+        with self.lock:
+            values = list(self.counters.items()) + list(self.gauges.items())
+        for name, func in self.callbacks:
+            try:
+                values.append((name, func()))
+            except Exception:
+                continue
+        for name, value in values:
+            samples.setdefault(name.split('{', 1)[0], []).append(f'{name} {value}')
+
+        output = []
+        for base, lines in sorted(samples.items()):
+            kind, help_text = METRIC_INFO.get(base, ('untyped', base))
+            output.append(f'# HELP {base} {help_text}')
+            output.append(f'# TYPE {base} {kind}')
+            output.extend(lines)
+        return '\n'.join(output) + '\n'
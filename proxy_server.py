@@ -1,28 +1,172 @@
+import functools
+import logging
+import select
 import socket
 import threading
-import re
 import sqlite3
-import select
-from datetime import datetime
-from urllib.parse import urlparse
+import time
+import config
+from admission import AdmissionController, HandlerPool, reject
+from collapsing import CollapsedRequestError, RequestCollapser
+from blob_store import BlobStore
+from blocklist import BlockDecisionCache, BlocklistMatcher, clean_pattern, describe_match, normalize_domain
+from connections import ConnectionTracker, shutdown_socket
+from http_cache import CACHEABLE_STATUS, ResponseCache
+from connection_pool import UpstreamPool
+from database import Database, connect
+from dns_cache import DNSCache
+from http_parser import (HTTPParseError, error_response, hop_by_hop_headers, parse_request,
+                         parse_response_head, request_framing, request_target, set_headers,
+                         set_request_line, wants_keep_alive)
+from http_relay import (CONTINUE_RESPONSE, BodyFramer, FramingError, HeadTooLargeError, HTTPRelayError,
+                        is_interim, read_head, relay_body, response_framing)
+from log_store import AccessLogStore
+from log_writer import AccessLogWriter
+from metrics import Metrics
+from rate_limit import RateLimiter
+from tunnel import relay_tunnel
+
+logger = logging.getLogger('proxy')
+
+
+def configure_logging(level=None):
+    """Set up proxy logging from config.LOG_LEVEL ('OFF' disables it entirely)"""
+    level = (level or config.LOG_LEVEL).upper()
+    if level == 'OFF':
+        logger.disabled = True
+        return
+    logger.disabled = False
+    logging.basicConfig(format=config.LOG_FORMAT)
+    logger.setLevel(level)
 
 class HTTPProxyServer:
     def __init__(self, host='localhost', port=8080):
         self.host = host
         self.port = port
-        self.blocked_sites = set()
+        self.blocklist = BlocklistMatcher()
+        # Serializes block list writers; request threads read self.blocklist without it
+        self.blocklist_lock = threading.Lock()
+        # Set once warm_up has loaded the block list; block checks wait for it
+        self.blocklist_ready = threading.Event()
+        self.blocklist_snapshot = f"{config.DATABASE_FILE}.blocklist" if config.BLOCKLIST_SNAPSHOT else None
+        self.snapshot_lock = threading.Lock()
+        self.snapshot_pending = False
+        self.snapshot_writer = None
+        self.block_decisions = BlockDecisionCache(config.BLOCK_CACHE_SIZE)
         self.is_running = False
         self.server_socket = None
-        self.conn = None
+        self.inherited_socket = None
+        self.wake_sender = None
+        self.reuse_port = False
+        # ready: set once start_server is listening (or has failed, see start_error)
+        # finished: set once start_server has drained and returned
+        self.ready = threading.Event()
+        self.finished = threading.Event()
+        self.finished.set()
+        self.start_error = None
+        self.connections = ConnectionTracker()
+        # Database users wait until warm_up has checked the schema
+        self.db = Database(config.DATABASE_FILE, ready=False)
+        self.metrics = Metrics(enabled=config.METRICS_ENABLED)
         
-        self.init_database()
-        self.load_blocked_sites()
+        self.log_store = AccessLogStore(
+            config.DATABASE_FILE,
+            retention_days=config.LOG_RETENTION_DAYS,
+            page_size=config.LOG_PAGE_SIZE
+        )
+        self.log_writer = AccessLogWriter(
+            self.log_store,
+            queue_size=config.LOG_QUEUE_SIZE,
+            batch_size=config.LOG_BATCH_SIZE,
+            flush_interval=config.LOG_FLUSH_INTERVAL,
+            retention_interval=config.LOG_RETENTION_INTERVAL,
+            rebuild_totals=config.LOG_REBUILD_TOTALS,
+            recent_size=config.LOG_RECENT_SIZE
+        )
+        self.log_writer.start()
+        self.cache = ResponseCache(
+            self.db,
+            max_entries=config.MAX_CACHE_SIZE,
+            max_bytes=config.CACHE_MAX_MEMORY,
+            max_object_size=config.CACHE_MAX_OBJECT_SIZE,
+            max_stored=config.CACHE_MAX_STORED,
+            default_ttl=config.CACHE_DURATION,
+            blobs=self.create_blob_store()
+        )
+        self.collapser = RequestCollapser(enabled=config.COLLAPSE_REQUESTS, timeout=config.COLLAPSE_TIMEOUT)
+        self.rate_limiter = RateLimiter(
+            burst=config.RATE_LIMIT_BURST,
+            max_delay=config.RATE_LIMIT_MAX_DELAY,
+            tracked=config.RATE_LIMIT_TRACKED,
+            **self.rate_limit_settings()
+        )
+        self.resolver = DNSCache(
+            ttl=config.DNS_CACHE_TTL,
+            negative_ttl=config.DNS_NEGATIVE_TTL,
+            max_entries=config.DNS_CACHE_SIZE,
+            happy_eyeballs=config.DNS_HAPPY_EYEBALLS,
+            fallback_delay=config.DNS_FALLBACK_DELAY,
+            metrics=self.metrics
+        )
+        self.upstream_pool = UpstreamPool(
+            max_per_host=config.UPSTREAM_MAX_PER_HOST,
+            idle_timeout=config.UPSTREAM_IDLE_TIMEOUT,
+            connect_timeout=10,
+            wait_timeout=config.CONNECTION_TIMEOUT,
+            connector=self.resolver.create_connection
+        )
+        self.admission = self.create_admission()
+        self.handlers = HandlerPool(
+            self.serve_client,
+            max_threads=config.MAX_CONNECTIONS,
+            queue_size=config.ACCEPT_QUEUE_SIZE,
+            name='proxy-client'
+        )
+        self.register_metrics()
+        threading.Thread(target=self.warm_up, name='proxy-warmup', daemon=True).start()
         print(f" Proxy Server Initialized on {host}:{port}")
         
+    def warm_up(self):
+        """Startup work done in the background, so the proxy can listen straight away.
+
+        The block list is taken from its snapshot file when there is one, then
+        the schema is checked. A missing or stale snapshot (the blocked_sites
+        table changed since it was written) is rebuilt from the rows. Until
+        then block checks wait instead of letting requests through unchecked.
+        """
+        started = time.perf_counter()
+        snapshot = None
+        try:
+            if self.blocklist_snapshot:
+                snapshot = BlocklistMatcher.load(self.blocklist_snapshot)
+            if snapshot:
+                matcher = snapshot[0]
+                with self.blocklist_lock:
+                    # Not shared yet, so its version can still be set
+                    matcher.version = self.blocklist.version + 1
+                    self.blocklist = matcher
+                self.blocklist_ready.set()
+                print(f" Loaded {len(self.blocklist)} blocked sites from the snapshot")
+            try:
+                self.init_database()
+            finally:
+                self.db.ready.set()
+            if not snapshot or snapshot[1] != self.blocklist_fingerprint():
+                self.load_blocked_sites()
+                self.save_blocklist_snapshot()
+            # Blob files left behind by a crash
+            self.cache.sweep()
+        except Exception as e:
+            logger.error("Warm-up failed: %s", e)
+        finally:
+            self.blocklist_ready.set()
+        logger.info("Warm-up finished in %.2fs", time.perf_counter() - started)
+    
     def init_database(self):
         """Initialize SQLite database for persistent storage"""
-        self.conn = sqlite3.connect('proxy_server.db', check_same_thread=False)
-        cursor = self.conn.cursor()
+        # Its own connection: self.db waits for this check to finish
+        conn = connect(self.db.db_file)
+        cursor = conn.cursor()
         
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS blocked_sites (
@@ -32,17 +176,7 @@ class HTTPProxyServer:
             )
         ''')
         
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS access_logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                client_ip TEXT,
-                url TEXT,
-                method TEXT,
-                status_code INTEGER,
-                blocked INTEGER DEFAULT 0,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+        # Access logs live in daily partitions managed by AccessLogStore
         
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS cache (
@@ -50,307 +184,869 @@ class HTTPProxyServer:
                 content BLOB,
                 content_type TEXT,
                 expires TIMESTAMP,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                etag TEXT,
+                last_modified TEXT,
+                vary_key TEXT,
+                head BLOB,
+                blob TEXT,
+                size INTEGER
             )
         ''')
         
-        self.conn.commit()
+        # Older databases lack the revalidation and blob file columns
+        cursor.execute("PRAGMA table_info(cache)")
+        cache_columns = {row[1] for row in cursor.fetchall()}
+        for column, column_type in (('etag', 'TEXT'), ('last_modified', 'TEXT'), ('vary_key', 'TEXT'),
+                                    ('head', 'BLOB'), ('blob', 'TEXT'), ('size', 'INTEGER')):
+            if column not in cache_columns:
+                cursor.execute(f"ALTER TABLE cache ADD COLUMN {column} {column_type}")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_cache_blob ON cache(blob)")
+        
+        conn.commit()
+        conn.close()
+    
+    def create_blob_store(self):
+        """Blob files for cached bodies with CACHE_STORAGE = 'files', next to the database"""
+        if config.CACHE_STORAGE != 'files':
+            return None
+        return BlobStore(f"{config.DATABASE_FILE}.cache", max_bytes=config.CACHE_DISK_MAX_BYTES)
+    
+    def create_admission(self):
+        """Connection limits; queued connections count toward the global one"""
+        limit = config.MAX_CONNECTIONS and config.MAX_CONNECTIONS + config.ACCEPT_QUEUE_SIZE
+        return AdmissionController(limit, config.MAX_CONNECTIONS_PER_CLIENT)
     
+    def register_metrics(self):
+        """Expose the cache, DNS, pool and log writer counters on /metrics"""
+        sources = (
+            ('proxy_cache_hits_total', lambda: self.cache.hits, 'counter', 'Responses served from the cache'),
+            ('proxy_cache_misses_total', lambda: self.cache.misses, 'counter', 'Cacheable requests sent to the origin'),
+            ('proxy_dns_hits_total', lambda: self.resolver.hits, 'counter', 'DNS lookups answered from the cache'),
+            ('proxy_dns_misses_total', lambda: self.resolver.misses, 'counter', 'DNS lookups sent to the resolver'),
+            ('proxy_block_cache_hits_total', lambda: self.block_decisions.hits, 'counter',
+             'Block checks answered from the decision cache'),
+            ('proxy_block_cache_misses_total', lambda: self.block_decisions.misses, 'counter',
+             'Block checks matched against the block list'),
+            ('proxy_upstream_connections_created_total', lambda: self.upstream_pool.created, 'counter',
+             'Upstream connections opened'),
+            ('proxy_upstream_connections_reused_total', lambda: self.upstream_pool.reused, 'counter',
+             'Requests sent on a pooled upstream connection'),
+            ('proxy_collapsed_requests_total', lambda: self.collapser.collapsed, 'counter',
+             'Requests answered from an identical request\'s upstream fetch'),
+            ('proxy_collapse_fallbacks_total', lambda: self.collapser.fallbacks, 'counter',
+             'Collapsed requests that fetched for themselves (other variant, not shareable, slow start)'),
+            ('proxy_rate_limited_requests_total', lambda: self.rate_limiter.delayed, 'counter',
+             'Requests held back by a request rate limit'),
+            ('proxy_rate_limit_refusals_total', lambda: self.rate_limiter.refused, 'counter',
+             'Requests refused with 429 because the rate limit wait was too long'),
+            ('proxy_rate_limit_pause_seconds_total', lambda: self.rate_limiter.paused, 'counter',
+             'Time relays paused for the byte rate limits'),
+            ('proxy_log_records_dropped_total', lambda: self.log_writer.dropped, 'counter',
+             'Access log records dropped because the queue was full'),
+            ('proxy_connections_shed_total{reason="global"}', lambda: self.admission.shed['global'], 'counter', None),
+            ('proxy_connections_shed_total{reason="client"}', lambda: self.admission.shed['client'], 'counter', None),
+        )
+        for name, func, kind, help_text in sources:
+            self.metrics.register_callback(name, func, kind, help_text)
+    
+    @property
+    def blocked_sites(self):
+        """The patterns in the current block list snapshot"""
+        return self.blocklist.patterns
+
     def load_blocked_sites(self):
         """Load blocked sites from database"""
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT url_pattern FROM blocked_sites")
-        results = cursor.fetchall()
-        self.blocked_sites = {row[0] for row in results}
-        print(f" Loaded {len(self.blocked_sites)} blocked sites")
+        cursor = self.db.connection().cursor()
+        with self.blocklist_lock:
+            cursor.execute("SELECT url_pattern FROM blocked_sites")
+            self.blocklist = BlocklistMatcher((row[0] for row in cursor), self.blocklist.version + 1)
+        print(f" Loaded {len(self.blocklist)} blocked sites")
+    
+    def blocklist_fingerprint(self):
+        """Changes with every write to blocked_sites: AUTOINCREMENT never reuses an id"""
+        count, last_id = self.db.connection().execute(
+            "SELECT COUNT(*), MAX(id) FROM blocked_sites"
+        ).fetchone()
+        return f"{count}:{last_id or 0}"
+    
+    def save_blocklist_snapshot(self):
+        """Rewrite the snapshot file in the background (a burst of changes is written once)"""
+        if not self.blocklist_snapshot:
+            return
+        with self.snapshot_lock:
+            self.snapshot_pending = True
+            if self.snapshot_writer is None:
+                self.snapshot_writer = threading.Thread(
+                    target=self.write_blocklist_snapshots, name='blocklist-snapshot', daemon=True
+                )
+                self.snapshot_writer.start()
+    
+    def write_blocklist_snapshots(self):
+        """Snapshot writer thread: save the current block list until no change is pending"""
+        while True:
+            with self.snapshot_lock:
+                if not self.snapshot_pending:
+                    self.snapshot_writer = None
+                    return
+                self.snapshot_pending = False
+            try:
+                # Writers change the table and the matcher under this lock, so both agree
+                with self.blocklist_lock:
+                    matcher = self.blocklist
+                    fingerprint = self.blocklist_fingerprint()
+                matcher.save(self.blocklist_snapshot, fingerprint)
+            except (OSError, ValueError, sqlite3.Error) as e:
+                logger.warning("Could not save the block list snapshot: %s", e)
     
     def normalize_domain(self, host):
         """Normalize domain for comparison"""
-        if not host:
-            return ""
-        # Remove www. prefix
-        host = host.lower().strip()
-        if host.startswith('www.'):
-            host = host[4:]
-        return host
+        return normalize_domain(host)
     
     def is_blocked(self, host):
-        """Check if host is blocked - FIXED VERSION"""
+        """Check if host is blocked; returns the (rule, reason) that matched, or None"""
         if not host:
-            return False
+            return None
         
-        normalized_host = self.normalize_domain(host)
-        print(f"🔍 Checking: {normalized_host}")
+        if not self.blocklist_ready.is_set():
+            # Still starting up: wait for the block list rather than let the host through
+            self.blocklist_ready.wait()
         
-        # Define YouTube-related domains
-        youtube_domains = {
-            'youtube.com',
-            'youtu.be',
-            'ytimg.com',
-            'googlevideo.com',
-            'ggpht.com',
-            'youtube-nocookie.com',
-            'youtubei.googleapis.com'
-        }
-        
-        for pattern in self.blocked_sites:
-            normalized_pattern = self.normalize_domain(pattern)
-            
-            # Check if pattern is for YouTube
-            if 'youtube' in normalized_pattern:
-                # Block all YouTube-related domains
-                for yt_domain in youtube_domains:
-                    if yt_domain in normalized_host or normalized_host.endswith('.' + yt_domain):
-                        print(f" BLOCKED: {host} (YouTube-related)")
-                        return True
-            
-            # Exact domain match
-            if normalized_host == normalized_pattern:
-                print(f"🚫 BLOCKED: {host} (exact match)")
-                return True
-            
-            # Subdomain match (e.g., pattern "example.com" blocks "www.example.com")
-            if normalized_host.endswith('.' + normalized_pattern):
-                print(f"🚫 BLOCKED: {host} (subdomain match)")
-                return True
-            
-            # Regex pattern match
-            try:
-                if re.search(normalized_pattern, normalized_host, re.IGNORECASE):
-                    print(f"🚫 BLOCKED: {host} (regex match)")
-                    return True
-            except re.error:
-                pass
+        started = time.perf_counter()
+        match = self.block_decisions.match(host, self.blocklist)
+        self.metrics.observe('block_check', started)
+        if match:
+            logger.info("BLOCKED: %s (%s: %s)", host, match[1], match[0])
+            return match
         
-        print(f"✅ ALLOWED: {host}")
-        return False
+        logger.debug("ALLOWED: %s", host)
+        return None
     
     def add_blocked_site(self, pattern):
         """Add a site to block list"""
-        pattern = pattern.strip().lower()
-        
-        # Remove protocol
-        if '://' in pattern:
-            pattern = pattern.split('://', 1)[1]
-        
-        # Remove path
-        if '/' in pattern:
-            pattern = pattern.split('/')[0]
+        pattern = clean_pattern(pattern)
         
-        # Remove www.
-        if pattern.startswith('www.'):
-            pattern = pattern[4:]
-        
-        cursor = self.conn.cursor()
-        try:
-            cursor.execute("INSERT INTO blocked_sites (url_pattern) VALUES (?)", (pattern,))
-            self.conn.commit()
-            self.blocked_sites.add(pattern)
-            print(f" Blocked: {pattern}")
-            return True
-        except sqlite3.IntegrityError:
-            print(f" Already blocked: {pattern}")
-            return False
+        self.blocklist_ready.wait()
+        conn = self.db.connection()
+        with self.blocklist_lock:
+            try:
+                with conn:
+                    conn.execute("INSERT INTO blocked_sites (url_pattern) VALUES (?)", (pattern,))
+            except sqlite3.IntegrityError:
+                print(f" Already blocked: {pattern}")
+                return False
+            self.blocklist = self.blocklist.updated(add=[pattern])
+        self.save_blocklist_snapshot()
+        print(f" Blocked: {pattern}")
+        return True
     
     def remove_blocked_site(self, pattern):
         """Remove a site from block list"""
         pattern = pattern.strip().lower()
-        cursor = self.conn.cursor()
-        cursor.execute("DELETE FROM blocked_sites WHERE url_pattern = ?", (pattern,))
-        self.conn.commit()
-        if cursor.rowcount > 0:
-            self.blocked_sites.discard(pattern)
-            print(f" Unblocked: {pattern}")
-            return True
-        return False
-    
-    def log_access(self, client_ip, url, method, status_code, blocked=0):
-        """Log access attempt"""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            INSERT INTO access_logs (client_ip, url, method, status_code, blocked)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (client_ip, url, method, status_code, blocked))
-        self.conn.commit()
+        self.blocklist_ready.wait()
+        conn = self.db.connection()
+        with self.blocklist_lock:
+            with conn:
+                cursor = conn.execute("DELETE FROM blocked_sites WHERE url_pattern = ?", (pattern,))
+            if cursor.rowcount == 0:
+                return False
+            self.blocklist = self.blocklist.updated(remove=[pattern])
+        self.save_blocklist_snapshot()
+        print(f" Unblocked: {pattern}")
+        return True
+    
+    def apply_blocklist_change(self, add=(), remove=()):
+        """Apply a change another process has already written to blocked_sites"""
+        self.blocklist_ready.wait()
+        with self.blocklist_lock:
+            self.blocklist = self.blocklist.updated(add=add, remove=remove)
+    
+    def import_blocked_sites(self, patterns, replace=False):
+        """Add many patterns at once (see blocklist.parse_blocklist) in one transaction.
 
-    def handle_https_request(self, client_socket, host, port):
-        """Handle HTTPS CONNECT requests"""
+        With replace=True the imported patterns become the whole block list.
+        The new snapshot is swapped in only after the database commit, so
+        requests see either the old list or the complete new one.
+        Returns (added, removed) counts.
+        """
+        patterns = set(patterns)
+        self.blocklist_ready.wait()
+        conn = self.db.connection()
+        with self.blocklist_lock:
+            current = self.blocklist
+            with conn:
+                if replace:
+                    conn.execute("DELETE FROM blocked_sites")
+                conn.executemany("INSERT OR IGNORE INTO blocked_sites (url_pattern) VALUES (?)",
+                                 ((pattern,) for pattern in patterns))
+            if replace:
+                self.blocklist = BlocklistMatcher(patterns, current.version + 1)
+            else:
+                self.blocklist = current.updated(add=patterns)
+        self.save_blocklist_snapshot()
+        added = len(patterns - current.patterns)
+        removed = len(current.patterns - patterns) if replace else 0
+        print(f" Imported block list: {added} added, {removed} removed, {len(self.blocklist)} total")
+        return added, removed
+    
+    def log_access(self, client_ip, url, method, status_code, blocked=0, rule=None):
+        """Log access attempt (written in the background by the log writer)"""
+        self.log_writer.log(client_ip, url, method, status_code, blocked, rule)
+
+    def handle_https_request(self, client_socket, client_ip, host, port, pending=b''):
+        """Handle HTTPS CONNECT requests; pending is whatever the client sent after the
+        CONNECT head (e.g. a TLS ClientHello in the same segment)"""
+        target_socket = None
         try:
             # Check if blocked
-            if self.is_blocked(host):
+            self.metrics.inc('proxy_requests_total{kind="connect"}')
+            match = self.is_blocked(host)
+            if match:
                 response = "HTTP/1.1 403 Forbidden\r\n\r\n🚫 This website is blocked by the proxy server."
                 client_socket.send(response.encode())
-                self.log_access("localhost", f"https://{host}", "CONNECT", 403, 1)
+                self.metrics.inc('proxy_blocked_total')
+                self.log_access("localhost", f"https://{host}", "CONNECT", 403, 1, describe_match(match))
+                return
+            if not self.wait_request_turn(client_ip, host):
+                client_socket.sendall(error_response(429))
+                self.log_access("localhost", f"https://{host}", "CONNECT", 429, 0)
                 return
-            
-            # Send connection established
-            client_socket.send(b"HTTP/1.1 200 Connection Established\r\n\r\n")
             
             # Connect to target
-            target_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            target_socket.settimeout(10)
-            target_socket.connect((host, port))
+            try:
+                target_socket = self.resolver.create_connection((host, port), timeout=10)
+            except OSError:
+                client_socket.sendall(b"HTTP/1.1 502 Bad Gateway\r\n\r\n")
+                self.log_access("localhost", f"https://{host}", "CONNECT", 502, 0)
+                raise
+            
+            # Send connection established
+            client_socket.sendall(b"HTTP/1.1 200 Connection Established\r\n\r\n")
             
             self.log_access("localhost", f"https://{host}", "CONNECT", 200, 0)
             
-            # Tunnel data
-            self.tunnel_data(client_socket, target_socket)
+            # Tunnel data; a forced close must also end the upstream side
+            self.connections.attach(client_socket, functools.partial(shutdown_socket, target_socket))
+            self.metrics.gauge('proxy_active_tunnels', 1)
+            meter = self.rate_limiter.meter(client_ip, host)
+            try:
+                if pending:
+                    target_socket.sendall(pending)
+                    meter.pause(len(pending))
+                sent, received = self.tunnel_data(client_socket, target_socket, meter)
+                sent += len(pending)
+            finally:
+                self.metrics.gauge('proxy_active_tunnels', -1)
+            self.metrics.inc('proxy_bytes_total{kind="tunnel",direction="upstream"}', sent)
+            self.metrics.inc('proxy_bytes_total{kind="tunnel",direction="downstream"}', received)
             
         except Exception as e:
-            print(f"HTTPS Error: {e}")
+            logger.warning("HTTPS error for %s:%s: %s", host, port, e)
         finally:
-            try:
-                client_socket.close()
-            except:
-                pass
+            for sock in (client_socket, target_socket):
+                try:
+                    if sock:
+                        sock.close()
+                except:
+                    pass
 
-    def tunnel_data(self, client_socket, target_socket):
-        """Tunnel data between client and target"""
-        sockets = [client_socket, target_socket]
-        
-        while True:
-            try:
-                read_sockets, _, _ = select.select(sockets, [], [], 5)
-                
-                if not read_sockets:
-                    break
-                
-                for sock in read_sockets:
-                    try:
-                        data = sock.recv(8192)
-                        if not data:
-                            return
-                        
-                        if sock is client_socket:
-                            target_socket.send(data)
-                        else:
-                            client_socket.send(data)
-                    except:
-                        return
-                        
-            except Exception:
-                break
+    def tunnel_data(self, client_socket, target_socket, meter=None):
+        """Tunnel data between client and target, paced by the client's and host's byte limits"""
+        return relay_tunnel(
+            client_socket, target_socket,
+            idle_timeout=config.TUNNEL_IDLE_TIMEOUT,
+            buffer_size=config.TUNNEL_BUFFER_SIZE,
+            use_splice=config.TUNNEL_SPLICE,
+            socket_buffer=config.TUNNEL_SOCKET_BUFFER,
+            throttle=meter.pause if meter else None
+        )
+    
+    def serve_client(self, client_socket, client_address, accepted):
+        """Handler thread entry: serve an admitted connection, then free its slot"""
+        self.metrics.observe('queue', accepted)
+        try:
+            self.handle_client(client_socket, client_address)
+        finally:
+            self.admission.release(client_address[0])
     
     def handle_client(self, client_socket, client_address):
-        """Handle client connection"""
+        """Handle client connection (several requests while the client keeps it alive)"""
+        buffer = bytearray(config.RELAY_BUFFER_SIZE)
+        pending = b''
+        self.metrics.gauge('proxy_active_connections', 1)
+        self.connections.add(client_socket, functools.partial(shutdown_socket, client_socket))
         try:
-            request = client_socket.recv(8192).decode('utf-8', errors='ignore')
-            
-            if not request:
-                return
-            
-            first_line = request.split('\n')[0]
-            parts = first_line.split()
-            if len(parts) < 2:
-                return
-
-            method = parts[0]
-            
-            # Handle HTTPS CONNECT
-            if method.upper() == 'CONNECT':
-                host_port = parts[1].split(':')
-                host = host_port[0]
-                port = int(host_port[1]) if len(host_port) > 1 else 443
-                self.handle_https_request(client_socket, host, port)
-                return
-            
-            # Handle HTTP
-            if len(parts) < 3:
-                return
+            client_socket.settimeout(config.CONNECTION_TIMEOUT)
+            while True:
+                # A draining server closes connections between requests
+                if not self.connections.idle(client_socket):
+                    return
+                try:
+                    head, pending = read_head(client_socket, buffer, pending, limit=config.MAX_REQUEST_SIZE)
+                except socket.timeout:
+                    return
+                except HeadTooLargeError as e:
+                    self.reject_request(client_socket, client_address, HTTPParseError(str(e), 431))
+                    return
+                if not head:
+                    return
+                self.connections.busy(client_socket)
+                
+                started = time.perf_counter()
+                try:
+                    method, target, version, request_headers, request = parse_request(head)
+                except HTTPParseError as e:
+                    self.reject_request(client_socket, client_address, e)
+                    return
+                self.metrics.observe('parse', started)
                 
-            url = parts[1]
-            if '://' not in url:
-                url = 'http://' + url
+                # Handle HTTPS CONNECT
+                if method.upper() == 'CONNECT':
+                    host_port = target.split(':')
+                    host = host_port[0]
+                    port = int(host_port[1]) if len(host_port) > 1 and host_port[1].isdigit() else 443
+                    self.handle_https_request(client_socket, client_address[0], host, port, pending)
+                    return
                 
-            parsed_url = urlparse(url)
-            host = parsed_url.hostname
-            
-            # Check if blocked
-            if self.is_blocked(host):
-                response = "HTTP/1.1 403 Forbidden\r\n\r\n🚫 This website is blocked."
-                client_socket.send(response.encode())
-                self.log_access(client_address[0], url, method, 403, 1)
-                return
-            
-            # Forward request
-            port = parsed_url.port or 80
-            target_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            target_socket.settimeout(10)
-            target_socket.connect((host, port))
-            target_socket.send(request.encode())
-            
-            response = b""
-            while True:
-                data = target_socket.recv(8192)
-                if not data:
-                    break
-                response += data
-            
-            client_socket.send(response)
-            self.log_access(client_address[0], url, method, 200, 0)
-            target_socket.close()
+                # Handle HTTP
+                try:
+                    keep_alive, pending = self.handle_http_request(
+                        client_socket, client_address, method, target, version,
+                        request, request_headers, buffer, pending
+                    )
+                except HTTPParseError as e:
+                    self.reject_request(client_socket, client_address, e)
+                    return
+                if not keep_alive:
+                    return
+                # Idle keep-alive connections get a shorter timeout
+                client_socket.settimeout(config.KEEP_ALIVE_TIMEOUT)
                 
         except Exception as e:
-            print(f"Error: {e}")
+            logger.warning("Error handling %s: %s", client_address[0], e)
         finally:
+            self.connections.remove(client_socket)
+            self.metrics.gauge('proxy_active_connections', -1)
             try:
                 client_socket.close()
             except:
                 pass
     
+    def reject_request(self, client_socket, client_address, error):
+        """Answer a request that will not be forwarded and log why"""
+        logger.info("Rejected request from %s: %s", client_address[0], error)
+        self.metrics.inc(f'proxy_rejected_requests_total{{status="{error.status}"}}')
+        try:
+            client_socket.sendall(error_response(error.status))
+        except OSError:
+            pass
+    
+    def handle_http_request(self, client_socket, client_address, method, target, version,
+                            request, request_headers, buffer, pending):
+        """Forward one plain HTTP request; returns (keep_alive, bytes read past the request)"""
+        url, host, port, path, authority = request_target(target, request_headers)
+        
+        # Check if blocked
+        self.metrics.inc('proxy_requests_total{kind="http"}')
+        match = self.is_blocked(host)
+        if match:
+            response = "HTTP/1.1 403 Forbidden\r\n\r\n🚫 This website is blocked."
+            client_socket.send(response.encode())
+            self.metrics.inc('proxy_blocked_total')
+            self.log_access(client_address[0], url, method, 403, 1, describe_match(match))
+            return False, b''
+        if not self.wait_request_turn(client_address[0], host):
+            client_socket.sendall(error_response(429))
+            self.log_access(client_address[0], url, method, 429, 0)
+            return False, b''
+        meter = self.rate_limiter.meter(client_address[0], host)
+        
+        keep_alive = wants_keep_alive(version, request_headers) and not self.connections.draining
+        request_framer = BodyFramer(*request_framing(request_headers))
+        
+        use_cache = config.CACHE_ENABLED and self.cache.is_cacheable_request(method, request_headers)
+        cached = None
+        if use_cache:
+            cached = self.cache.lookup(url, request_headers)
+            if cached and self.cache.can_serve(cached, request_headers) and request_framer.done:
+                self.send_cached(client_socket, cached, keep_alive, meter)
+                self.cache.record_hit(cached)
+                self.log_access(client_address[0], url, method, cached.status_code, 0)
+                return keep_alive, pending
+            if not (cached and cached.has_validators()):
+                cached = None
+        
+        # An identical request already being fetched is followed instead of fetched again
+        flight = None
+        if use_cache and request_framer.done and self.collapser.collapsible(request_headers):
+            flight, leading = self.collapser.join(url, request_headers)
+            if not leading:
+                status_code, keep_alive = self.follow(client_socket, flight, url, request_headers,
+                                                      keep_alive, meter)
+                if status_code is not None:
+                    self.log_access(client_address[0], url, method, status_code, 0)
+                    return keep_alive, pending
+                flight = None
+        
+        # Upstream request: origin-form target, our own connection headers, plus
+        # validators when revalidating
+        upstream_headers = {'Host': authority, 'Connection': 'keep-alive'}
+        if cached is not None:
+            upstream_headers.update(cached.conditional_headers())
+        remove = hop_by_hop_headers(request_headers)
+        if not request_framer.done and request_headers.get('expect', '').lower() == '100-continue':
+            # Answer the expectation here so the body can be streamed straight through
+            client_socket.sendall(CONTINUE_RESPONSE)
+            remove.add('expect')
+        upstream_request = set_headers(
+            set_request_line(request, method, path, version), upstream_headers, remove
+        ).encode('iso-8859-1')
+        
+        try:
+            # A reused connection may have been closed by the origin just before we
+            # sent; retry once on a fresh one if the request has no body to replay
+            replayable = request_framer.done
+            fresh = False
+            while True:
+                try:
+                    target_socket, reused = self.upstream_pool.acquire(host, port, fresh=fresh)
+                except OSError as e:
+                    return self.bad_gateway(client_socket, client_address, method, url, flight, e)
+                close_upstream = functools.partial(shutdown_socket, target_socket)
+                self.connections.attach(client_socket, close_upstream)
+                try:
+                    target_socket.settimeout(10)
+                    target_socket.sendall(upstream_request)
+                    pending = relay_body(client_socket, target_socket, buffer, request_framer, pending,
+                                         throttle=meter.pause)
+                    started = time.perf_counter()
+                    head, rest = read_head(target_socket, buffer)
+                    while is_interim(head):
+                        # 1xx responses are not for HTTP/1.0 clients
+                        if version != 'HTTP/1.0':
+                            client_socket.sendall(head)
+                        head, rest = read_head(target_socket, buffer, rest)
+                    self.metrics.observe('ttfb', started)
+                    if not head:
+                        raise HTTPRelayError("origin closed without a response")
+                except (OSError, HTTPRelayError) as e:
+                    self.connections.detach(client_socket, close_upstream)
+                    self.upstream_pool.release(host, port, target_socket, False)
+                    if isinstance(e, FramingError):
+                        # Only the request body has been framed so far
+                        raise HTTPParseError(f"invalid request body: {e}")
+                    if reused and replayable and not fresh:
+                        fresh = True
+                        continue
+                    return self.bad_gateway(client_socket, client_address, method, url, flight, e)
+                break
+            
+            reusable = False
+            try:
+                status_code, keep_alive, reusable = self.relay_response(
+                    client_socket, target_socket, head, rest, buffer, method, url,
+                    request_headers, keep_alive, use_cache, cached, flight, meter
+                )
+            finally:
+                # Once pooled the connection may serve another client, so stop tracking it
+                self.connections.detach(client_socket, close_upstream)
+                self.upstream_pool.release(host, port, target_socket, reusable)
+        except Exception as e:
+            if flight is not None:
+                self.collapser.land(flight, e)
+            raise
+        if flight is not None:
+            self.collapser.land(flight)
+        
+        self.log_access(client_address[0], url, method, status_code, 0)
+        return keep_alive, pending
+    
+    def bad_gateway(self, client_socket, client_address, method, url, flight, error):
+        """Answer 502 when the origin could not be reached or sent no response.
+
+        Nothing but 1xx responses has reached the client at that point.
+        Returns (keep_alive, pending) for handle_http_request.
+        """
+        logger.info("Upstream request for %s failed: %s", url, error)
+        if flight is not None:
+            self.collapser.land(flight, error)
+        client_socket.sendall(error_response(502))
+        self.log_access(client_address[0], url, method, 502, 0)
+        return False, b''
+    
+    def follow(self, client_socket, flight, url, request_headers, keep_alive, meter=None):
+        """Answer a request from an identical request's upstream fetch (see collapsing.Flight).
+
+        Returns (status code sent, client keep-alive). The status is None when
+        the caller has to fetch for itself: the response is another variant,
+        is not shareable, or did not start within the collapse timeout.
+        """
+        outcome = flight.wait_head(self.collapser.timeout)
+        if outcome == 'failed':
+            return self.flight_failed(client_socket, url, CollapsedRequestError(
+                f"upstream request failed: {flight.error}"))
+        if outcome == 'refreshed':
+            # The origin confirmed the cached copy, which is fresh again
+            cached = self.cache.lookup(url, request_headers)
+            if cached and self.cache.can_serve(cached, request_headers):
+                self.send_cached(client_socket, cached, keep_alive, meter)
+                self.cache.record_hit(cached)
+                self.collapser.record(True)
+                return cached.status_code, keep_alive
+        elif outcome == 'shared' and flight.matches(request_headers):
+            answer = self.send_flight(client_socket, flight, url, keep_alive, meter)
+            self.collapser.record(True)
+            return answer
+        self.collapser.record(False)
+        return None, keep_alive
+    
+    def send_flight(self, client_socket, flight, url, keep_alive, meter=None):
+        """Copy a flight's shared response to a client as it arrives (leader's or follower's).
+
+        The head goes out with the first body bytes, so a client whose fetch
+        fails or stalls before then still gets a 502 or 504.
+        Returns (status code sent, client keep-alive).
+        """
+        try:
+            data = flight.read(0, self.collapser.timeout)
+        except CollapsedRequestError as e:
+            return self.flight_failed(client_socket, url, e)
+        status_code, response_headers = parse_response_head(flight.head)
+        started = time.perf_counter()
+        client_socket.sendall(self.client_head(flight.head, response_headers, keep_alive) + data)
+        sent = len(data)
+        while data:
+            if meter:
+                meter.pause(len(data))
+            data = flight.read(sent, self.collapser.timeout)
+            client_socket.sendall(data)
+            sent += len(data)
+        self.metrics.observe('transfer', started)
+        self.metrics.inc('proxy_bytes_total{kind="http",direction="downstream"}', len(flight.head) + sent)
+        return status_code, keep_alive
+    
+    def flight_failed(self, client_socket, url, error):
+        """Tell a client that has received nothing yet that the fetch it waited on failed"""
+        logger.info("Shared fetch of %s failed: %s", url, error)
+        client_socket.sendall(error_response(error.status))
+        return error.status, False
+    
+    def fetch_shared(self, target_socket, buffer, framer, rest, flight, on_data, result):
+        """Read a shared response body into its flight at the origin's pace.
+
+        Runs on a thread of its own while the leader's client reads the flight
+        like any follower. result gets the bytes read past the body, or the error.
+        """
+        try:
+            result['leftover'] = relay_body(target_socket, None, buffer, framer, rest, on_data)
+            flight.finish()
+        except Exception as e:
+            result['error'] = e
+            flight.fail(e)
+    
+    def client_head(self, head, response_headers, keep_alive):
+        """An origin response head with this client connection's Connection header"""
+        return set_headers(
+            head.decode('iso-8859-1'),
+            {'Connection': 'keep-alive' if keep_alive else 'close'},
+            hop_by_hop_headers(response_headers)
+        ).encode('iso-8859-1')
+    
+    def send_cached(self, client_socket, cached, keep_alive, meter=None):
+        """Send a cached response with this connection's Connection header.
+
+        A body kept in a blob file goes from the page cache to the socket with
+        sendfile, without passing through Python. It is charged to the byte
+        limits once it has been sent.
+        """
+        body = self.cache.open_body(cached)
+        try:
+            client_socket.sendall(self.client_head(cached.head, cached.headers, keep_alive))
+            if body is None:
+                client_socket.sendall(cached.body)
+            else:
+                client_socket.sendfile(body, 0, cached.body_size)
+        finally:
+            if body is not None:
+                body.close()
+        if meter:
+            meter.pause(cached.size)
+    
+    def relay_response(self, client_socket, target_socket, head, rest, buffer, method, url,
+                       request_headers, keep_alive, use_cache, cached, flight=None, meter=None):
+        """Stream the origin response to the client.
+
+        With a flight (see collapsing.Flight) the response is also published to
+        followers when it may be shared; this client then reads it from the
+        flight like they do. With a meter the body is paced by the client's and
+        host's byte limits.
+        Returns (status_code, client keep-alive, upstream connection reusable).
+        """
+        status_code, response_headers = parse_response_head(head)
+        response_version = head.split(b' ', 1)[0].decode('iso-8859-1')
+        reusable = wants_keep_alive(response_version, response_headers)
+        
+        if cached is not None and status_code == 304:
+            # Origin confirmed our copy is still valid
+            self.cache.refresh(cached, response_headers)
+            if flight is not None:
+                flight.refreshed()
+            self.cache.record_hit(cached, revalidated=True)
+            self.send_cached(client_socket, cached, keep_alive, meter)
+            return cached.status_code, keep_alive, reusable and not rest
+        
+        try:
+            framing, length = response_framing(method, status_code, response_headers)
+        except FramingError as e:
+            # Nothing has reached the client yet, so it can still be told
+            logger.info("Invalid response for %s: %s", url, e)
+            if flight is not None:
+                flight.fail(e)
+            client_socket.sendall(error_response(502))
+            return 502, False, False
+        framer = BodyFramer(framing, length)
+        if framing == 'close':
+            # The body ends when the origin closes, so neither side can be reused
+            keep_alive = False
+            reusable = False
+        
+        # Followers get the response only if it has a bounded length and may be shared
+        sharing = False
+        if flight is not None:
+            sharing = framing == 'length' and length <= self.cache.max_object_size \
+                and self.cache.can_share(status_code, response_headers)
+            if sharing:
+                flight.publish(head, response_headers.get('vary', ''))
+            else:
+                flight.unshare()
+        
+        # Keep a copy only while the body might still fit in the cache
+        capture = None
+        if use_cache and status_code in CACHEABLE_STATUS and \
+                (framing != 'length' or length <= self.cache.max_object_size):
+            capture = bytearray(head)
+
+        def feed(piece):
+            nonlocal capture
+            if sharing:
+                flight.feed(piece)
+            if capture is not None:
+                capture += piece
+                if len(capture) > self.cache.max_object_size:
+                    capture = None
+        on_data = feed if capture is not None or sharing else None
+        
+        if sharing:
+            # The fetch does not wait on this client: a slow, rate-limited or
+            # vanished leader must not hold back or cut short its followers
+            result = {}
+            fetch = threading.Thread(
+                target=self.fetch_shared, name='proxy-fetch', daemon=True,
+                args=(target_socket, buffer, framer, rest, flight, on_data, result)
+            )
+            fetch.start()
+            try:
+                status_code, keep_alive = self.send_flight(client_socket, flight, url, keep_alive, meter)
+            finally:
+                fetch.join()
+            if 'error' in result:
+                # send_flight only returns before the body is complete once it
+                # has answered with 502 or 504
+                return status_code, False, False
+            leftover = result['leftover']
+        else:
+            started = time.perf_counter()
+            client_socket.sendall(self.client_head(head, response_headers, keep_alive))
+            leftover = relay_body(target_socket, client_socket, buffer, framer, rest, on_data,
+                                  throttle=meter.pause if meter else None)
+            self.metrics.observe('transfer', started)
+            self.metrics.inc('proxy_bytes_total{kind="http",direction="downstream"}', len(head) + framer.bytes)
+        if leftover:
+            reusable = False
+        
+        if use_cache:
+            self.cache.record_miss()
+            if capture is not None:
+                self.cache.store(url, request_headers, capture)
+        return status_code, keep_alive, reusable
+    
+    def inherit_listener(self, fd):
+        """Serve on a listening socket passed down by the process being replaced"""
+        self.inherited_socket = socket.socket(fileno=fd)
+    
+    def open_listener(self):
+        """The listening socket: inherited from a previous process, or newly bound"""
+        if self.inherited_socket is not None:
+            sock, self.inherited_socket = self.inherited_socket, None
+            return sock
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(config.LISTEN_BACKLOG)
+        return sock
+    
     def start_server(self):
-        """Start the proxy server"""
+        """Start the proxy server (blocks until stop_server has drained it)"""
+        self.ready.clear()
+        self.finished.clear()
+        self.start_error = None
+        self.connections.reset()
+        wake_receiver, self.wake_sender = socket.socketpair()
         try:
-            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.server_socket.bind((self.host, self.port))
-            self.server_socket.listen(5)
+            self.server_socket = self.open_listener()
+            # Non-blocking: another process may share the socket and win the accept
+            self.server_socket.setblocking(False)
             self.is_running = True
+            self.ready.set()
             
             print(f"✅ Proxy server running on {self.host}:{self.port}")
             
             while self.is_running:
+                readable, _, _ = select.select([self.server_socket, wake_receiver], [], [])
+                if wake_receiver in readable:
+                    break
                 try:
                     client_socket, client_address = self.server_socket.accept()
-                    client_thread = threading.Thread(
-                        target=self.handle_client,
-                        args=(client_socket, client_address),
-                        daemon=True
-                    )
-                    client_thread.start()
+                except (BlockingIOError, InterruptedError):
+                    continue
                 except socket.error:
                     break
+                # Shed overload here, before it costs a thread or a queue slot
+                if not self.admission.admit(client_address[0]):
+                    reject(client_socket)
+                    continue
+                if not self.handlers.submit(client_socket, client_address, time.perf_counter()):
+                    self.admission.release(client_address[0])
+                    self.admission.record_shed('global')
+                    reject(client_socket)
                     
         except Exception as e:
+            self.start_error = str(e)
             print(f"Server error: {e}")
+        finally:
             self.is_running = False
+            # Closing only this process's handle leaves an inherited socket
+            # listening in the process that took over
+            if self.server_socket:
+                self.server_socket.close()
+            self.drain_connections()
+            wake_receiver.close()
+            self.wake_sender.close()
+            self.ready.set()
+            self.finished.set()
+    
+    def drain_connections(self):
+        """Let open connections finish for up to DRAIN_TIMEOUT seconds, then close them"""
+        if len(self.connections):
+            logger.info("Draining %d open connections", len(self.connections))
+        forced = self.connections.drain(config.DRAIN_TIMEOUT)
+        if forced:
+            logger.warning("Closed %d connections still open after %ss", forced, config.DRAIN_TIMEOUT)
+            self.metrics.inc('proxy_connections_forced_closed_total', forced)
     
     def stop_server(self):
-        """Stop the proxy server"""
+        """Stop accepting, drain open connections and wait until that is done"""
         self.is_running = False
-        if self.server_socket:
-            self.server_socket.close()
+        try:
+            self.wake_sender.send(b'\0')
+        except (AttributeError, OSError):
+            pass
+        self.finished.wait(config.DRAIN_TIMEOUT + 5)
+        self.log_writer.flush()
+        self.upstream_pool.close_all()
         print("🛑 Proxy server stopped")
     
+    def clear_cache(self):
+        """Drop every cached response"""
+        self.cache.clear()
+    
+    def rate_limit_settings(self):
+        """Rate limits from config, as RateLimiter.configure takes them"""
+        return {
+            'client_bytes': config.CLIENT_BYTES_PER_SECOND,
+            'client_requests': config.CLIENT_REQUESTS_PER_SECOND,
+            'host_bytes': config.HOST_BYTES_PER_SECOND,
+            'host_requests': config.HOST_REQUESTS_PER_SECOND
+        }
+    
+    def set_rate_limits(self, client_bytes, client_requests, host_bytes, host_requests):
+        """Change the rate limits of the running proxy (until it restarts)"""
+        config.CLIENT_BYTES_PER_SECOND = client_bytes
+        config.CLIENT_REQUESTS_PER_SECOND = client_requests
+        config.HOST_BYTES_PER_SECOND = host_bytes
+        config.HOST_REQUESTS_PER_SECOND = host_requests
+        self.rate_limiter.configure(**self.rate_limit_settings())
+    
+    def wait_request_turn(self, client_ip, host):
+        """Hold a request back under the request rate limits; False if it must be refused"""
+        delay = self.rate_limiter.request(client_ip, host)
+        if delay is None:
+            return False
+        if delay:
+            time.sleep(delay)
+        return True
+    
+    def clear_logs(self):
+        """Delete every access log record"""
+        self.log_writer.clear()
+    
     def get_stats(self):
         """Get server statistics"""
-        cursor = self.conn.cursor()
-        
-        cursor.execute("SELECT COUNT(*) FROM access_logs")
-        total_requests = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM access_logs WHERE blocked = 1")
-        blocked_requests = cursor.fetchone()[0]
+        cursor = self.db.connection().cursor()
         
         cursor.execute("SELECT COUNT(*) FROM cache WHERE expires > datetime('now')")
         cached_items = cursor.fetchone()[0]
         
         return {
-            'total_requests': total_requests,
-            'blocked_requests': blocked_requests,
+            **self.runtime_stats(),
             'cached_items': cached_items,
-            'blocked_sites_count': len(self.blocked_sites)
+            'blocked_sites_count': len(self.blocklist),
+            'blocklist_version': self.blocklist.version
+        }
+    
+    def runtime_stats(self):
+        """Counters kept in this process (the part of get_stats workers report)"""
+        return {
+            **self.log_writer.totals(),
+            'logs_dropped': self.log_writer.dropped,
+            **self.cache.get_stats(),
+            **self.upstream_pool.get_stats(),
+            **self.resolver.get_stats(),
+            **self.block_decisions.get_stats(),
+            **self.collapser.get_stats(),
+            **self.rate_limiter.get_stats(),
+            **self.admission.get_stats()
         }
 
-# Global instance
-proxy_server_instance = HTTPProxyServer()
\ No newline at end of file
+def create_proxy_server(engine=None, host=None, port=None):
+    """Create a proxy server using the configured engine ('threaded' or 'asyncio').
+
+    With config.PROXY_WORKERS > 1 the engine runs in that many worker processes.
+    """
+    configure_logging()
+    engine = engine or config.PROXY_ENGINE
+    host = host or config.PROXY_HOST
+    port = port or config.PROXY_PORT
+    if engine not in ('threaded', 'asyncio'):
+        raise ValueError(f"Unknown proxy engine: {engine}")
+    if config.PROXY_WORKERS > 1:
+        from workers import MultiProcessProxyServer
+        return MultiProcessProxyServer(host, port, workers=config.PROXY_WORKERS, engine=engine)
+    if engine == 'asyncio':
+        from async_proxy import AsyncHTTPProxyServer
+        return AsyncHTTPProxyServer(host, port)
+    return HTTPProxyServer(host, port)
+
+_instance = None
+_instance_lock = threading.Lock()
+
+def get_proxy_server():
+    """The process's proxy server, created from config on first use (importing creates nothing)"""
+    global _instance
+    if _instance is None:
+        with _instance_lock:
+            if _instance is None:
+                _instance = create_proxy_server()
+    return _instance
\ No newline at end of file
@@ -0,0 +1,103 @@
+"""Entry point of a proxy worker process started by workers.MultiProcessProxyServer.
+
+Kept apart from workers.py so that starting a worker does not import
+proxy_server before the supervisor's settings have been applied.
+"""
+
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+
+import config
+
+
+def run_worker(index, settings, commands, events):
+    """Worker process entry point: serve until told to stop, then drain"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for name, value in settings.items():
+        setattr(config, name, value)
+    # Created from the settings applied above
+    from proxy_server import get_proxy_server
+    server = get_proxy_server()
+    server.reuse_port = True
+
+    # stop_server waits for the drain, which needs this (the serving) thread
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.stop_server).start())
+    reporting = threading.Lock()
+    # Last access log record already sent to the supervisor
+    progress = {'log_sequence': 0}
+    finished = threading.Event()
+    threading.Thread(target=worker_control, args=(server, commands),
+                     name='worker-control', daemon=True).start()
+    threading.Thread(target=worker_reporter, args=(server, index, events, reporting, finished, progress),
+                     name='worker-reporter', daemon=True).start()
+    threading.Thread(target=worker_ready, args=(server, index, events),
+                     name='worker-ready', daemon=True).start()
+
+    # Returns once the server has stopped and drained its connections
+    server.start_server()
+    server.log_writer.stop()
+    # The final report must be the last one the supervisor sees from this worker
+    with reporting:
+        finished.set()
+        send_logs(server, index, events, progress)
+        events.put(('final', index, server.runtime_stats()))
+    events.close()
+    events.join_thread()
+
+
+def worker_ready(server, index, events):
+    """Tell the supervisor when this worker is accepting connections"""
+    server.ready.wait()
+    if server.is_running:
+        events.put(('ready', index, None))
+
+
+def worker_control(server, commands):
+    """Apply commands sent by the supervisor"""
+    while True:
+        command = commands.get()
+        name = command[0]
+        if name == 'stop':
+            server.stop_server()
+            return
+        if name == 'reload_blocklist':
+            server.load_blocked_sites()
+        elif name == 'blocklist_change':
+            server.apply_blocklist_change(*command[1:])
+        elif name == 'clear_cache':
+            # The supervisor has emptied the shared table and blob files
+            server.cache.clear_memory()
+        elif name == 'rate_limits':
+            server.set_rate_limits(**command[1])
+        elif name == 'reset_totals':
+            server.log_writer.flush()
+            server.log_writer.reset_totals()
+
+
+def send_logs(server, index, events, progress):
+    """Send the access log records committed since the last call (for the live views)"""
+    records, progress['log_sequence'] = server.log_writer.recent_since(progress['log_sequence'])
+    if records:
+        events.put(('logs', index, records))
+
+
+def worker_reporter(server, index, events, reporting, finished, progress):
+    """Send stats and new access log records to the supervisor, and stop if the
+    supervisor has gone away"""
+    parent = multiprocessing.parent_process()
+    while not finished.is_set():
+        time.sleep(config.WORKER_STATS_INTERVAL)
+        if parent is not None and not parent.is_alive():
+            server.stop_server()
+            return
+        with reporting:
+            if finished.is_set():
+                return
+            try:
+                send_logs(server, index, events, progress)
+                events.put(('stats', index, server.runtime_stats()))
+            except (OSError, ValueError, queue.Full):
+                return
@@ -0,0 +1,223 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Setting names of the limits, as accepted by RateLimiter.configure
+LIMITS = ('client_bytes', 'client_requests', 'host_bytes', 'host_requests')
+
+# Clients listed by get_stats, the ones that moved the most bytes
+TOP_CLIENTS = 20
+
+
+class TokenBucket:
+    """rate tokens per second, holding at most burst seconds' worth.
+
+    take() lets the bucket go into debt: a piece a relay already read is
+    always sent on, and the debt is how long the relay then pauses before it
+    reads again. So limits never drop data, they only slow the reads.
+    """
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.capacity = max(rate * burst, 1)
+        self.tokens = self.capacity
+        self.updated = now
+
+    def take(self, amount, now, max_wait=None):
+        """Seconds until the bucket is out of debt after taking amount.
+
+        If that would be longer than max_wait nothing is taken and None is returned.
+        """
+        tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate) - amount
+        wait = -tokens / self.rate if tokens < 0 else 0
+        if max_wait is not None and wait > max_wait:
+            return None
+        self.tokens = tokens
+        self.updated = now
+        return wait
+
+
+class Usage:
+    """Traffic of one client IP or destination host, and its buckets.
+
+    lock guards bytes, throttled_until and byte_bucket, which relays update
+    for every piece they move; the rest is guarded by the limiter's lock.
+    """
+
+    __slots__ = ('bytes', 'requests', 'throttled_until', 'byte_bucket', 'request_bucket', 'lock')
+
+    def __init__(self):
+        self.bytes = 0
+        self.requests = 0
+        self.throttled_until = 0
+        self.byte_bucket = None
+        self.request_bucket = None
+        self.lock = threading.Lock()
+
+
+class RateLimiter:
+    """Token-bucket limits on bytes and requests per second, per client IP and
+    per destination host.
+
+    Requests are held back until both the client's and the host's request
+    buckets have a token; one that would wait longer than max_delay is refused
+    instead. Relays charge every piece they move to the connection's Meter and
+    pause for as long as either byte bucket is in debt. A limit of 0 means
+    unlimited.
+
+    Usage is kept for the tracked most recently active clients and hosts each,
+    so a flood of one-off addresses cannot grow it without bound. A Meter
+    holds on to the usage it was created with even if it is dropped from the
+    table, so a connection's pacing never depends on that bookkeeping.
+    """
+
+    def __init__(self, client_bytes=0, client_requests=0, host_bytes=0, host_requests=0,
+                 burst=1.0, max_delay=5, tracked=1024):
+        self.burst = burst
+        self.max_delay = max_delay
+        self.tracked = tracked
+        self.clients = OrderedDict()
+        self.hosts = OrderedDict()
+        self.lock = threading.Lock()
+        self.delayed = 0
+        self.refused = 0
+        self.paused = 0.0
+        self.configure(client_bytes=client_bytes, client_requests=client_requests,
+                       host_bytes=host_bytes, host_requests=host_requests)
+
+    def configure(self, **limits):
+        """Change limits (see LIMITS); buckets start over, full, under the new rates"""
+        with self.lock:
+            for name, value in limits.items():
+                if name not in LIMITS:
+                    raise ValueError(f"unknown limit {name}")
+                setattr(self, name, value)
+            for usage in list(self.clients.values()) + list(self.hosts.values()):
+                usage.request_bucket = None
+                # Relays use byte_bucket under the usage's lock only
+                with usage.lock:
+                    usage.byte_bucket = None
+
+    def limits(self):
+        with self.lock:
+            return {name: getattr(self, name) for name in LIMITS}
+
+    def request(self, client_ip, host):
+        """Seconds to hold a new request back, or None if it must be refused"""
+        now = time.monotonic()
+        with self.lock:
+            client = self._usage(self.clients, client_ip)
+            target = self._usage(self.hosts, host)
+            client.requests += 1
+            target.requests += 1
+            if not (self.client_requests or self.host_requests):
+                return 0
+            # Check both buckets before taking from either, so a refusal costs nothing
+            waits = []
+            for usage, rate in ((client, self.client_requests), (target, self.host_requests)):
+                if rate:
+                    if usage.request_bucket is None:
+                        usage.request_bucket = TokenBucket(rate, self.burst, now)
+                    bucket = usage.request_bucket
+                    waits.append((bucket, bucket.take(1, now, self.max_delay)))
+            if any(wait is None for _, wait in waits):
+                for bucket, wait in waits:
+                    if wait is not None:
+                        # Give back the token taken from the other bucket
+                        bucket.tokens += 1
+                self.refused += 1
+                return None
+            delay = max(wait for _, wait in waits)
+            if delay:
+                self.delayed += 1
+            return delay
+
+    def meter(self, client_ip, host):
+        """A Meter for one connection; its client and host usage are looked up once here"""
+        with self.lock:
+            return Meter(self, self._usage(self.clients, client_ip), self._usage(self.hosts, host))
+
+    def charge(self, client, target, amount):
+        """Count bytes relayed for a client's and a host's Usage; returns seconds to pause.
+
+        Only those two usages are locked, so relays for other clients and
+        hosts never wait on each other.
+        """
+        if not (self.client_bytes or self.host_bytes):
+            # No byte limits: only keep the traffic totals for the settings page
+            with client.lock:
+                client.bytes += amount
+            with target.lock:
+                target.bytes += amount
+            return 0
+        now = time.monotonic()
+        delay = 0
+        for usage, rate in ((client, self.client_bytes), (target, self.host_bytes)):
+            with usage.lock:
+                usage.bytes += amount
+                if rate:
+                    bucket = usage.byte_bucket
+                    if bucket is None:
+                        bucket = usage.byte_bucket = TokenBucket(rate, self.burst, now)
+                    wait = bucket.take(amount, now)
+                    if wait:
+                        usage.throttled_until = max(usage.throttled_until, now + wait)
+                        delay = max(delay, wait)
+        if delay:
+            with self.lock:
+                self.paused += delay
+        return delay
+
+    def _usage(self, table, key):
+        """The Usage for key, kept in least recently active order (caller holds the lock)"""
+        usage = table.get(key)
+        if usage is None:
+            usage = table[key] = Usage()
+            if len(table) > self.tracked:
+                table.popitem(last=False)
+        else:
+            table.move_to_end(key)
+        return usage
+
+    def get_stats(self):
+        now = time.monotonic()
+        with self.lock:
+            top = sorted(self.clients.items(), key=lambda item: item[1].bytes, reverse=True)[:TOP_CLIENTS]
+            return {
+                'rate_limited_requests': self.delayed,
+                'rate_limit_refusals': self.refused,
+                'rate_limit_pause_seconds': round(self.paused, 3),
+                'throttled_clients': sum(1 for usage in self.clients.values() if usage.throttled_until > now),
+                'throttled_hosts': sum(1 for usage in self.hosts.values() if usage.throttled_until > now),
+                'client_traffic': {
+                    client_ip: {
+                        'bytes': usage.bytes,
+                        'requests': usage.requests,
+                        'throttled': usage.throttled_until > now
+                    }
+                    for client_ip, usage in top
+                }
+            }
+
+
+class Meter:
+    """Charges the bytes one connection relays to its client's and host's buckets"""
+
+    __slots__ = ('limiter', 'client', 'host')
+
+    def __init__(self, limiter, client, host):
+        self.limiter = limiter
+        self.client = client
+        self.host = host
+
+    def charge(self, amount):
+        """Seconds the caller should pause before reading more"""
+        return self.limiter.charge(self.client, self.host, amount)
+
+    def pause(self, amount):
+        """charge() for blocking relays: sleeps the pause off in the calling thread"""
+        delay = self.charge(amount)
+        if delay:
+            time.sleep(delay)
@@ -4,8 +4,21 @@ HTTP Proxy Server Launcher
 Starts both the web interface and proxy server
 """
 
-from web_interface import run_web_interface
+import argparse
+import os
+import select
+import signal
+import subprocess
 import sys
+import threading
+
+import config
+
+# Set by hand_off in the environment of the process taking over
+PROXY_FD_ENV = 'PROXY_LISTEN_FD'
+WEB_FD_ENV = 'WEB_LISTEN_FD'
+READY_FD_ENV = 'PROXY_READY_FD'
+HANDOFF_TIMEOUT = 30  # Seconds to wait for the new process before giving up on a restart
 
 def print_banner():
     """Print startup banner"""
@@ -15,6 +28,8 @@ def print_banner():
     print(banner)
     print(" Web Interface: http://localhost:5000")
     print(" Proxy Server: localhost:8080")
+    if config.PROXY_WORKERS > 1:
+        print(f" Workers: {config.PROXY_WORKERS} processes ({config.PROXY_ENGINE} engine)")
     print("\n" + "="*50)
     print(" SETUP INSTRUCTIONS:")
     print("="*50)
@@ -27,13 +42,104 @@ def print_banner():
     print("5. Start browsing!")
     print("\n Press Ctrl+C to stop\n")
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="HTTP proxy server with web interface")
+    parser.add_argument('--workers', type=int, default=config.PROXY_WORKERS,
+                        help='proxy worker processes sharing the port (needs SO_REUSEPORT)')
+    parser.add_argument('--engine', choices=('threaded', 'asyncio'), default=config.PROXY_ENGINE)
+    parser.add_argument('--start', action='store_true',
+                        help='start the proxy right away instead of waiting for the Start button')
+    return parser.parse_args()
+
+def hand_off(proxy_server, web_server):
+    """Start a new launcher on this one's listening sockets and wait until it is up.
+
+    The new process accepts on the inherited sockets before this one stops, so
+    a restart (e.g. to pick up new code) never refuses a connection. Worker
+    processes bind the port with SO_REUSEPORT themselves, so in that mode only
+    the web interface socket is passed on. Returns False if the new process
+    did not come up in time.
+    """
+    # Both processes accept on the shared sockets for a moment, so neither may
+    # block in accept() after the other one took the connection
+    web_server.socket.setblocking(False)
+    fds = {WEB_FD_ENV: web_server.fileno()}
+    if proxy_server.is_running and proxy_server.server_socket is not None:
+        fds[PROXY_FD_ENV] = proxy_server.server_socket.fileno()
+    ready_r, ready_w = os.pipe()
+    env = dict(os.environ, **{name: str(fd) for name, fd in fds.items()})
+    env[READY_FD_ENV] = str(ready_w)
+    argv = [sys.executable] + sys.argv
+    if proxy_server.is_running and '--start' not in argv:
+        argv.append('--start')
+    child = subprocess.Popen(argv, env=env, pass_fds=list(fds.values()) + [ready_w])
+    os.close(ready_w)
+    try:
+        readable, _, _ = select.select([ready_r], [], [], HANDOFF_TIMEOUT)
+        if readable and os.read(ready_r, 1):
+            return True
+    finally:
+        os.close(ready_r)
+    print(" Restart failed: the new process did not start, still serving")
+    child.terminate()
+    return False
+
+def restart(proxy_server):
+    """SIGHUP: hand the sockets to a new process; main() then drains and exits"""
+    import web_interface
+    if hand_off(proxy_server, web_interface.web_server):
+        # Ends serve_forever in the main thread
+        web_interface.web_server.shutdown()
+
+def signal_ready(proxy_server, fd, wait_for_proxy):
+    """Tell the process that started us (see hand_off) that we are serving"""
+    if wait_for_proxy:
+        proxy_server.ready.wait()
+    os.write(fd, b'1' if not wait_for_proxy or proxy_server.is_running else b'')
+    os.close(fd)
+
 def main():
     """Main entry point"""
+    args = parse_args()
+    config.PROXY_WORKERS = args.workers
+    config.PROXY_ENGINE = args.engine
+
+    from web_interface import run_web_interface
+    from proxy_server import get_proxy_server
+
+    # Created from the settings above; its database and block list load in the background
+    proxy_server_instance = get_proxy_server()
+
+    # Sockets inherited from the process this one replaces
+    listen_fd = os.environ.pop(PROXY_FD_ENV, None)
+    web_fd = os.environ.pop(WEB_FD_ENV, None)
+    ready_fd = os.environ.pop(READY_FD_ENV, None)
+    if listen_fd:
+        proxy_server_instance.inherit_listener(int(listen_fd))
+
+    # Treat SIGTERM like Ctrl+C so connections get drained
+    signal.signal(signal.SIGTERM, lambda signum, frame: signal.default_int_handler(signum, frame))
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, lambda signum, frame: threading.Thread(
+            target=restart, args=(proxy_server_instance,), daemon=True).start())
     try:
         print_banner()
-        run_web_interface()
+        if args.start:
+            proxy_server_instance.ready.clear()
+            threading.Thread(target=proxy_server_instance.start_server, daemon=True).start()
+        if ready_fd:
+            threading.Thread(target=signal_ready, args=(proxy_server_instance, int(ready_fd), args.start),
+                             daemon=True).start()
+        run_web_interface(fd=int(web_fd) if web_fd else None)
+        # Only returns after a restart handed the sockets to a new process
+        print("\n Handed off to a new process, draining...")
+        if proxy_server_instance.is_running:
+            proxy_server_instance.stop_server()
+        print(" Goodbye!")
     except KeyboardInterrupt:
         print("\n\n Shutting down proxy server...")
+        if proxy_server_instance.is_running:
+            proxy_server_instance.stop_server()
         print(" Goodbye!")
         sys.exit(0)
     except Exception as e:
@@ -41,4 +147,4 @@ def main():
         sys.exit(1)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
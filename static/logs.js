@@ -0,0 +1,82 @@
+// Live access log: new entries are pushed on /api/stream and added to the top
+// of the first page when they match the current filters
+const params = new URLSearchParams(location.search);
+const table = document.querySelector('.logs-table tbody');
+const pageSize = parseInt(table.dataset.pageSize, 10);
+
+function matchesFilters(log) {
+    const client = params.get('client');
+    const host = params.get('host');
+    const status = params.get('status');
+    const blocked = params.get('blocked');
+    const since = params.get('since');
+    if (client && log.client_ip !== client) return false;
+    if (status && log.status_code !== parseInt(status, 10)) return false;
+    if (blocked && String(log.blocked) !== blocked) return false;
+    if (since && log.timestamp < since.replace('T', ' ')) return false;
+    if (host) {
+        try {
+            if (new URL(log.url).hostname !== host.toLowerCase()) return false;
+        } catch (error) {
+            return false;
+        }
+    }
+    return true;
+}
+
+function cell(className, text) {
+    const td = document.createElement('td');
+    td.className = className;
+    td.textContent = text;
+    return td;
+}
+
+function logRow(log) {
+    const row = document.createElement('tr');
+    if (log.blocked === 1) row.className = 'blocked-row';
+    row.append(
+        cell('timestamp', log.timestamp),
+        cell('client', log.client_ip),
+        cell('url', log.url),
+        cell('method', log.method),
+        cell(`status status-${log.status_code}`, log.status_code)
+    );
+
+    const blocked = cell('blocked', '');
+    const badge = document.createElement('span');
+    if (log.blocked === 1) {
+        badge.className = 'badge badge-blocked';
+        badge.textContent = '🚫 Blocked';
+        blocked.append(badge);
+        if (log.block_rule) {
+            badge.title = log.block_rule;
+            const rule = document.createElement('div');
+            rule.className = 'block-rule';
+            rule.textContent = log.block_rule;
+            blocked.append(rule);
+        }
+    } else {
+        badge.className = 'badge badge-allowed';
+        badge.textContent = '✅ Allowed';
+        blocked.append(badge);
+    }
+    row.append(blocked);
+    return row;
+}
+
+function showLogs(logs) {
+    const empty = table.querySelector('.empty-logs');
+    for (const log of logs) {
+        if (!matchesFilters(log)) continue;
+        if (empty && empty.parentNode) empty.parentNode.remove();
+        table.prepend(logRow(log));
+    }
+    while (table.rows.length > pageSize) {
+        table.deleteRow(-1);
+    }
+}
+
+// Older pages and ranges that end in the past never get new entries
+if (window.EventSource && !params.get('cursor') && !params.get('until')) {
+    new EventSource('/api/stream').addEventListener('logs', event => showLogs(JSON.parse(event.data)));
+}
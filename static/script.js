@@ -1,31 +1,45 @@
-// Auto-refresh stats every 3 seconds
+// Show stats; data may hold only the values that changed
+function showStats(data) {
+    const fields = {
+        'total-requests': data.total_requests,
+        'blocked-requests': data.blocked_requests,
+        'cached-items': data.cached_items,
+        'blocked-sites-count': data.blocked_sites_count
+    };
+    for (const [id, value] of Object.entries(fields)) {
+        if (value !== undefined) {
+            document.getElementById(id).textContent = value;
+        }
+    }
+    
+    // Update server status
+    if (data.server_running === undefined) return;
+    const statusIndicator = document.querySelector('.status-indicator');
+    const statusText = document.querySelector('.status-text');
+    if (data.server_running) {
+        statusIndicator.classList.add('running');
+        statusIndicator.classList.remove('stopped');
+        statusText.textContent = 'RUNNING';
+    } else {
+        statusIndicator.classList.add('stopped');
+        statusIndicator.classList.remove('running');
+        statusText.textContent = 'STOPPED';
+    }
+}
+
 function updateStats() {
     fetch('/api/stats')
         .then(response => response.json())
-        .then(data => {
-            document.getElementById('total-requests').textContent = data.total_requests;
-            document.getElementById('blocked-requests').textContent = data.blocked_requests;
-            document.getElementById('cached-items').textContent = data.cached_items;
-            document.getElementById('blocked-sites-count').textContent = data.blocked_sites_count;
-            
-            // Update server status
-            const statusIndicator = document.querySelector('.status-indicator');
-            const statusText = document.querySelector('.status-text');
-            if (data.server_running) {
-                statusIndicator.classList.add('running');
-                statusIndicator.classList.remove('stopped');
-                statusText.textContent = 'RUNNING';
-            } else {
-                statusIndicator.classList.add('stopped');
-                statusIndicator.classList.remove('running');
-                statusText.textContent = 'STOPPED';
-            }
-        })
+        .then(showStats)
         .catch(error => console.error('Error updating stats:', error));
 }
 
-// Start auto-refresh
-setInterval(updateStats, 3000);
+// Live updates pushed by the server; poll only where EventSource is missing
+if (window.EventSource) {
+    new EventSource('/api/stream').addEventListener('stats', event => showStats(JSON.parse(event.data)));
+} else {
+    setInterval(updateStats, 3000);
+}
 
 // Show toast notification
 function showToast(message, type = 'info') {
@@ -127,6 +141,33 @@ function unblockSite(pattern) {
     });
 }
 
+// Bulk import a hosts file or domain list
+function importBlocklist() {
+    const file = document.getElementById('blocklistFile').files[0];
+    if (!file) {
+        showToast('Please choose a file to import', 'error');
+        return;
+    }
+    const form = new FormData();
+    form.append('file', file);
+    form.append('replace', document.getElementById('blocklistReplace').checked ? '1' : '0');
+
+    fetch('/api/blocklist/import', { method: 'POST', body: form })
+    .then(response => response.json())
+    .then(data => {
+        if (data.status === 'success') {
+            showToast(data.message, 'success');
+            setTimeout(() => location.reload(), 1500);
+        } else {
+            showToast(data.message, 'error');
+        }
+    })
+    .catch(error => {
+        showToast('Failed to import block list', 'error');
+        console.error('Error:', error);
+    });
+}
+
 // Quick block
 function quickBlock(site) {
     fetch('/api/quick-block', {
@@ -0,0 +1,33 @@
+// Show toast notification
+function showToast(message, type = 'info') {
+    const toast = document.getElementById('toast');
+    toast.textContent = message;
+    toast.className = `toast show ${type}`;
+    
+    setTimeout(() => {
+        toast.classList.remove('show');
+    }, 3000);
+}
+
+// Save rate limits
+function saveRateLimits(event) {
+    event.preventDefault();
+    const limits = {};
+    for (const input of event.target.querySelectorAll('input')) {
+        limits[input.name] = input.value === '' ? 0 : Number(input.value);
+    }
+    
+    fetch('/api/settings', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(limits)
+    })
+    .then(response => response.json())
+    .then(data => {
+        showToast(data.message, data.status === 'success' ? 'success' : 'error');
+    })
+    .catch(error => {
+        showToast('Failed to save settings', 'error');
+        console.error('Error:', error);
+    });
+}
@@ -0,0 +1,153 @@
+"""Bidirectional byte relay for CONNECT tunnels"""
+
+import errno
+import os
+import selectors
+import socket
+
+SPLICE_AVAILABLE = hasattr(os, 'splice')
+F_SETPIPE_SZ = 1031  # Linux fcntl command to resize a pipe
+
+
+class _Direction:
+    """One half of a tunnel: bytes read from src are written to dst"""
+
+    def __init__(self, src, dst, buffer_size):
+        self.src = src
+        self.dst = dst
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.transferred = 0
+        self.open = True
+
+    def pump(self):
+        """Move whatever is readable; returns False once src reached EOF"""
+        received = self.src.recv_into(self.buffer)
+        if not received:
+            return False
+        self.dst.sendall(self.view[:received])
+        self.transferred += received
+        return True
+
+    def close(self):
+        pass
+
+
+class _SpliceDirection(_Direction):
+    """Moves bytes socket -> pipe -> socket in the kernel, never through Python"""
+
+    def __init__(self, src, dst, buffer_size):
+        self.src = src
+        self.dst = dst
+        self.buffer_size = buffer_size
+        self.transferred = 0
+        self.open = True
+        self.pipe_r, self.pipe_w = os.pipe()
+        try:
+            import fcntl
+            fcntl.fcntl(self.pipe_w, F_SETPIPE_SZ, buffer_size)
+        except (ImportError, OSError):
+            pass
+
+    def pump(self):
+        received = os.splice(self.src.fileno(), self.pipe_w, self.buffer_size)
+        if not received:
+            return False
+        pending = received
+        while pending:
+            try:
+                pending -= os.splice(self.pipe_r, self.dst.fileno(), pending)
+            except BlockingIOError:
+                _wait_writable(self.dst)
+        self.transferred += received
+        return True
+
+    def close(self):
+        if self.pipe_r is not None:
+            os.close(self.pipe_r)
+            os.close(self.pipe_w)
+            self.pipe_r = self.pipe_w = None
+
+
+def _wait_writable(sock):
+    with selectors.DefaultSelector() as selector:
+        selector.register(sock, selectors.EVENT_WRITE)
+        selector.select()
+
+
+def _make_directions(client_socket, target_socket, buffer_size, use_splice):
+    if use_splice and SPLICE_AVAILABLE:
+        try:
+            return (_SpliceDirection(client_socket, target_socket, buffer_size),
+                    _SpliceDirection(target_socket, client_socket, buffer_size))
+        except OSError:
+            pass
+    return (_Direction(client_socket, target_socket, buffer_size),
+            _Direction(target_socket, client_socket, buffer_size))
+
+
+def relay_tunnel(client_socket, target_socket, idle_timeout=60, buffer_size=256 * 1024,
+                 use_splice=True, socket_buffer=0, throttle=None):
+    """Relay bytes both ways until both sides finish or the tunnel is idle.
+
+    Writes always complete (sendall / looping splice), so a slow reader stalls
+    the tunnel instead of losing data. When one side closes, the other side's
+    write half is shut down and the remaining direction keeps flowing.
+    throttle, if given, is called with the bytes moved by each read and may
+    block, which pauses reading in both directions.
+
+    Returns (bytes client->target, bytes target->client).
+    """
+    for sock in (client_socket, target_socket):
+        sock.settimeout(None)
+        if socket_buffer:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, socket_buffer)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, socket_buffer)
+
+    directions = dict(zip(
+        (client_socket, target_socket),
+        _make_directions(client_socket, target_socket, buffer_size, use_splice)
+    ))
+    # A selector, not select(): a busy proxy has descriptors past FD_SETSIZE
+    selector = selectors.DefaultSelector()
+    for sock in directions:
+        selector.register(sock, selectors.EVENT_READ)
+    try:
+        while any(direction.open for direction in directions.values()):
+            readable = [key.fileobj for key, _ in selector.select(idle_timeout)]
+            if not readable:
+                break
+
+            for sock in readable:
+                direction = directions[sock]
+                if not direction.open:
+                    continue
+                moved = direction.transferred
+                try:
+                    still_open = direction.pump()
+                except OSError as e:
+                    if isinstance(direction, _SpliceDirection) and e.errno == errno.EINVAL \
+                            and direction.transferred == 0:
+                        # Kernel refused splice for these sockets: fall back to copying
+                        direction.close()
+                        directions[sock] = _Direction(direction.src, direction.dst, buffer_size)
+                        continue
+                    # A reset on either side ends the whole tunnel
+                    for other in directions.values():
+                        other.open = False
+                    break
+                if throttle and direction.transferred > moved:
+                    throttle(direction.transferred - moved)
+                if not still_open:
+                    direction.open = False
+                    selector.unregister(sock)
+                    try:
+                        direction.dst.shutdown(socket.SHUT_WR)
+                    except OSError:
+                        pass
+    finally:
+        selector.close()
+        for direction in directions.values():
+            direction.close()
+
+    return directions[client_socket].transferred, directions[target_socket].transferred
@@ -1,97 +1,250 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context
+from werkzeug.serving import make_server
+import heapq
+import io
+import json
 import threading
-import time
-from proxy_server import proxy_server_instance
+import config
+from blocklist import format_blocklist, parse_blocklist
+from live_feed import LiveFeed
+from log_export import FORMATS as EXPORT_FORMATS, encode_export
+from proxy_server import get_proxy_server
 
 app = Flask(__name__)
 server_thread = None
+web_server = None
+START_TIMEOUT = 10  # Seconds /api/start waits for the proxy to accept connections
+BLOCKED_SITES_SHOWN = 500  # Blocked sites listed on the dashboard and in /api/stats
+live_feed = LiveFeed(get_proxy_server, interval=config.STREAM_INTERVAL,
+                     keepalive=config.STREAM_KEEPALIVE)
+
+@app.teardown_appcontext
+def close_database(exception=None):
+    """Close the request thread's database connection; with threaded=True every
+    request runs on a new thread, whose connection would otherwise be left open"""
+    get_proxy_server().db.close()
 
 @app.route('/')
 def index():
-    stats = proxy_server_instance.get_stats()
-    blocked_sites = sorted(list(proxy_server_instance.blocked_sites))
+    server = get_proxy_server()
+    stats = server.get_stats()
+    blocked_sites = server.blocked_sites
     return render_template('index.html', 
                          stats=stats, 
-                         blocked_sites=blocked_sites,
-                         server_running=proxy_server_instance.is_running)
+                         blocked_sites=heapq.nsmallest(BLOCKED_SITES_SHOWN, blocked_sites),
+                         blocked_sites_total=len(blocked_sites),
+                         server_running=server.is_running)
+
+def log_filters():
+    """Access log filters from the query string (shared by /logs and the export)"""
+    filters = {
+        'client_ip': request.args.get('client', '').strip() or None,
+        'host': request.args.get('host', '').strip() or None,
+        'status': request.args.get('status', type=int),
+        'since': request.args.get('since', '').strip() or None,
+        'until': request.args.get('until', '').strip() or None,
+    }
+    blocked = request.args.get('blocked', '')
+    if blocked in ('0', '1'):
+        filters['blocked'] = blocked == '1'
+    return filters
 
 @app.route('/logs')
 def logs():
-    cursor = proxy_server_instance.conn.cursor()
-    cursor.execute('''
-        SELECT client_ip, url, method, status_code, blocked, timestamp 
-        FROM access_logs 
-        ORDER BY timestamp DESC 
-        LIMIT 200
-    ''')
-    logs_data = cursor.fetchall()
-    return render_template('logs.html', logs=logs_data)
+    server = get_proxy_server()
+    try:
+        logs_data, next_cursor = server.log_store.query(
+            server.db.connection(), cursor=request.args.get('cursor') or None, **log_filters()
+        )
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Invalid time or cursor'}), 400
+    query = {key: value for key, value in request.args.items() if key != 'cursor' and value}
+    return render_template('logs.html', logs=logs_data, next_cursor=next_cursor,
+                         query=query, page_size=server.log_store.page_size)
+
+@app.route('/api/logs/export')
+def export_logs():
+    """Stream every matching log row, oldest first, as NDJSON (or ?format=csv, ?gzip=1).
+
+    Takes the /logs filters. Every row carries an id; ?after=<last id received>
+    resumes an interrupted export, or fetches only what was logged since.
+    """
+    server = get_proxy_server()
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'status': 'error', 'message': f'Unknown format {fmt}'}), 400
+    compress = request.args.get('gzip', '') in ('1', 'true', 'on')
+    try:
+        batches = server.log_store.export(
+            server.db.connection(), after=request.args.get('after') or None,
+            batch_size=config.LOG_EXPORT_BATCH_SIZE, **log_filters()
+        )
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Invalid time or export id'}), 400
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    filename = f'access_logs.{extension}'
+    if compress:
+        mimetype, filename = 'application/gzip', filename + '.gz'
+    # The batches read from this thread's connection, so keep it open until the last one
+    return Response(stream_with_context(encode_export(batches, fmt, compress)), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filename}',
+                             'X-Accel-Buffering': 'no'})
+
+@app.route('/settings')
+def settings():
+    server = get_proxy_server()
+    stats = server.get_stats()
+    traffic = sorted(stats.get('client_traffic', {}).items(), key=lambda item: item[1]['bytes'], reverse=True)
+    return render_template('settings.html', limits=server.rate_limiter.limits(), stats=stats,
+                         traffic=traffic)
+
+@app.route('/api/settings', methods=['GET', 'POST'])
+def rate_limit_settings():
+    """Current rate limits, or change them on the running proxy"""
+    server = get_proxy_server()
+    if request.method == 'GET':
+        return jsonify(server.rate_limiter.limits())
+    data = request.get_json() or {}
+    limits = server.rate_limiter.limits()
+    for name in limits:
+        try:
+            value = float(data.get(name, limits[name]) or 0)
+        except (TypeError, ValueError):
+            return jsonify({'status': 'error', 'message': f'Invalid value for {name}'}), 400
+        if value < 0:
+            return jsonify({'status': 'error', 'message': f'{name} cannot be negative'}), 400
+        limits[name] = int(value) if value.is_integer() else value
+    server.set_rate_limits(**limits)
+    return jsonify({'status': 'success', 'message': 'Rate limits updated', 'limits': limits})
 
 @app.route('/api/start', methods=['POST'])
 def start_server():
     global server_thread
-    if not proxy_server_instance.is_running:
-        server_thread = threading.Thread(target=proxy_server_instance.start_server)
-        server_thread.daemon = True
-        server_thread.start()
-        time.sleep(1)
-        return jsonify({'status': 'success', 'message': 'Proxy server started on port 8080'})
-    return jsonify({'status': 'error', 'message': 'Server already running'})
+    server = get_proxy_server()
+    if server.is_running:
+        return jsonify({'status': 'error', 'message': 'Server already running'})
+    if not server.finished.is_set():
+        return jsonify({'status': 'error', 'message': 'Server is still draining connections'})
+    server.ready.clear()
+    server_thread = threading.Thread(target=server.start_server)
+    server_thread.daemon = True
+    server_thread.start()
+    server.ready.wait(START_TIMEOUT)
+    if server.is_running:
+        return jsonify({'status': 'success',
+                        'message': f'Proxy server started on port {server.port}'})
+    error = server.start_error or 'timed out'
+    return jsonify({'status': 'error', 'message': f'Proxy server failed to start: {error}'})
 
 @app.route('/api/stop', methods=['POST'])
 def stop_server():
-    if proxy_server_instance.is_running:
-        proxy_server_instance.stop_server()
+    server = get_proxy_server()
+    if server.is_running:
+        server.stop_server()
         return jsonify({'status': 'success', 'message': 'Proxy server stopped'})
     return jsonify({'status': 'error', 'message': 'Server not running'})
 
 @app.route('/api/block-site', methods=['POST'])
 def block_site():
+    server = get_proxy_server()
     data = request.get_json()
     pattern = data.get('pattern', '').strip()
     
     if not pattern:
         return jsonify({'status': 'error', 'message': 'Please enter a website URL'})
     
-    if proxy_server_instance.add_blocked_site(pattern):
+    if server.add_blocked_site(pattern):
         return jsonify({'status': 'success', 'message': f'Blocked: {pattern}'})
     else:
         return jsonify({'status': 'error', 'message': f'Already blocked: {pattern}'})
 
 @app.route('/api/unblock-site', methods=['POST'])
 def unblock_site():
+    server = get_proxy_server()
     data = request.get_json()
     pattern = data.get('pattern', '').strip()
     
-    if proxy_server_instance.remove_blocked_site(pattern):
+    if server.remove_blocked_site(pattern):
         return jsonify({'status': 'success', 'message': f'Unblocked: {pattern}'})
     else:
         return jsonify({'status': 'error', 'message': f'Not found: {pattern}'})
 
+@app.route('/api/blocklist/import', methods=['POST'])
+def import_blocklist():
+    """Bulk import a hosts file or a list of domains (uploaded as 'file' or sent as the body)"""
+    server = get_proxy_server()
+    upload = request.files.get('file')
+    if upload:
+        lines = io.TextIOWrapper(upload.stream, encoding='utf-8', errors='replace')
+    else:
+        lines = request.get_data(as_text=True).splitlines()
+    replace = request.values.get('replace', '') in ('1', 'true', 'on')
+    patterns = set(parse_blocklist(lines))
+    if replace and not patterns:
+        # Most likely an empty or unreadable upload, not a request to unblock everything
+        return jsonify({'status': 'error', 'message': 'No patterns found, block list left unchanged'}), 400
+    added, removed = server.import_blocked_sites(patterns, replace=replace)
+    return jsonify({'status': 'success',
+                    'message': f'Imported block list: {added} added, {removed} removed',
+                    'added': added,
+                    'removed': removed,
+                    'blocked_sites_count': len(server.blocked_sites)})
+
+@app.route('/api/blocklist/export')
+def export_blocklist():
+    """Download the block list (?format=hosts for a hosts file)"""
+    server = get_proxy_server()
+    hosts = request.args.get('format') == 'hosts'
+    filename = 'blocklist.hosts' if hosts else 'blocklist.txt'
+    return Response(format_blocklist(server.blocked_sites, hosts=hosts),
+                    mimetype='text/plain',
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint"""
+    server = get_proxy_server()
+    return Response(server.metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/stats')
 def get_stats():
-    stats = proxy_server_instance.get_stats()
-    stats['server_running'] = proxy_server_instance.is_running
-    stats['blocked_sites'] = sorted(list(proxy_server_instance.blocked_sites))
+    """Stats, with the first BLOCKED_SITES_SHOWN blocked sites (all of them: /api/blocklist/export)"""
+    server = get_proxy_server()
+    stats = server.get_stats()
+    stats['server_running'] = server.is_running
+    stats['blocked_sites'] = heapq.nsmallest(BLOCKED_SITES_SHOWN, server.blocked_sites)
     return jsonify(stats)
 
+@app.route('/api/stream')
+def stream():
+    """Server-Sent Events: a stats snapshot, then 'stats' deltas and new 'logs' entries"""
+    def events():
+        yield f"retry: {config.STREAM_INTERVAL * 1000 * 3}\n\n"
+        for event in live_feed.subscribe():
+            if event is None:
+                yield ": keep-alive\n\n"
+                continue
+            event_id, kind, data = event
+            yield f"id: {event_id}\nevent: {kind}\ndata: {json.dumps(data)}\n\n"
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/clear-cache', methods=['POST'])
 def clear_cache():
-    cursor = proxy_server_instance.conn.cursor()
-    cursor.execute("DELETE FROM cache")
-    proxy_server_instance.conn.commit()
+    server = get_proxy_server()
+    server.clear_cache()
     return jsonify({'status': 'success', 'message': 'Cache cleared successfully'})
 
 @app.route('/api/clear-logs', methods=['POST'])
 def clear_logs():
-    cursor = proxy_server_instance.conn.cursor()
-    cursor.execute("DELETE FROM access_logs")
-    proxy_server_instance.conn.commit()
+    server = get_proxy_server()
+    server.clear_logs()
     return jsonify({'status': 'success', 'message': 'Logs cleared successfully'})
 
 @app.route('/api/quick-block', methods=['POST'])
 def quick_block():
     """Quick block popular websites"""
+    server = get_proxy_server()
     data = request.get_json()
     site = data.get('site', '')
     
@@ -104,16 +257,18 @@ def quick_block():
     
     if site in site_mappings:
         pattern = site_mappings[site]
-        if proxy_server_instance.add_blocked_site(pattern):
+        if server.add_blocked_site(pattern):
             return jsonify({'status': 'success', 'message': f'Blocked {site.title()}'})
         return jsonify({'status': 'error', 'message': f'{site.title()} already blocked'})
     
     return jsonify({'status': 'error', 'message': 'Invalid site'})
 
-def run_web_interface():
-    """Start the web interface"""
+def run_web_interface(fd=None):
+    """Start the web interface (fd: an inherited listening socket to serve on)"""
+    global web_server
     print(" Web interface: http://localhost:5000")
-    app.run(host='localhost', port=5000, debug=False, use_reloader=False)
+    web_server = make_server('localhost', 5000, app, threaded=True, fd=fd)
+    web_server.serve_forever()
 
 if __name__ == '__main__':
     run_web_interface()
\ No newline at end of file
@@ -0,0 +1,239 @@
+import multiprocessing
+import socket
+import threading
+import time
+
+import config
+from blocklist import clean_pattern
+from proxy_server import HTTPProxyServer, logger
+from proxy_worker import run_worker
+
+# Totals that must survive a worker exiting (its rows are already in the database)
+RETAINED_STATS = ('total_requests', 'blocked_requests', 'logs_dropped')
+
+# Stats that describe shared state and are taken from the supervisor as they are
+SHARED_STATS = ('cached_items', 'blocked_sites_count')
+
+
+def merge_traffic(merged, traffic):
+    """Add one process's per-client traffic (see RateLimiter.get_stats) into merged"""
+    for client_ip, usage in traffic.items():
+        total = merged.setdefault(client_ip, {'bytes': 0, 'requests': 0, 'throttled': False})
+        total['bytes'] += usage['bytes']
+        total['requests'] += usage['requests']
+        total['throttled'] = total['throttled'] or usage['throttled']
+
+
+def merge_stats(base, snapshots):
+    """Add worker counters onto the supervisor's stats and recompute the ratios"""
+    merged = dict(base)
+    merged['client_traffic'] = {}
+    merge_traffic(merged['client_traffic'], base.get('client_traffic', {}))
+    for snapshot in snapshots:
+        merge_traffic(merged['client_traffic'], snapshot.get('client_traffic', {}))
+        for name, value in snapshot.items():
+            if name in SHARED_STATS or name.endswith('_ratio') or isinstance(value, bool) \
+                    or not isinstance(value, (int, float)):
+                continue
+            merged[name] = merged.get(name, 0) + value
+
+    lookups = merged.get('cache_hits', 0) + merged.get('cache_revalidations', 0) + merged.get('cache_misses', 0)
+    served = merged.get('cache_hits', 0) + merged.get('cache_revalidations', 0)
+    merged['cache_hit_ratio'] = round(served / lookups, 3) if lookups else 0
+    lookups = merged.get('dns_hits', 0) + merged.get('dns_negative_hits', 0) + merged.get('dns_misses', 0)
+    answered = merged.get('dns_hits', 0) + merged.get('dns_negative_hits', 0)
+    merged['dns_hit_ratio'] = round(answered / lookups, 3) if lookups else 0
+    lookups = merged.get('block_cache_hits', 0) + merged.get('block_cache_misses', 0)
+    merged['block_cache_hit_ratio'] = round(merged.get('block_cache_hits', 0) / lookups, 3) if lookups else 0
+    return merged
+
+
+class WorkerSlot:
+    """One worker process and the queue used to send it commands"""
+
+    def __init__(self, index, process, commands):
+        self.index = index
+        self.process = process
+        self.commands = commands
+        self.started = time.monotonic()
+
+
+class MultiProcessProxyServer(HTTPProxyServer):
+    """Supervisor that runs the proxy engine in several worker processes.
+
+    Every worker binds the proxy port with SO_REUSEPORT and runs its own
+    accept loop, so the kernel spreads connections across processes and the
+    GIL no longer caps the proxy at one core. This process keeps the database,
+    the web UI and log retention. It restarts workers that die, tells them to
+    apply block list changes or clear their caches when those change, and adds
+    their periodic stats reports into get_stats.
+    """
+
+    def __init__(self, host='localhost', port=8080, workers=2, engine='threaded'):
+        super().__init__(host, port)
+        self.worker_count = workers
+        self.engine = engine
+        self.context = multiprocessing.get_context('spawn')
+        self.events = self.context.Queue()
+        self.slots = []
+        self.snapshots = {}
+        self.retired = dict.fromkeys(RETAINED_STATS, 0)
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.stopped = threading.Event()
+        self.stopped.set()
+        self.collector = threading.Thread(target=self.collect_stats, name='worker-stats', daemon=True)
+        self.collector.start()
+
+    def start_server(self):
+        """Start the workers and supervise them until stop_server is called"""
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            self.start_error = "SO_REUSEPORT is not available, set PROXY_WORKERS = 1"
+            print(f"Server error: {self.start_error}")
+            self.ready.set()
+            return
+        self.stopping.clear()
+        self.stopped.clear()
+        self.ready.clear()
+        self.finished.clear()
+        self.start_error = None
+        try:
+            self.slots = [self.spawn(index) for index in range(self.worker_count)]
+            self.is_running = True
+            print(f"✅ Proxy server running on {self.host}:{self.port} "
+                  f"with {self.worker_count} {self.engine} workers")
+
+            while not self.stopping.wait(1):
+                for index, slot in enumerate(self.slots):
+                    if slot.process.is_alive():
+                        continue
+                    logger.warning("Worker %d exited with code %s, restarting",
+                                   index, slot.process.exitcode)
+                    self.retire(index)
+                    # Back off if the worker keeps dying straight after start
+                    if time.monotonic() - slot.started < 1:
+                        time.sleep(1)
+                    self.slots[index] = self.spawn(index)
+        except Exception as e:
+            self.start_error = str(e)
+            print(f"Server error: {e}")
+        finally:
+            self.drain()
+            self.is_running = False
+            self.stopped.set()
+            self.ready.set()
+            self.finished.set()
+
+    def stop_server(self):
+        """Drain the workers and wait for them to exit"""
+        self.is_running = False
+        self.stopping.set()
+        self.stopped.wait(config.DRAIN_TIMEOUT + 10)
+        self.log_writer.flush()
+        print("🛑 Proxy server stopped")
+
+    def spawn(self, index):
+        commands = self.context.Queue()
+        settings = {name: getattr(config, name) for name in dir(config) if name.isupper()}
+        settings.update({
+            'PROXY_WORKERS': 1,
+            'PROXY_ENGINE': self.engine,
+            'PROXY_HOST': self.host,
+            'PROXY_PORT': self.port,
+            # The supervisor owns retention and the totals already in the database
+            'LOG_RETENTION_INTERVAL': 0,
+            'LOG_REBUILD_TOTALS': False,
+        })
+        process = self.context.Process(
+            target=run_worker, args=(index, settings, commands, self.events),
+            name=f'proxy-worker-{index}', daemon=True
+        )
+        process.start()
+        return WorkerSlot(index, process, commands)
+
+    def drain(self):
+        """Ask every worker to stop, then kill any that outlive the drain timeout"""
+        self.broadcast(('stop',))
+        deadline = time.monotonic() + config.DRAIN_TIMEOUT + 5
+        for slot in self.slots:
+            slot.process.join(max(0, deadline - time.monotonic()))
+            if slot.process.is_alive():
+                logger.warning("Worker %d did not drain in time, terminating", slot.index)
+                slot.process.terminate()
+                slot.process.join(5)
+        # Give the collector a moment to fold in the final reports
+        time.sleep(0.2)
+        for slot in self.slots:
+            self.retire(slot.index)
+        self.slots = []
+
+    def broadcast(self, command):
+        for slot in self.slots:
+            if slot.process.is_alive():
+                slot.commands.put(command)
+
+    def retire(self, index):
+        """Keep a gone worker's totals so the dashboard numbers never go backwards"""
+        with self.lock:
+            snapshot = self.snapshots.pop(index, None)
+            if snapshot:
+                for name in RETAINED_STATS:
+                    self.retired[name] += snapshot.get(name, 0)
+
+    def collect_stats(self):
+        while True:
+            kind, index, snapshot = self.events.get()
+            if kind == 'ready':
+                # The port is served as soon as one worker accepts on it
+                self.ready.set()
+                continue
+            if kind == 'logs':
+                self.log_writer.remember(snapshot)
+                continue
+            with self.lock:
+                self.snapshots[index] = snapshot
+            if kind == 'final':
+                self.retire(index)
+
+    def add_blocked_site(self, pattern):
+        added = super().add_blocked_site(pattern)
+        if added:
+            # Workers apply the one pattern instead of reloading the whole list
+            self.broadcast(('blocklist_change', [clean_pattern(pattern)], []))
+        return added
+
+    def remove_blocked_site(self, pattern):
+        removed = super().remove_blocked_site(pattern)
+        if removed:
+            self.broadcast(('blocklist_change', [], [pattern.strip().lower()]))
+        return removed
+
+    def import_blocked_sites(self, patterns, replace=False):
+        added, removed = super().import_blocked_sites(patterns, replace)
+        if added or removed:
+            self.broadcast(('reload_blocklist',))
+        return added, removed
+
+    def clear_cache(self):
+        super().clear_cache()
+        self.broadcast(('clear_cache',))
+
+    def set_rate_limits(self, client_bytes, client_requests, host_bytes, host_requests):
+        super().set_rate_limits(client_bytes, client_requests, host_bytes, host_requests)
+        # Restarted workers pick the new limits up from config
+        self.broadcast(('rate_limits', self.rate_limit_settings()))
+
+    def clear_logs(self):
+        super().clear_logs()
+        with self.lock:
+            for name in ('total_requests', 'blocked_requests'):
+                self.retired[name] = 0
+        self.broadcast(('reset_totals',))
+
+    def get_stats(self):
+        with self.lock:
+            snapshots = list(self.snapshots.values()) + [dict(self.retired)]
+            workers = len(self.snapshots)
+        stats = merge_stats(super().get_stats(), snapshots)
+        stats['workers'] = workers
+        return stats